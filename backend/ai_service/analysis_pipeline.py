@@ -0,0 +1,216 @@
+"""
+Background analysis of ended conversations
+Jobs run on Celery when ANALYSIS_BACKEND=celery, otherwise on an in-process
+worker thread; either way a conversation is analyzed at most once at a time
+"""
+import os
+import queue
+import threading
+from typing import Dict, Optional
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from api.models import Conversation
+from .conversation_analyzer import ConversationAnalyzer
+from .conversation_embeddings import refresh_conversation_embedding
+
+
+BACKEND_THREAD = 'thread'
+BACKEND_CELERY = 'celery'
+
+
+def get_analysis_backend() -> str:
+    return os.getenv('ANALYSIS_BACKEND', BACKEND_THREAD).lower()
+
+
+def get_max_retries() -> int:
+    return int(os.getenv('ANALYSIS_MAX_RETRIES', '3'))
+
+
+def get_retry_backoff(attempt: int) -> float:
+    """Seconds to wait before retry number `attempt` (0-based), doubling each time"""
+    return float(os.getenv('ANALYSIS_RETRY_BACKOFF', '5')) * (2 ** attempt)
+
+
+def request_analysis(conversation: Conversation, force: bool = False) -> str:
+    """
+    Queue analysis of a conversation and return its analysis status
+
+    Idempotent: while an analysis is pending or running no second job is
+    queued, and the job itself skips the LLM when the stored analysis
+    matches the current messages. `force` re-queues anyway (e.g. for a job
+    lost in a restart) and re-analyzes unchanged conversations.
+    """
+    pending = Conversation.objects.filter(id=conversation.id)
+    if not force:
+        pending = pending.exclude(analysis_status__in=['pending', 'running'])
+    if pending.update(analysis_status='pending', analysis_error=''):
+        conversation_id = str(conversation.id)
+        # Workers must not pick the job up before the status is visible
+        transaction.on_commit(lambda: enqueue_analysis(conversation_id, force))
+    conversation.refresh_from_db(fields=['analysis_status', 'analysis_error'])
+    return conversation.analysis_status
+
+
+def enqueue_analysis(conversation_id: str, force: bool = False):
+    """Hand a pending analysis to the configured backend"""
+    if get_analysis_backend() == BACKEND_CELERY:
+        try:
+            from .tasks import analyze_conversation_task
+            analyze_conversation_task.delay(conversation_id, force)
+            return
+        except Exception as e:
+            print(f"Warning: Could not queue analysis on Celery, running in-process: {e}")
+    get_analysis_worker().submit(conversation_id, force)
+
+
+def run_analysis(conversation_id: str, force: bool = False) -> bool:
+    """
+    Analyze a pending conversation and store the results
+
+    Returns False without doing anything when the job is not pending
+    (already running elsewhere, completed, or never requested), so a
+    duplicate delivery is harmless. The analyzer itself skips the LLM
+    when the stored analysis is current, unless `force` is set. On error
+    the job is put back to pending for a retry and the exception is
+    re-raised.
+    """
+    claimed = Conversation.objects.filter(
+        id=conversation_id, analysis_status='pending'
+    ).update(analysis_status='running')
+    if not claimed:
+        return False
+
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+        ConversationAnalyzer().analyze_and_save(conversation, force=force)
+        # Searchable by its new summary; a no-op when the summary is unchanged
+        refresh_conversation_embedding(conversation)
+        Conversation.objects.filter(id=conversation_id).update(
+            analysis_status='completed',
+            analysis_error='',
+            updated_at=timezone.now()
+        )
+    except Exception as e:
+        Conversation.objects.filter(id=conversation_id).update(
+            analysis_status='pending', analysis_error=str(e)
+        )
+        raise
+
+    notify_analysis(conversation_id, 'completed', conversation.summary)
+    return True
+
+
+def mark_failed(conversation_id: str, error: Exception):
+    """Give up on an analysis after its last retry"""
+    print(f"Error generating analysis for {conversation_id}: {error}")
+    Conversation.objects.filter(id=conversation_id).update(
+        analysis_status='failed', analysis_error=str(error)
+    )
+    # Without a summary the conversation is still searchable by its opening messages
+    conversation = Conversation.objects.filter(id=conversation_id).first()
+    if conversation:
+        refresh_conversation_embedding(conversation)
+    notify_analysis(conversation_id, 'failed')
+
+
+def notify_analysis(conversation_id: str, analysis_status: str, summary: str = ''):
+    """Send an analysis_complete event to clients connected to the conversation"""
+    try:
+        channel_layer = get_channel_layer()
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(
+                f'chat_{conversation_id}',
+                {
+                    'type': 'analysis_complete',
+                    'conversation_id': conversation_id,
+                    'status': analysis_status,
+                    'summary': summary,
+                }
+            )
+    except Exception as e:
+        print(f"Warning: Could not send analysis notification: {e}")
+
+
+class AnalysisWorker:
+    """In-process analysis queue served by a single daemon thread"""
+
+    def __init__(self):
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'completed': 0, 'skipped': 0, 'retries': 0, 'failed': 0}
+
+    def submit(self, conversation_id: str, force: bool = False) -> bool:
+        """Queue a conversation unless it is already queued or retrying"""
+        with self._lock:
+            if conversation_id in self._queued:
+                return False
+            self._queued.add(conversation_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='analysis-worker', daemon=True)
+                self._thread.start()
+        self._queue.put((conversation_id, 0, force))
+        return True
+
+    def _run(self):
+        while True:
+            conversation_id, attempt, force = self._queue.get()
+            retrying = False
+            close_old_connections()
+            try:
+                ran = run_analysis(conversation_id, force)
+                with self._lock:
+                    self._stats['completed' if ran else 'skipped'] += 1
+            except Exception as e:
+                if attempt < get_max_retries():
+                    retrying = True
+                    with self._lock:
+                        self._stats['retries'] += 1
+                    timer = threading.Timer(
+                        get_retry_backoff(attempt), self._queue.put,
+                        args=((conversation_id, attempt + 1, force),)
+                    )
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    with self._lock:
+                        self._stats['failed'] += 1
+                    try:
+                        mark_failed(conversation_id, e)
+                    except Exception as mark_error:
+                        print(f"Error recording failed analysis: {mark_error}")
+            finally:
+                close_old_connections()
+                if not retrying:
+                    with self._lock:
+                        self._queued.discard(conversation_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, queued=len(self._queued))
+
+
+# Global analysis worker instance
+_analysis_worker = None
+_analysis_worker_lock = threading.Lock()
+
+
+def get_analysis_worker() -> AnalysisWorker:
+    """Get or create global analysis worker instance"""
+    global _analysis_worker
+    if _analysis_worker is None:
+        with _analysis_worker_lock:
+            if _analysis_worker is None:
+                _analysis_worker = AnalysisWorker()
+    return _analysis_worker
+
+
+def get_analysis_stats() -> Dict:
+    """Backend and, for the in-process worker, its counters"""
+    stats = {'backend': get_analysis_backend()}
+    if _analysis_worker is not None:
+        stats['worker'] = _analysis_worker.stats()
+    return stats
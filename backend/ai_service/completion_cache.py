@@ -0,0 +1,187 @@
+"""
+Completion cache for repeated low-temperature generate() calls
+An in-process LRU tier in front of a persistent SQLite tier
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from django.conf import settings
+
+
+class CompletionCache:
+    """Two-tier completion cache keyed by model, prompt hash and sampling params"""
+
+    def __init__(self, path: Optional[str], memory_entries: int = 1024,
+                 max_disk_entries: int = 100000, ttl_seconds: float = 7 * 24 * 3600):
+        """
+        Initialize completion cache
+
+        Args:
+            path: SQLite file for the persistent tier, None for memory only
+            memory_entries: Entries kept in the in-process LRU
+            max_disk_entries: Entries kept on disk before the least recently used are deleted
+            ttl_seconds: Age after which an entry is ignored and removed, 0 to keep forever
+        """
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts_since_trim = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if self.path:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self._connection().execute(
+                "CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)"
+            )
+
+    @staticmethod
+    def make_key(model_id: str, prompt: str, params: Dict) -> str:
+        """Hash the model id, prompt and sampling parameters into a cache key"""
+        payload = json.dumps(
+            {'model': model_id, 'prompt': prompt, 'params': params},
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached completion or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+        if self.path:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, expires_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                value, expires_at = row
+                if expires_at is None or expires_at > now:
+                    conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._remember(key, value, expires_at)
+                    with self._lock:
+                        self._stats['disk_hits'] += 1
+                    return value
+                conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, key: str, value: str):
+        """Store a completion in both tiers"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        self._remember(key, value, expires_at)
+
+        if self.path:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)", (key, value, expires_at, now)
+            )
+            with self._lock:
+                self._puts_since_trim += 1
+                trim = self._puts_since_trim >= 100
+                if trim:
+                    self._puts_since_trim = 0
+            if trim:
+                self._trim_disk()
+
+        with self._lock:
+            self._stats['stores'] += 1
+
+    def _remember(self, key: str, value: str, expires_at: Optional[float]):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _trim_disk(self):
+        """Delete expired entries and the least recently used ones beyond max_disk_entries"""
+        conn = self._connection()
+        conn.execute("DELETE FROM completions WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                     (time.time(),))
+        count = conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY accessed_at LIMIT ?)", (excess,)
+            )
+            with self._lock:
+                self._stats['evictions'] += excess
+
+    def _connection(self) -> sqlite3.Connection:
+        """SQLite connections cannot be shared across threads, keep one per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+def is_enabled() -> bool:
+    return os.getenv('LLM_COMPLETION_CACHE', 'false').lower() == 'true'
+
+
+def max_cached_temperature() -> float:
+    """Calls sampled above this temperature are not cached by default"""
+    return float(os.getenv('LLM_COMPLETION_CACHE_MAX_TEMPERATURE', '0.5'))
+
+
+# Global completion cache instance
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """Get or create global completion cache, None unless LLM_COMPLETION_CACHE is enabled"""
+    global _completion_cache
+    if not is_enabled():
+        return None
+    if _completion_cache is None:
+        with _completion_cache_lock:
+            if _completion_cache is None:
+                path = os.getenv(
+                    'LLM_COMPLETION_CACHE_PATH',
+                    os.path.join(settings.BASE_DIR, 'llm_cache.sqlite3')
+                )
+                _completion_cache = CompletionCache(
+                    path=path or None,
+                    memory_entries=int(os.getenv('LLM_COMPLETION_CACHE_MEMORY_ENTRIES', '1024')),
+                    max_disk_entries=int(os.getenv('LLM_COMPLETION_CACHE_MAX_ENTRIES', '100000')),
+                    ttl_seconds=float(os.getenv('LLM_COMPLETION_CACHE_TTL', str(7 * 24 * 3600))),
+                )
+    return _completion_cache
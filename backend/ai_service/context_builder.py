@@ -0,0 +1,135 @@
+"""
+Token-budget-aware context assembly for chat prompts
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Sequence, Tuple
+
+
+# Tokens kept free for BOS/template tokens and tokenizer boundary effects
+SAFETY_MARGIN_TOKENS = 16
+
+# A reply is not shortened below this to make room for a long new message
+MIN_RESPONSE_TOKENS = 64
+
+# The oldest kept message is aligned to a multiple of this many messages,
+# so consecutive turns share a prompt prefix (see LLMClient keep_state)
+WINDOW_STEP = 6
+
+
+class TokenCountCache:
+    """Bounded LRU of per-message token counts keyed by model and content"""
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_count(self, key: tuple, count: Callable[[], int]) -> int:
+        with self._lock:
+            value = self._counts.get(key)
+            if value is not None:
+                self._counts.move_to_end(key)
+                return value
+        value = count()
+        with self._lock:
+            self._counts[key] = value
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return value
+
+
+_token_counts = TokenCountCache()
+
+
+def render_turn(message) -> str:
+    """Render a stored message the same way the chat prompt renders the new turn"""
+    role = 'User' if message.sender == 'user' else 'Assistant'
+    return f"{role}: {message.content}"
+
+
+class ContextBuilder:
+    """Pack the most recent turns into whatever room the context window leaves"""
+
+    def __init__(self, llm_client, render: Callable = render_turn):
+        """
+        Initialize context builder
+
+        Args:
+            llm_client: Client whose tokenizer and context window are used
+            render: Turns a message into its prompt line
+        """
+        self.llm_client = llm_client
+        self.render = render
+
+    def message_tokens(self, message) -> int:
+        """Token count of a rendered message, cached by message id and content"""
+        line = self.render(message)
+        digest = hashlib.sha1(line.encode('utf-8')).hexdigest()
+        key = (self.llm_client.model_id, str(message.id), digest)
+        # +1 for the newline joining turns
+        return _token_counts.get_or_count(key, lambda: self.llm_client.count_tokens(line) + 1)
+
+    def budget(self, fixed_text: str, max_tokens: int) -> int:
+        """Tokens left for history once the fixed prompt parts and the reply are reserved"""
+        reserved = self.llm_client.count_tokens(fixed_text) + max_tokens + SAFETY_MARGIN_TOKENS
+        return max(0, self.llm_client.context_window - reserved)
+
+    def truncate(self, text: str, budget: int) -> str:
+        """The start of `text` that fits `budget` tokens"""
+        if budget <= 0:
+            return ""
+        tokens = self.llm_client.count_tokens(text)
+        while tokens > budget:
+            # Proportional cut with a little slack for uneven token lengths
+            text = text[:int(len(text) * budget / tokens * 0.9)]
+            tokens = self.llm_client.count_tokens(text)
+        return text
+
+    def fit_turn(self, fixed_text: str, text: str, max_tokens: int) -> Tuple[str, int]:
+        """
+        The new turn's text and reply length that fit the context window
+
+        When `fixed_text`, `text` and a reply of `max_tokens` do not fit
+        together, the reply is shortened first (down to MIN_RESPONSE_TOKENS),
+        then `text` is cut to the room that is left.
+        """
+        room = max(0, self.llm_client.context_window - self.llm_client.count_tokens(fixed_text)
+                   - SAFETY_MARGIN_TOKENS)
+        text_tokens = self.llm_client.count_tokens(text)
+        if text_tokens + max_tokens <= room:
+            return text, max_tokens
+        max_tokens = max(1, min(max_tokens, max(room - text_tokens, MIN_RESPONSE_TOKENS), room))
+        if text_tokens + max_tokens > room:
+            text = self.truncate(text, room - max_tokens)
+        return text, max_tokens
+
+    def select(self, messages: Sequence, budget: int) -> List:
+        """
+        Newest-first selection of the messages that fit `budget` tokens
+
+        The cut-off is then moved forward to a WINDOW_STEP boundary, so the
+        start of the history only changes every few turns instead of every
+        turn, keeping the prompt append-only in between.
+        """
+        messages = [msg for msg in messages if msg.content]
+        used = 0
+        start = len(messages)
+        while start > 0:
+            tokens = self.message_tokens(messages[start - 1])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start -= 1
+
+        if start > 0 and start % WINDOW_STEP:
+            aligned = start + WINDOW_STEP - start % WINDOW_STEP
+            if aligned < len(messages):
+                start = aligned
+        return messages[start:]
+
+    def build(self, messages: Sequence, fixed_text: str, max_tokens: int) -> str:
+        """Return the rendered history that fits next to `fixed_text` and the reply"""
+        selected = self.select(messages, self.budget(fixed_text, max_tokens))
+        return "\n".join(self.render(msg) for msg in selected)
@@ -1,179 +1,449 @@
 """
 Conversation analyzer for generating summaries, extracting topics, sentiment analysis, etc.
 """
-from typing import Dict, List, Optional
-from api.models import Conversation, Message
+import os
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from django.db import transaction
+from django.utils import timezone
+from api.models import Conversation, ConversationAnalysis, Message
 from .llm_client import get_llm_client
+from .inference_scheduler import PRIORITY_BACKGROUND
+from .model_registry import ROLE_ANALYSIS
+from .rolling_summary import RollingSummarizer, render_messages
+from .fast_analyzers import TIER_FAST, TIER_LLM, get_analysis_tier, get_fast_analyzer
+
+
+# Bump whenever prompts or parsing change so stored analyses are recomputed
+ANALYZER_VERSION = '3'
+
+# Messages included in the prompt of every task except the summary
+TASK_MESSAGE_LIMIT = 20
+
+# Task -> instruction, answer label and generation settings. Prompts start
+# with the conversation so the tasks of one analysis share a prompt prefix.
+ANALYSIS_TASKS = {
+    'summary': {
+        'instruction': """Please provide a concise summary of the conversation above.
+Focus on the main topics discussed, key decisions made, and important information shared.""",
+        'label': 'Summary',
+        'max_tokens': 256,
+        'temperature': 0.5,
+        'message_limit': None,
+    },
+    'topics': {
+        'instruction': """Extract the main topics discussed in the conversation above.
+Return only a comma-separated list of topics, nothing else.""",
+        'label': 'Topics',
+        'max_tokens': 128,
+        'temperature': 0.3,
+        'message_limit': TASK_MESSAGE_LIMIT,
+    },
+    'sentiment': {
+        'instruction': """Analyze the sentiment of the conversation above.
+Respond with only one word: "positive", "negative", or "neutral".""",
+        'label': 'Sentiment',
+        'max_tokens': 10,
+        'temperature': 0.2,
+        'message_limit': TASK_MESSAGE_LIMIT,
+    },
+    'action_items': {
+        'instruction': """Extract any action items, tasks, or to-dos mentioned in the conversation above.
+Return only a comma-separated list of action items, nothing else. If there are no action items, return "None".""",
+        'label': 'Action Items',
+        'max_tokens': 256,
+        'temperature': 0.3,
+        'message_limit': TASK_MESSAGE_LIMIT,
+    },
+    'key_points': {
+        'instruction': """Extract the key points or important information from the conversation above.
+Return only a comma-separated list of key points, nothing else.""",
+        'label': 'Key Points',
+        'max_tokens': 256,
+        'temperature': 0.4,
+        'message_limit': TASK_MESSAGE_LIMIT,
+    },
+}
+
+
+# Analysis modes: one schema-constrained JSON call, or one call per task
+ANALYSIS_MODE_STRUCTURED = 'structured'
+ANALYSIS_MODE_TASKS = 'tasks'
+
+SENTIMENTS = ['positive', 'negative', 'neutral']
+
+# Field -> (JSON schema, description) of a structured analysis
+ANALYSIS_FIELDS = {
+    'summary': (
+        {'type': 'string'},
+        'a concise summary of the main topics, key decisions and important information',
+    ),
+    'topics': (
+        {'type': 'array', 'items': {'type': 'string'}, 'maxItems': 10},
+        'the main topics discussed',
+    ),
+    'sentiment': (
+        {'type': 'string', 'enum': SENTIMENTS},
+        'the overall sentiment, one of "positive", "negative" or "neutral"',
+    ),
+    'action_items': (
+        {'type': 'array', 'items': {'type': 'string'}, 'maxItems': 10},
+        'action items, tasks or to-dos mentioned (empty list if none)',
+    ),
+    'key_points': (
+        {'type': 'array', 'items': {'type': 'string'}, 'maxItems': 10},
+        'the key points or important information',
+    ),
+}
+
+
+def analysis_schema(fields: List[str]) -> Dict:
+    """JSON schema of a structured analysis limited to `fields`"""
+    return {
+        'type': 'object',
+        'properties': {field: ANALYSIS_FIELDS[field][0] for field in fields},
+        'required': list(fields),
+    }
+
+
+def structured_instruction(fields: List[str]) -> str:
+    lines = [f'- "{field}": {ANALYSIS_FIELDS[field][1]}' for field in fields]
+    return "Analyze the conversation above and answer with a JSON object containing:\n" + "\n".join(lines)
+
+
+ANALYSIS_SCHEMA = analysis_schema(list(ANALYSIS_FIELDS))
+
+
+# Room for the whole JSON answer of a structured analysis
+STRUCTURED_MAX_TOKENS = 1024
+
+
+def get_analysis_mode() -> str:
+    return os.getenv('ANALYSIS_MODE', ANALYSIS_MODE_STRUCTURED).lower()
+
+
+def content_hash(messages) -> str:
+    """Hash of the ordered senders and contents an analysis was computed from"""
+    digest = hashlib.sha256()
+    for msg in messages:
+        digest.update(f"{msg.sender}\x1f{msg.content}\x1e".encode('utf-8'))
+    return digest.hexdigest()
 
 
 class ConversationAnalyzer:
     """Analyze conversations and extract insights"""
-    
+
     def __init__(self):
-        self.llm_client = get_llm_client()
-    
+        self.llm_client = get_llm_client(ROLE_ANALYSIS)
+
+    def _conversation_text(self, conversation: Conversation, messages: List[Message],
+                           fixed_text: str, max_tokens: int) -> str:
+        """
+        The conversation as prompt text, condensed when it does not fit
+
+        Conversations longer than the context window are replaced by their
+        hierarchical chunk summaries (see rolling_summary).
+        """
+        text = render_messages(messages)
+        summarizer = RollingSummarizer(self.llm_client)
+        budget = summarizer.budget(fixed_text, max_tokens)
+        if self.llm_client.count_tokens(text) <= budget:
+            return text
+        header = "Summaries of the conversation, in order:"
+        return header + "\n" + summarizer.condense(conversation, messages, budget - 16)
+
+    def _build_prompt(self, task: str, conversation: Conversation, messages: List[Message]) -> Dict:
+        """generate_many() entry for one analysis task"""
+        spec = ANALYSIS_TASKS[task]
+        limit = spec['message_limit']
+        if limit:
+            conversation_text = render_messages(messages[:limit])
+        else:
+            conversation_text = self._conversation_text(
+                conversation, messages, spec['instruction'], spec['max_tokens']
+            )
+        prompt = f"""Conversation:
+{conversation_text}
+
+{spec['instruction']}
+
+{spec['label']}:"""
+        return {
+            'prompt': prompt,
+            'max_tokens': spec['max_tokens'],
+            'temperature': spec['temperature'],
+        }
+
+    def _run_tasks(self, conversation: Conversation, tasks: List[str],
+                   messages: Optional[List[Message]] = None) -> Dict[str, Dict]:
+        """Generate the responses of several tasks in one batch"""
+        if messages is None:
+            messages = list(conversation.messages.all().order_by('timestamp'))
+        results = self.llm_client.generate_many(
+            [self._build_prompt(task, conversation, messages) for task in tasks],
+            priority=PRIORITY_BACKGROUND,
+            conversation_id=str(conversation.id)
+        )
+        return dict(zip(tasks, results))
+
+    @staticmethod
+    def _parse_list(response: str) -> List[str]:
+        return [item.strip() for item in response.split(',') if item.strip()][:10]
+
+    def _parse_summary(self, result: Dict, messages: List[Message]) -> str:
+        if result['error']:
+            print(f"Error generating summary: {result['error']}")
+            # Fallback summary
+            return f"Conversation with {len(messages)} messages about various topics."
+        return result['text'].strip()
+
+    def _parse_topics(self, result: Dict) -> List[str]:
+        if result['error']:
+            print(f"Error extracting topics: {result['error']}")
+            return []
+        return self._parse_list(result['text'])
+
+    def _parse_sentiment(self, result: Dict) -> str:
+        if result['error']:
+            print(f"Error analyzing sentiment: {result['error']}")
+            return "neutral"
+        sentiment = result['text'].strip().lower()
+        if sentiment in SENTIMENTS:
+            return sentiment
+        return "neutral"
+
+    def _parse_action_items(self, result: Dict) -> List[str]:
+        if result['error']:
+            print(f"Error extracting action items: {result['error']}")
+            return []
+        if result['text'].strip().lower() == 'none':
+            return []
+        return self._parse_list(result['text'])
+
+    def _parse_key_points(self, result: Dict) -> List[str]:
+        if result['error']:
+            print(f"Error extracting key points: {result['error']}")
+            return []
+        return self._parse_list(result['text'])
+
     def generate_summary(self, conversation: Conversation) -> str:
         """Generate a summary of the conversation"""
-        messages = conversation.messages.all().order_by('timestamp')
+        messages = list(conversation.messages.all().order_by('timestamp'))
         if not messages:
             return "Empty conversation"
-        
-        # Build conversation text
-        conversation_text = "\n".join([
-            f"{msg.sender.upper()}: {msg.content}" for msg in messages
-        ])
-        
-        prompt = f"""Please provide a concise summary of the following conversation. 
-Focus on the main topics discussed, key decisions made, and important information shared.
-
-Conversation:
-{conversation_text}
+        results = self._run_tasks(conversation, ['summary'], messages)
+        return self._parse_summary(results['summary'], messages)
 
-Summary:"""
-        
-        try:
-            summary = self.llm_client.generate(
-                prompt=prompt,
-                max_tokens=256,
-                temperature=0.5
-            )
-            return summary.strip()
-        except Exception as e:
-            print(f"Error generating summary: {e}")
-            # Fallback summary
-            return f"Conversation with {len(messages)} messages about various topics."
-    
     def extract_topics(self, conversation: Conversation) -> List[str]:
         """Extract main topics from conversation"""
-        messages = conversation.messages.all().order_by('timestamp')
-        if not messages:
+        if not conversation.messages.exists():
             return []
-        
-        conversation_text = "\n".join([
-            f"{msg.sender.upper()}: {msg.content}" for msg in messages[:20]  # Limit for context
-        ])
-        
-        prompt = f"""Extract the main topics discussed in this conversation. 
-Return only a comma-separated list of topics, nothing else.
-
-Conversation:
-{conversation_text}
+        return self._parse_topics(self._run_tasks(conversation, ['topics'])['topics'])
 
-Topics:"""
-        
-        try:
-            response = self.llm_client.generate(
-                prompt=prompt,
-                max_tokens=128,
-                temperature=0.3
-            )
-            topics = [t.strip() for t in response.split(',') if t.strip()]
-            return topics[:10]  # Limit to 10 topics
-        except Exception as e:
-            print(f"Error extracting topics: {e}")
-            return []
-    
     def analyze_sentiment(self, conversation: Conversation) -> str:
         """Analyze overall sentiment of conversation"""
-        messages = conversation.messages.all().order_by('timestamp')
-        if not messages:
+        if not conversation.messages.exists():
             return "neutral"
-        
-        conversation_text = "\n".join([
-            f"{msg.sender.upper()}: {msg.content}" for msg in messages[:20]
-        ])
-        
-        prompt = f"""Analyze the sentiment of this conversation. 
-Respond with only one word: "positive", "negative", or "neutral".
-
-Conversation:
-{conversation_text}
+        return self._parse_sentiment(self._run_tasks(conversation, ['sentiment'])['sentiment'])
 
-Sentiment:"""
-        
-        try:
-            response = self.llm_client.generate(
-                prompt=prompt,
-                max_tokens=10,
-                temperature=0.2
-            )
-            sentiment = response.strip().lower()
-            if sentiment in ['positive', 'negative', 'neutral']:
-                return sentiment
-            return "neutral"
-        except Exception as e:
-            print(f"Error analyzing sentiment: {e}")
-            return "neutral"
-    
     def extract_action_items(self, conversation: Conversation) -> List[str]:
         """Extract action items or tasks mentioned in conversation"""
-        messages = conversation.messages.all().order_by('timestamp')
-        if not messages:
+        if not conversation.messages.exists():
             return []
-        
-        conversation_text = "\n".join([
-            f"{msg.sender.upper()}: {msg.content}" for msg in messages[:20]
-        ])
-        
-        prompt = f"""Extract any action items, tasks, or to-dos mentioned in this conversation.
-Return only a comma-separated list of action items, nothing else. If there are no action items, return "None".
-
-Conversation:
-{conversation_text}
+        return self._parse_action_items(self._run_tasks(conversation, ['action_items'])['action_items'])
 
-Action Items:"""
-        
-        try:
-            response = self.llm_client.generate(
-                prompt=prompt,
-                max_tokens=256,
-                temperature=0.3
-            )
-            if response.strip().lower() == 'none':
-                return []
-            action_items = [item.strip() for item in response.split(',') if item.strip()]
-            return action_items[:10]
-        except Exception as e:
-            print(f"Error extracting action items: {e}")
-            return []
-    
     def extract_key_points(self, conversation: Conversation) -> List[str]:
         """Extract key discussion points"""
-        messages = conversation.messages.all().order_by('timestamp')
-        if not messages:
+        if not conversation.messages.exists():
             return []
-        
-        conversation_text = "\n".join([
-            f"{msg.sender.upper()}: {msg.content}" for msg in messages[:20]
-        ])
-        
-        prompt = f"""Extract the key points or important information from this conversation.
-Return only a comma-separated list of key points, nothing else.
-
-Conversation:
+        return self._parse_key_points(self._run_tasks(conversation, ['key_points'])['key_points'])
+
+    def analyze_structured(self, conversation: Conversation,
+                           messages: Optional[List[Message]] = None,
+                           fields: Optional[List[str]] = None) -> Dict:
+        """
+        Analysis in a single LLM call returning JSON for `fields` (default all)
+
+        Raises ValueError when the model output is not usable.
+        """
+        if messages is None:
+            messages = list(conversation.messages.all().order_by('timestamp'))
+        fields = fields or list(ANALYSIS_FIELDS)
+        instruction = structured_instruction(fields)
+        conversation_text = self._conversation_text(
+            conversation, messages, instruction, STRUCTURED_MAX_TOKENS
+        )
+        prompt = f"""Conversation:
 {conversation_text}
 
-Key Points:"""
-        
-        try:
-            response = self.llm_client.generate(
-                prompt=prompt,
-                max_tokens=256,
-                temperature=0.4
+{instruction}
+
+JSON:"""
+        data = self.llm_client.generate_json(
+            prompt,
+            analysis_schema(fields),
+            max_tokens=STRUCTURED_MAX_TOKENS,
+            temperature=0.3,
+            priority=PRIORITY_BACKGROUND,
+            conversation_id=str(conversation.id)
+        )
+        if not isinstance(data, dict):
+            raise ValueError("Analysis JSON is not an object")
+        if 'summary' in fields and not isinstance(data.get('summary'), str):
+            raise ValueError("Analysis JSON without a summary")
+
+        def string_list(key):
+            values = data.get(key) or []
+            if not isinstance(values, list):
+                return []
+            return [str(value).strip() for value in values if str(value).strip()][:10]
+
+        sentiment = str(data.get('sentiment', '')).strip().lower()
+        result = {
+            'summary': str(data.get('summary', '')).strip(),
+            'topics': string_list('topics'),
+            'sentiment': sentiment if sentiment in SENTIMENTS else "neutral",
+            'action_items': string_list('action_items'),
+            'key_points': string_list('key_points'),
+        }
+        return {field: result[field] for field in fields}
+
+    @property
+    def version(self) -> str:
+        """Identifies prompts, mode and model; a different version invalidates stored analyses"""
+        return (f"{ANALYZER_VERSION}:{get_analysis_mode()}:{get_analysis_tier()}:"
+                f"{self.llm_client.model_id}")[:255]
+
+    def analyze_and_save(self, conversation: Conversation, force: bool = False) -> bool:
+        """
+        Analyze a conversation and store the result unless it is up to date
+
+        The stored analysis is kept when its content hash and analyzer
+        version match the current messages. Otherwise an analysis of
+        identical content (e.g. a duplicate conversation) is copied if one
+        exists. Only then is the LLM called. `force` always re-analyzes.
+        Returns True if the LLM was called.
+        """
+        messages = list(conversation.messages.all().order_by('timestamp'))
+        digest = content_hash(messages)
+        version = self.version
+
+        if not force:
+            stored = ConversationAnalysis.objects.filter(conversation=conversation).first()
+            current, copied = self.lookup(conversation, stored, digest, version)
+            if current:
+                return False
+            if copied:
+                self._save(conversation, copied, digest, version)
+                return False
+
+        analysis_data = self.analyze_conversation(conversation, messages)
+        self._save(conversation, analysis_data, digest, version)
+        return True
+
+    @staticmethod
+    def lookup(conversation: Conversation, stored: Optional[ConversationAnalysis],
+               digest: str, version: str) -> Tuple[bool, Optional[Dict]]:
+        """
+        (whether `stored` is current, analysis data of identical content
+        stored for another conversation or None)
+        """
+        if stored is not None and stored.content_hash == digest and stored.analyzer_version == version:
+            return True, None
+        source = ConversationAnalysis.objects.filter(
+            content_hash=digest, analyzer_version=version
+        ).exclude(conversation=conversation).select_related('conversation').first()
+        if source is None:
+            return False, None
+        return False, {
+            'summary': source.conversation.summary,
+            'sentiment': source.sentiment,
+            'topics': source.topics,
+            'action_items': source.action_items,
+            'key_points': source.key_points,
+        }
+
+    @staticmethod
+    def _save(conversation: Conversation, analysis_data: Dict, digest: str, version: str):
+        with transaction.atomic():
+            ConversationAnalysis.objects.update_or_create(
+                conversation=conversation,
+                defaults={
+                    'sentiment': analysis_data['sentiment'],
+                    'topics': analysis_data['topics'],
+                    'action_items': analysis_data['action_items'],
+                    'key_points': analysis_data['key_points'],
+                    'content_hash': digest,
+                    'analyzer_version': version,
+                }
             )
-            key_points = [point.strip() for point in response.split(',') if point.strip()]
-            return key_points[:10]
-        except Exception as e:
-            print(f"Error extracting key points: {e}")
-            return []
-    
-    def analyze_conversation(self, conversation: Conversation) -> Dict:
-        """Perform full analysis of conversation"""
-        return {
-            'summary': self.generate_summary(conversation),
-            'topics': self.extract_topics(conversation),
-            'sentiment': self.analyze_sentiment(conversation),
-            'action_items': self.extract_action_items(conversation),
-            'key_points': self.extract_key_points(conversation)
+            Conversation.objects.filter(id=conversation.id).update(
+                summary=analysis_data['summary'], updated_at=timezone.now()
+            )
+        conversation.summary = analysis_data['summary']
+
+    def analyze_conversation(self, conversation: Conversation,
+                             messages: Optional[List[Message]] = None) -> Dict:
+        """
+        Perform full analysis of conversation
+
+        Messages are fetched once. With ANALYSIS_TIER=hybrid sentiment and
+        topics come from embeddings when they are clear-cut, and with
+        ANALYSIS_TIER=fast every field does (no LLM call at all). The
+        remaining fields go to the LLM: in the default structured mode the
+        conversation is sent a single time and the model answers with JSON
+        for those fields; if that fails (or ANALYSIS_MODE=tasks) the task
+        prompts are generated as one generate_many() batch.
+        """
+        if messages is None:
+            messages = list(conversation.messages.all().order_by('timestamp'))
+        if not messages:
+            return {
+                'summary': "Empty conversation",
+                'topics': [],
+                'sentiment': "neutral",
+                'action_items': [],
+                'key_points': [],
+            }
+
+        known = {}
+        tier = get_analysis_tier()
+        if tier != TIER_LLM:
+            fast = self._fast_analysis(messages)
+            if fast and tier == TIER_FAST:
+                return {field: fast[field] for field in ANALYSIS_FIELDS}
+            if fast and fast['sentiment_confident']:
+                known['sentiment'] = fast['sentiment']
+            if fast and fast['topics_confident']:
+                known['topics'] = fast['topics']
+        fields = [field for field in ANALYSIS_FIELDS if field not in known]
+
+        if get_analysis_mode() == ANALYSIS_MODE_STRUCTURED:
+            try:
+                return dict(self.analyze_structured(conversation, messages, fields), **known)
+            except Exception as e:
+                print(f"Structured analysis failed, falling back to per-task prompts: {e}")
+
+        results = self._run_tasks(conversation, fields, messages)
+        if all(result['error'] for result in results.values()):
+            # Nothing usable came back, let the caller retry later
+            raise RuntimeError(f"Analysis failed: {next(iter(results.values()))['error']}")
+        parsers = {
+            'summary': lambda result: self._parse_summary(result, messages),
+            'topics': self._parse_topics,
+            'sentiment': self._parse_sentiment,
+            'action_items': self._parse_action_items,
+            'key_points': self._parse_key_points,
         }
+        return dict({field: parsers[field](results[field]) for field in fields}, **known)
 
+    def _fast_analysis(self, messages: List[Message]) -> Optional[Dict]:
+        """Embedding-based analysis, None when the embedding model is unavailable"""
+        try:
+            fast_analyzer = get_fast_analyzer()
+            if not fast_analyzer.available:
+                return None
+            return fast_analyzer.analyze(messages)
+        except Exception as e:
+            print(f"Fast analysis failed, using the LLM: {e}")
+            return None
@@ -0,0 +1,217 @@
+"""
+Stored conversation embeddings and their in-memory search matrix
+A conversation is embedded once when it ends (and again only when its
+summary changes); queries score all stored embeddings with one matrix product.
+"""
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+from django.utils import timezone
+from api.models import Conversation
+from .embedding_service import get_embedding_service
+from .vector_index import normalize, top_k
+
+
+# Opening messages embedded for conversations without a summary
+OPENING_MESSAGES = 5
+
+# Re-read embeddings this much older than the last sync, for writes that
+# committed after it with an earlier timestamp
+SYNC_MARGIN_SECONDS = 60
+
+# Searches within this many seconds of a sync skip the database check
+SYNC_INTERVAL_SECONDS = 2
+
+
+def embedding_text(conversation: Conversation) -> str:
+    """The summary, or the opening messages while there is none"""
+    if conversation.summary:
+        return conversation.summary
+    messages = conversation.messages.all().order_by('timestamp')[:OPENING_MESSAGES]
+    return " ".join(msg.content for msg in messages)
+
+
+def embedding_hash(text: str, model_name: str) -> str:
+    return hashlib.sha256(f"{model_name}\n{text}".encode('utf-8')).hexdigest()
+
+
+def refresh_conversation_embeddings(conversations: Iterable[Conversation], force: bool = False,
+                                    embedding_service=None) -> int:
+    """
+    Embed conversations whose text changed since they were last embedded
+
+    All changed texts are encoded in one batch and written with one
+    bulk update. Returns the number of conversations embedded.
+    """
+    embedding_service = embedding_service or get_embedding_service()
+    changed, texts = [], []
+    for conversation in conversations:
+        text = embedding_text(conversation)
+        if not text:
+            continue
+        digest = embedding_hash(text, embedding_service.model_name)
+        if force or conversation.embedding_hash != digest or conversation.embedding is None:
+            conversation.embedding_hash = digest
+            changed.append(conversation)
+            texts.append(text)
+    if not changed:
+        return 0
+
+    now = timezone.now()
+    embedded = []
+    for conversation, vector in zip(changed, embedding_service.generate_embeddings(texts)):
+        if vector is None:
+            continue
+        conversation.embedding = vector
+        conversation.embedding_updated_at = now
+        embedded.append(conversation)
+    Conversation.objects.bulk_update(
+        embedded, ['embedding', 'embedding_hash', 'embedding_updated_at'], batch_size=500
+    )
+    if _conversation_index is not None:
+        _conversation_index.put_many(embedded)
+    return len(embedded)
+
+
+def refresh_conversation_embedding(conversation: Conversation, force: bool = False) -> bool:
+    """Embed one conversation if its text changed; errors are logged, not raised"""
+    try:
+        return refresh_conversation_embeddings([conversation], force=force) > 0
+    except Exception as e:
+        print(f"Warning: Could not embed conversation {conversation.id}: {e}")
+        return False
+
+
+class ConversationEmbeddingIndex:
+    """Unit-length conversation embeddings as one matrix, synced from the database"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._rows = {}
+        self._updated_at = {}
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._start_times = np.zeros(0, dtype=np.float64)
+        self._size = 0
+        self._synced_at = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def put_many(self, conversations: Iterable[Conversation]):
+        """Add or replace the embeddings of conversations"""
+        items = [c for c in conversations if c.embedding is not None and len(c.embedding)]
+        if not items:
+            return
+        vectors = normalize(np.asarray([c.embedding for c in items], dtype=np.float32))
+        with self._lock:
+            if not self._ids:
+                self._vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            elif vectors.shape[1] != self._vectors.shape[1]:
+                print("Warning: Conversation embedding dimension changed, "
+                      "run `manage.py embed_conversations --force`")
+                return
+            if self._size + len(items) > len(self._vectors):
+                # Grow geometrically so syncing many rows stays linear
+                capacity = max(self._size + len(items), 2 * len(self._vectors), 256)
+                vectors_buffer = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+                vectors_buffer[:self._size] = self._vectors[:self._size]
+                start_times = np.zeros(capacity, dtype=np.float64)
+                start_times[:self._size] = self._start_times[:self._size]
+                self._vectors, self._start_times = vectors_buffer, start_times
+            for conversation, vector in zip(items, vectors):
+                key = str(conversation.id)
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._rows[key] = self._size
+                    self._ids.append(key)
+                    self._size += 1
+                self._vectors[row] = vector
+                self._start_times[row] = conversation.start_time.timestamp()
+                self._updated_at[key] = conversation.embedding_updated_at
+
+    def remove(self, conversation_id):
+        """Drop a conversation, moving the last row into its place"""
+        with self._lock:
+            key = str(conversation_id)
+            row = self._rows.pop(key, None)
+            self._updated_at.pop(key, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                moved = self._ids[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+                self._vectors[row] = self._vectors[last]
+                self._start_times[row] = self._start_times[last]
+            self._ids.pop()
+            self._size -= 1
+
+    def sync(self, max_age: float = 0):
+        """Pick up embeddings stored since the last sync, by any process"""
+        if self._synced_at is not None and (timezone.now() - self._synced_at).total_seconds() < max_age:
+            return
+        recent = Conversation.objects.filter(embedding_updated_at__isnull=False)
+        if self._synced_at is not None:
+            recent = recent.filter(
+                embedding_updated_at__gte=self._synced_at - timedelta(seconds=SYNC_MARGIN_SECONDS)
+            )
+        synced_at = timezone.now()
+        # Only rows not seen at this timestamp are loaded with their embedding
+        changed = [
+            conversation_id for conversation_id, updated_at in recent.values_list('id', 'embedding_updated_at')
+            if self._updated_at.get(str(conversation_id)) != updated_at
+        ]
+        for start in range(0, len(changed), 2000):
+            self.put_many(Conversation.objects.filter(
+                id__in=changed[start:start + 2000], embedding__isnull=False
+            ).only('id', 'start_time', 'embedding', 'embedding_updated_at'))
+        self._synced_at = synced_at
+
+    def search(self, query: List[float], k: int = 10,
+               date_range: Optional[Tuple] = None) -> List[Tuple[str, float]]:
+        """(conversation id, cosine similarity) of the k nearest conversations, best first"""
+        self.sync(max_age=SYNC_INTERVAL_SECONDS)
+        query = normalize(np.asarray(query, dtype=np.float32))
+        with self._lock:
+            if not self._ids or query.shape[-1] != self._vectors.shape[1]:
+                return []
+            scores = self._vectors[:self._size] @ query
+            if date_range:
+                start_date, end_date = date_range
+                start_times = self._start_times[:self._size]
+                outside = ((start_times < start_date.timestamp()) |
+                           (start_times > end_date.timestamp()))
+                scores = np.where(outside, -np.inf, scores)
+            best = [i for i in top_k(scores, k) if np.isfinite(scores[i])]
+            return [(self._ids[i], float(scores[i])) for i in best]
+
+
+# Global conversation embedding index
+_conversation_index = None
+_conversation_index_lock = threading.Lock()
+
+
+def get_conversation_index() -> ConversationEmbeddingIndex:
+    """Get or create the global conversation embedding index"""
+    global _conversation_index
+    if _conversation_index is None:
+        with _conversation_index_lock:
+            if _conversation_index is None:
+                index = ConversationEmbeddingIndex()
+                index.sync()
+                missing = Conversation.objects.filter(status='ended', embedding__isnull=True).count()
+                if missing:
+                    print(f"Warning: {missing} ended conversations have no embedding, "
+                          f"run `manage.py embed_conversations`")
+                _conversation_index = index
+    return _conversation_index
+
+
+def remove_conversation_embedding(conversation_id):
+    """Drop a deleted conversation; nothing to do while the index is not loaded"""
+    if _conversation_index is not None:
+        _conversation_index.remove(conversation_id)
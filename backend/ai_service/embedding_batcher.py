@@ -0,0 +1,112 @@
+"""
+Micro-batching of concurrent single-text embedding requests
+Requests arriving from many threads and event loops are queued and encoded
+together by one worker thread: a batch is sent to the model once it is full
+or its oldest request has waited the maximum wait.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+
+class EmbeddingBatcher:
+    """Coalesce single-text embedding requests into batched encode calls"""
+
+    def __init__(self, encode: Callable[[List[str]], List[List[float]]],
+                 max_batch_size: int = 64, max_wait_ms: float = 2):
+        """
+        Initialize embedding batcher
+
+        Args:
+            encode: Embeds a list of texts in one call, raising on failure
+            max_batch_size: Texts encoded together at most
+            max_wait_ms: How long the first queued text waits for company
+        """
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._batches = 0
+        self._texts = 0
+        self._largest_batch = 0
+        self._errors = 0
+
+    def submit(self, text: str) -> Future:
+        """Queue a text, the future resolves to its embedding"""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._thread.start()
+            self._queue.append((text, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """Embedding of one text, blocking until its batch is encoded"""
+        return self.submit(text).result(timeout)
+
+    async def aembed(self, text: str) -> List[float]:
+        """Embedding of one text without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _next_batch(self) -> List:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch_size))]
+
+    def _run(self):
+        while True:
+            # Requests cancelled while queued (e.g. a closed WebSocket) are dropped
+            batch = [(text, future) for text, future, _ in self._next_batch()
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.encode([text for text, _ in batch])
+            except Exception as e:
+                self._errors += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+            with self._cond:
+                self._batches += 1
+                self._texts += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'batches': self._batches,
+                'texts': self._texts,
+                'avg_batch_size': round(self._texts / self._batches, 2) if self._batches else 0.0,
+                'largest_batch': self._largest_batch,
+                'errors': self._errors,
+            }
+
+
+def create_embedding_batcher(encode: Callable[[List[str]], List[List[float]]]) -> Optional[EmbeddingBatcher]:
+    """Create a batcher from EMBEDDING_BATCH_MAX_SIZE and EMBEDDING_BATCH_MAX_WAIT_MS, None when disabled"""
+    max_batch_size = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '64'))
+    if max_batch_size <= 1:
+        return None
+    return EmbeddingBatcher(encode, max_batch_size=max_batch_size,
+                            max_wait_ms=float(os.getenv('EMBEDDING_BATCH_MAX_WAIT_MS', '2')))
@@ -2,44 +2,196 @@
 Embedding service for semantic search using sentence-transformers
 """
 import os
-from typing import List, Optional
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from .embedding_batcher import create_embedding_batcher
+
+
+# Inference backends of sentence-transformers >= 3.2, besides the default "torch"
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+class EmbeddingCache:
+    """Bounded LRU of embeddings keyed by model id and whitespace-normalized text"""
+
+    def __init__(self, max_entries: int = 1024, max_chars: int = 512):
+        """
+        Initialize embedding cache
+
+        Args:
+            max_entries: Embeddings kept before the least recently used are evicted
+            max_chars: Longer texts (whole messages, summaries) are not cached
+        """
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, model_id: str, text: str) -> Optional[Tuple[str, str]]:
+        """Cache key for a text, None when it is too long to cache"""
+        normalized = " ".join(text.split())
+        if len(normalized) > self.max_chars:
+            return None
+        return (model_id, normalized)
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers may modify the list they get
+        return list(embedding)
+
+    def put(self, key: Tuple[str, str], embedding: List[float]):
+        with self._lock:
+            self._entries[key] = list(embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def create_embedding_cache() -> Optional[EmbeddingCache]:
+    """Create a cache from EMBEDDING_CACHE_SIZE and EMBEDDING_CACHE_MAX_CHARS, None when disabled"""
+    max_entries = int(os.getenv('EMBEDDING_CACHE_SIZE', '1024'))
+    if max_entries <= 0:
+        return None
+    return EmbeddingCache(max_entries=max_entries,
+                          max_chars=int(os.getenv('EMBEDDING_CACHE_MAX_CHARS', '512')))
 
 
 class EmbeddingService:
     """Service for generating text embeddings"""
     
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', cache: Optional[EmbeddingCache] = None,
+                 batched: bool = False, backend: str = 'torch', model_file: Optional[str] = None):
         """
         Initialize embedding service
         
         Args:
             model_name: Name of the sentence-transformer model to use
+            cache: Cache for single-text embeddings such as search queries
+            batched: Encode concurrent single-text requests together
+                (configured by EMBEDDING_BATCH_MAX_SIZE / _MAX_WAIT_MS)
+            backend: "torch", or "onnx" / "openvino" to run the model without torch
+            model_file: Model file within the model repository for that backend,
+                e.g. "onnx/model_qint8_avx512_vnni.onnx" for int8 weights
         """
         self.model_name = model_name
+        self.backend = backend
+        self.model_file = model_file
         self.model = None
+        self.cache = cache
+        self.batcher = create_embedding_batcher(self._encode_batch) if batched else None
         self._load_model()
     
     def _load_model(self):
         """Load the embedding model"""
         try:
+            # Imports torch, so only when the model is first needed
+            from sentence_transformers import SentenceTransformer
+            if self.backend != 'torch':
+                kwargs = {'model_kwargs': {'file_name': self.model_file}} if self.model_file else {}
+                try:
+                    self.model = SentenceTransformer(self.model_name, backend=self.backend, **kwargs)
+                    return
+                except TypeError:
+                    # An install older than the pinned version has no backend argument
+                    print(f"Warning: Embedding backend '{self.backend}' needs sentence-transformers >= 3.2, "
+                          f"using torch")
+                except Exception as e:
+                    # e.g. optimum not installed, or no such model file in the repository
+                    print(f"Warning: Could not load embedding backend '{self.backend}', using torch: {e}")
+                self.backend = 'torch'
             self.model = SentenceTransformer(self.model_name)
         except Exception as e:
             print(f"Warning: Could not load embedding model: {e}")
             self.model = None
     
+    @property
+    def model_id(self) -> str:
+        """Identifies the weights producing the embeddings, e.g. for cache keys"""
+        if self.backend == 'torch':
+            return f"{self.model_name}:torch"
+        return f"{self.model_name}:{self.backend}:{self.model_file or 'default'}"
+    
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        return [emb.tolist() for emb in self.model.encode(texts, convert_to_numpy=True)]
+    
+    def _cache_key(self, text: str):
+        return self.cache.make_key(self.model_id, text) if self.cache else None
+    
     def generate_embedding(self, text: str) -> Optional[List[float]]:
         """Generate embedding for a single text"""
         if not self.model or not text:
             return None
         
+        key = self._cache_key(text)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        try:
+            if self.batcher is not None:
+                embedding = self.batcher.embed(text)
+            else:
+                embedding = self.model.encode(text, convert_to_numpy=True).tolist()
+        except Exception as e:
+            print(f"Error generating embedding: {e}")
+            return None
+        if key is not None:
+            self.cache.put(key, embedding)
+        return embedding
+    
+    async def agenerate_embedding(self, text: str) -> Optional[List[float]]:
+        """Generate embedding for a single text without blocking the event loop"""
+        if not self.model or not text:
+            return None
+        
+        key = self._cache_key(text)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
-            embedding = self.model.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            if self.batcher is not None:
+                embedding = await self.batcher.aembed(text)
+            else:
+                loop = asyncio.get_running_loop()
+                embedding = (await loop.run_in_executor(None, self._encode_batch, [text]))[0]
         except Exception as e:
             print(f"Error generating embedding: {e}")
             return None
+        if key is not None:
+            self.cache.put(key, embedding)
+        return embedding
     
     def generate_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
         """Generate embeddings for multiple texts"""
@@ -47,8 +199,7 @@ class EmbeddingService:
             return [None] * len(texts)
         
         try:
-            embeddings = self.model.encode(texts, convert_to_numpy=True)
-            return [emb.tolist() for emb in embeddings]
+            return self._encode_batch(texts)
         except Exception as e:
             print(f"Error generating embeddings: {e}")
             return [None] * len(texts)
@@ -71,15 +222,48 @@ class EmbeddingService:
         return float(dot_product / (norm1 * norm2))
 
 
+def get_embedding_backend() -> str:
+    """Embedding backend from EMBEDDING_BACKEND: torch (default), onnx or openvino"""
+    backend = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+    if backend not in EMBEDDING_BACKENDS:
+        print(f"Warning: Unknown EMBEDDING_BACKEND '{backend}', using torch")
+        return 'torch'
+    return backend
+
+
 # Global embedding service instance
 _embedding_service = None
+_embedding_service_lock = threading.Lock()
 
 
 def get_embedding_service() -> EmbeddingService:
     """Get or create global embedding service instance"""
     global _embedding_service
     if _embedding_service is None:
-        model_name = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
-        _embedding_service = EmbeddingService(model_name=model_name)
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService(
+                    model_name=os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2'),
+                    cache=create_embedding_cache(),
+                    batched=True,
+                    backend=get_embedding_backend(),
+                    model_file=os.getenv('EMBEDDING_MODEL_FILE') or None,
+                )
     return _embedding_service
 
+
+def get_embedding_cache_stats() -> Optional[Dict]:
+    """Stats of the query embedding cache, None until the service is created or when disabled"""
+    service = _embedding_service
+    if service is None or service.cache is None:
+        return None
+    return service.cache.stats()
+
+
+def get_embedding_batcher_stats() -> Optional[Dict]:
+    """Stats of the micro-batching worker, None until the service is created or when disabled"""
+    service = _embedding_service
+    if service is None or service.batcher is None:
+        return None
+    return service.batcher.stats()
+
@@ -0,0 +1,243 @@
+"""
+Embedding-based analyzers that replace LLM calls for classification tasks
+Sentiment is scored against prototype centroids and topics against a topic
+vocabulary, all as matrix products over the message embeddings
+"""
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from .embedding_service import get_embedding_service
+
+
+# Example sentences whose mean embedding represents each sentiment
+SENTIMENT_PROTOTYPES = {
+    'positive': [
+        "This is great, thank you so much!",
+        "I love it, that works perfectly.",
+        "Awesome, I'm really happy with this.",
+        "That was very helpful, I appreciate it.",
+        "Excellent, this is exactly what I needed.",
+    ],
+    'negative': [
+        "This is terrible and doesn't work at all.",
+        "I'm frustrated, nothing is going right.",
+        "That answer was wrong and unhelpful.",
+        "I hate this, it keeps failing.",
+        "I'm disappointed and annoyed with the result.",
+    ],
+    'neutral': [
+        "Can you tell me more about this?",
+        "Here is some information on the topic.",
+        "What are the steps to do that?",
+        "The meeting is scheduled for Tuesday.",
+        "Let me explain how it works.",
+    ],
+}
+
+# Default topic vocabulary, replaced by ANALYSIS_TOPICS_FILE (one topic per line)
+DEFAULT_TOPICS = [
+    "travel", "programming", "software development", "machine learning",
+    "data science", "web development", "cooking", "recipes", "nutrition",
+    "fitness", "health", "mental health", "career", "job search", "education",
+    "learning languages", "books", "movies", "music", "games", "sports",
+    "personal finance", "investing", "business", "startups", "marketing",
+    "technology", "smartphones", "hardware", "home improvement", "gardening",
+    "pets", "parenting", "relationships", "productivity", "writing", "science",
+    "history", "politics", "law", "real estate", "cars", "fashion", "art",
+    "photography", "environment", "weather", "shopping", "customer support",
+]
+
+# Sentences that usually state something to be done
+ACTION_PATTERN = re.compile(
+    r"\b(need to|needs to|should|must|have to|has to|remember to|don't forget|"
+    r"to-do|todo|action item|follow up|i will|i'll|we will|we'll|let's)\b",
+    re.IGNORECASE
+)
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+# Analysis tiers, see get_analysis_tier()
+TIER_LLM = 'llm'
+TIER_HYBRID = 'hybrid'
+TIER_FAST = 'fast'
+
+
+def get_analysis_tier() -> str:
+    """
+    ANALYSIS_TIER: "llm" runs every task on the LLM, "hybrid" scores
+    sentiment and topics with embeddings and asks the LLM only when unsure,
+    "fast" never calls the LLM
+    """
+    return os.getenv('ANALYSIS_TIER', TIER_LLM).lower()
+
+
+def get_sentiment_margin() -> float:
+    return float(os.getenv('ANALYSIS_FAST_SENTIMENT_MARGIN', '0.05'))
+
+
+def get_topic_min_similarity() -> float:
+    return float(os.getenv('ANALYSIS_FAST_TOPIC_MIN_SIMILARITY', '0.35'))
+
+
+def load_topic_vocabulary() -> List[str]:
+    path = os.getenv('ANALYSIS_TOPICS_FILE', '')
+    if not path:
+        return list(DEFAULT_TOPICS)
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class FastAnalyzer:
+    """Sentiment, topics and extractive fields from message embeddings"""
+
+    def __init__(self, embedding_service=None):
+        self.embedding_service = embedding_service or get_embedding_service()
+        self.sentiment_labels = list(SENTIMENT_PROTOTYPES)
+        self.topics = load_topic_vocabulary()
+        self._sentiment_centroids = None
+        self._topic_matrix = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self.embedding_service.model is not None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.embedding_service.generate_embeddings(texts)
+        if not vectors or any(vector is None for vector in vectors):
+            raise RuntimeError("Embedding model unavailable")
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _label_matrices(self):
+        """Unit-length sentiment centroids (3, d) and topic vectors (T, d), built once"""
+        with self._lock:
+            if self._sentiment_centroids is None:
+                centroids = []
+                for label in self.sentiment_labels:
+                    prototypes = normalize_rows(self._encode(SENTIMENT_PROTOTYPES[label]))
+                    centroids.append(prototypes.mean(axis=0))
+                self._sentiment_centroids = normalize_rows(np.stack(centroids))
+                self._topic_matrix = normalize_rows(self._encode(
+                    [f"A conversation about {topic}" for topic in self.topics]
+                ))
+            return self._sentiment_centroids, self._topic_matrix
+
+    def message_matrix(self, messages: Sequence) -> np.ndarray:
+        """Unit-length message vectors, using stored embeddings where present"""
+        _, topic_matrix = self._label_matrices()
+        dim = topic_matrix.shape[1]
+        rows: List[Optional[list]] = []
+        missing = []
+        for i, msg in enumerate(messages):
+            embedding = getattr(msg, 'embedding', None)
+            if embedding is not None and len(embedding) == dim:
+                rows.append(embedding)
+            else:
+                rows.append(None)
+                missing.append(i)
+        if missing:
+            encoded = self._encode([messages[i].content for i in missing])
+            for i, vector in zip(missing, encoded):
+                rows[i] = vector
+        if not rows:
+            return np.zeros((0, dim), dtype=np.float32)
+        return normalize_rows(np.asarray(rows, dtype=np.float32))
+
+    def analyze_many(self, conversations: Sequence[Sequence]) -> List[Optional[Dict]]:
+        """
+        Analyze many conversations (each a list of messages) at once
+
+        All messages are scored in one matrix product. Each result holds
+        the analysis fields plus 'sentiment_confident' and
+        'topics_confident', which say whether the embedding answer is
+        clear enough to skip the LLM. Empty conversations give None.
+        """
+        centroids, topic_matrix = self._label_matrices()
+        flat = [msg for messages in conversations for msg in messages if msg.content]
+        matrix = self.message_matrix(flat)
+        sentiment_scores = matrix @ centroids.T
+
+        margin = get_sentiment_margin()
+        min_similarity = get_topic_min_similarity()
+        results = []
+        offset = 0
+        for messages in conversations:
+            count = sum(1 for msg in messages if msg.content)
+            if not count:
+                results.append(None)
+                continue
+            vectors = matrix[offset:offset + count]
+            scores = sentiment_scores[offset:offset + count]
+            texts = [msg for msg in messages if msg.content]
+            offset += count
+
+            # Sentiment: mean similarity to each centroid, user messages weigh double
+            weights = np.array([2.0 if msg.sender == 'user' else 1.0 for msg in texts], dtype=np.float32)
+            mean_scores = weights @ scores / weights.sum()
+            order = np.argsort(mean_scores)[::-1]
+            sentiment = self.sentiment_labels[order[0]]
+            sentiment_margin = float(mean_scores[order[0]] - mean_scores[order[1]])
+
+            # Topics: vocabulary entries close to the conversation centroid
+            centroid = vectors.mean(axis=0)
+            centroid /= (np.linalg.norm(centroid) or 1.0)
+            topic_scores = topic_matrix @ centroid
+            ranked = np.argsort(topic_scores)[::-1][:5]
+            topics = [self.topics[i] for i in ranked if topic_scores[i] >= min_similarity]
+
+            # Extractive fields: the messages most representative of the whole
+            centrality = vectors @ centroid
+            central = sorted(np.argsort(centrality)[::-1][:3])
+            key_points = [self._first_sentence(texts[i].content) for i in central]
+            summary = " ".join(self._first_sentence(texts[i].content) for i in central[:2])
+
+            results.append({
+                'summary': summary,
+                'topics': topics,
+                'sentiment': sentiment,
+                'action_items': self._action_items(texts),
+                'key_points': key_points,
+                'sentiment_confident': sentiment_margin >= margin,
+                'topics_confident': bool(topics),
+            })
+        return results
+
+    def analyze(self, messages: Sequence) -> Optional[Dict]:
+        return self.analyze_many([messages])[0]
+
+    @staticmethod
+    def _first_sentence(text: str, max_chars: int = 200) -> str:
+        sentence = SENTENCE_SPLIT.split(text.strip(), 1)[0]
+        return sentence[:max_chars]
+
+    @staticmethod
+    def _action_items(messages: Sequence) -> List[str]:
+        items = []
+        for msg in messages:
+            for sentence in SENTENCE_SPLIT.split(msg.content.strip()):
+                if ACTION_PATTERN.search(sentence) and sentence not in items:
+                    items.append(sentence[:200])
+        return items[:10]
+
+
+# Global fast analyzer instance
+_fast_analyzer = None
+_fast_analyzer_lock = threading.Lock()
+
+
+def get_fast_analyzer() -> FastAnalyzer:
+    """Get or create global fast analyzer instance"""
+    global _fast_analyzer
+    if _fast_analyzer is None:
+        with _fast_analyzer_lock:
+            if _fast_analyzer is None:
+                _fast_analyzer = FastAnalyzer()
+    return _fast_analyzer
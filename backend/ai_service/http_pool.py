@@ -0,0 +1,118 @@
+"""
+Pooled keep-alive HTTP connections for the LM Studio API
+"""
+import os
+from typing import Dict, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Transient server errors worth retrying
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class CompletionRetry(Retry):
+    """
+    Retry connection resets but never read timeouts
+
+    urllib3 counts a reset before the response arrives (ProtocolError, e.g.
+    a keep-alive connection the server had closed) as a read error, like a
+    timeout. Here it counts as a connection error and is retried, while a
+    timed-out completion is not re-sent: the server may still be generating it.
+    """
+
+    def _is_connection_error(self, err: Exception) -> bool:
+        return super()._is_connection_error(err) or isinstance(err, ProtocolError)
+
+
+def get_pool_size() -> int:
+    """Maximum number of pooled connections per host"""
+    return int(os.getenv('LM_STUDIO_POOL_SIZE', '10'))
+
+
+def get_max_retries() -> int:
+    """Retries for connection errors and 5xx responses"""
+    return int(os.getenv('LM_STUDIO_MAX_RETRIES', '3'))
+
+
+def get_timeouts() -> Tuple[float, float]:
+    """(connect, read) timeouts in seconds"""
+    connect_timeout = float(os.getenv('LM_STUDIO_CONNECT_TIMEOUT', '5'))
+    read_timeout = float(os.getenv('LM_STUDIO_READ_TIMEOUT', '60'))
+    return connect_timeout, read_timeout
+
+
+def create_session() -> requests.Session:
+    """
+    Create a session whose connection pool is shared by all threads
+
+    Connections are kept alive between completions, and failed connects,
+    connection resets or 5xx responses are retried with exponential backoff.
+    Read timeouts are raised right away (see CompletionRetry).
+    """
+    retry = CompletionRetry(
+        total=get_max_retries(),
+        read=False,
+        backoff_factor=float(os.getenv('LM_STUDIO_RETRY_BACKOFF', '0.5')),
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'POST']),
+        raise_on_status=False,
+    )
+    pool_size = get_pool_size()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        pool_block=False,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    return session
+
+
+def create_async_client():
+    """Create an async client with the same pool limits, timeouts and connect retries"""
+    if httpx is None:
+        return None
+    connect_timeout, read_timeout = get_timeouts()
+    pool_size = get_pool_size()
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+        ),
+        transport=httpx.AsyncHTTPTransport(retries=get_max_retries()),
+    )
+
+
+def session_pool_stats(session: requests.Session) -> Dict:
+    """Return per-host connection pool statistics for a session"""
+    pools = {}
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pool_manager = adapter.poolmanager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                if pool.pool else 0,
+                'max_size': pool.pool.maxsize if pool.pool else 0,
+            }
+    return pools
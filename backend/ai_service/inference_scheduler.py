@@ -0,0 +1,314 @@
+"""
+Inference scheduler providing admission control for the shared LLM
+Orders requests by priority, keeps conversations fair against each other
+and bounds how many generations run at once
+"""
+import os
+import time
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+# Lower value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BACKGROUND = 10
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NORMAL: 'normal',
+    PRIORITY_BACKGROUND: 'background',
+}
+
+
+class QueueTimeout(RuntimeError):
+    """Raised when a request waits longer than allowed for an inference slot"""
+
+
+class Ticket:
+    """A single request waiting for or holding an inference slot"""
+
+    def __init__(self, priority: int, conversation_id: Optional[str], start_tag: float,
+                 seq: int, on_position: Optional[Callable[[int], None]],
+                 future: Optional[asyncio.Future] = None):
+        self.priority = priority
+        self.conversation_id = conversation_id
+        self.start_tag = start_tag
+        self.seq = seq
+        self.on_position = on_position
+        # Resolved on its event loop when an async waiter is granted
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.position = None
+        self.granted = False
+        self.released = False
+        self.abandoned = False
+
+    def sort_key(self):
+        return (self.priority, self.start_tag, self.seq)
+
+
+class InferenceScheduler:
+    """
+    Priority queue with start-time fair queueing per conversation
+
+    Within a priority level every conversation gets a virtual start tag one
+    step after its previous request, so a conversation that queues a burst
+    of requests cannot starve a conversation that queues a single one.
+
+    Slots are granted by whichever thread changes the queue; threads waiting
+    in wait() are woken, async waiters get their future resolved on their
+    event loop, so no thread is parked per queued async request.
+    """
+
+    def __init__(self, max_in_flight: int = 1):
+        """
+        Initialize scheduler
+
+        Args:
+            max_in_flight: Maximum number of generations allowed to run at once
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self._cond = threading.Condition()
+        self._waiting: List[Ticket] = []
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._last_finish: Dict[tuple, float] = {}
+        self._seq = itertools.count()
+
+        # Statistics
+        self._granted = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def enqueue(self, priority: int = PRIORITY_NORMAL, conversation_id: Optional[str] = None,
+                on_position: Optional[Callable[[int], None]] = None,
+                future: Optional[asyncio.Future] = None) -> Ticket:
+        """Register a request without blocking; pair with wait(), or await `future`"""
+        with self._cond:
+            key = (priority, conversation_id or '')
+            start_tag = max(self._virtual_time, self._last_finish.get(key, 0.0))
+            self._last_finish[key] = start_tag + 1
+            ticket = Ticket(priority, conversation_id, start_tag, next(self._seq), on_position, future)
+            self._waiting.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> Ticket:
+        """Block until the ticket is granted a slot"""
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while not ticket.granted and not ticket.abandoned:
+                position = self._position(ticket)
+                if position != ticket.position:
+                    ticket.position = position
+                    notify_position(ticket, position)
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        self._timeouts += 1
+                        self._dispatch()
+                        raise QueueTimeout(
+                            f"Timed out after {timeout:.0f}s waiting for an inference slot"
+                        )
+                self._cond.wait(remaining)
+            return ticket
+
+    def acquire(self, priority: int = PRIORITY_NORMAL, conversation_id: Optional[str] = None,
+                on_position: Optional[Callable[[int], None]] = None,
+                timeout: Optional[float] = None) -> Ticket:
+        """Block until a slot is available and return the ticket holding it"""
+        ticket = self.enqueue(priority, conversation_id, on_position)
+        return self.wait(ticket, timeout)
+
+    def release(self, ticket: Ticket):
+        """Give back a slot obtained with acquire()"""
+        with self._cond:
+            if self._release(ticket):
+                self._dispatch()
+
+    def abandon(self, ticket: Ticket):
+        """Drop a ticket whose caller went away, whether it was granted yet or not"""
+        with self._cond:
+            ticket.abandoned = True
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._release(ticket)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_NORMAL, conversation_id: Optional[str] = None,
+             on_position: Optional[Callable[[int], None]] = None,
+             timeout: Optional[float] = None):
+        """Context manager holding an inference slot"""
+        ticket = self.acquire(priority, conversation_id, on_position, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = PRIORITY_NORMAL, conversation_id: Optional[str] = None,
+                    on_position: Optional[Callable[[int], Awaitable]] = None,
+                    timeout: Optional[float] = None):
+        """Async context manager holding an inference slot without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        callback = threadsafe_callback(loop, on_position) if on_position else None
+        ticket = self.enqueue(priority, conversation_id, callback, future=loop.create_future())
+        try:
+            await asyncio.wait_for(ticket.future, timeout)
+        except asyncio.TimeoutError:
+            # A grant racing the timeout is given back by abandon()
+            with self._cond:
+                self._timeouts += 1
+            self.abandon(ticket)
+            raise QueueTimeout(f"Timed out after {timeout:.0f}s waiting for an inference slot")
+        except asyncio.CancelledError:
+            self.abandon(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        """Return queue depth and wait time statistics"""
+        with self._cond:
+            depth_by_priority = {}
+            for ticket in self._waiting:
+                name = PRIORITY_NAMES.get(ticket.priority, str(ticket.priority))
+                depth_by_priority[name] = depth_by_priority.get(name, 0) + 1
+            now = time.monotonic()
+            oldest_wait = max((now - t.enqueued_at for t in self._waiting), default=0.0)
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._waiting),
+                'queue_depth_by_priority': depth_by_priority,
+                'oldest_wait_ms': round(oldest_wait * 1000, 1),
+                'granted': self._granted,
+                'completed': self._completed,
+                'timeouts': self._timeouts,
+                'avg_wait_ms': round(self._total_wait / self._granted * 1000, 1) if self._granted else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 1),
+            }
+
+    def _position(self, ticket: Ticket) -> int:
+        """Number of waiting requests that will be served before this one"""
+        key = ticket.sort_key()
+        return sum(1 for other in self._waiting if other.sort_key() < key)
+
+    def _dispatch(self):
+        """
+        Grant free slots in queue order and report new queue positions
+
+        Called with the lock held after every change to the queue or to the
+        number of slots in use.
+        """
+        queue = sorted(self._waiting, key=Ticket.sort_key)
+        while queue and self._in_flight < self.max_in_flight:
+            ticket = queue.pop(0)
+            self._grant(ticket)
+            if ticket.future is not None:
+                try:
+                    ticket.future.get_loop().call_soon_threadsafe(resolve_grant, ticket.future)
+                except RuntimeError:
+                    # Event loop closed: nobody will release this slot
+                    ticket.abandoned = True
+                    self._release(ticket)
+        # Threads in wait() report their own position
+        for position, ticket in enumerate(queue):
+            if ticket.future is not None and position != ticket.position:
+                ticket.position = position
+                notify_position(ticket, position)
+        self._cond.notify_all()
+
+    def _release(self, ticket: Ticket) -> bool:
+        if not ticket.granted or ticket.released:
+            return False
+        ticket.released = True
+        self._in_flight -= 1
+        self._completed += 1
+        return True
+
+    def _grant(self, ticket: Ticket):
+        self._waiting.remove(ticket)
+        self._in_flight += 1
+        ticket.granted = True
+        ticket.granted_at = time.monotonic()
+        self._virtual_time = max(self._virtual_time, ticket.start_tag)
+
+        wait = ticket.granted_at - ticket.enqueued_at
+        self._granted += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        
+        # Conversations that fell behind virtual time no longer need a tag
+        if len(self._last_finish) > 1024:
+            self._last_finish = {
+                key: tag for key, tag in self._last_finish.items() if tag > self._virtual_time
+            }
+
+
+def notify_position(ticket: Ticket, position: int):
+    if ticket.on_position:
+        try:
+            ticket.on_position(position)
+        except Exception as e:
+            print(f"Warning: queue position callback failed: {e}")
+
+
+def resolve_grant(future: asyncio.Future):
+    """Runs on the waiter's event loop; a cancelled waiter gives the slot back itself"""
+    if not future.done():
+        future.set_result(None)
+
+
+def threadsafe_callback(loop: asyncio.AbstractEventLoop,
+                        callback: Callable[[int], Awaitable]) -> Callable[[int], None]:
+    """Wrap an async callback so worker threads can schedule it on the event loop"""
+    pending = set()
+
+    def schedule(value):
+        task = asyncio.ensure_future(callback(value))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    def call(value: int):
+        try:
+            loop.call_soon_threadsafe(schedule, value)
+        except RuntimeError:
+            pass  # Event loop closed
+
+    return call
+
+
+# Global scheduler instance
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_inference_scheduler() -> InferenceScheduler:
+    """Get or create global inference scheduler instance"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                max_in_flight = int(os.getenv('LLM_MAX_IN_FLIGHT', '1'))
+                _scheduler = InferenceScheduler(max_in_flight=max_in_flight)
+    return _scheduler
+
+
+def get_queue_timeout() -> Optional[float]:
+    """Maximum seconds a request may wait for a slot, None to wait forever"""
+    value = os.getenv('LLM_QUEUE_TIMEOUT', '')
+    return float(value) if value else None
@@ -0,0 +1,426 @@
+"""
+BM25 inverted index over conversation titles, summaries and messages
+One document per conversation. Postings are append-only (row, term
+frequency) arrays per term: a new message only appends its terms, and
+frequencies of repeated rows are summed when a term is scored. Edited
+conversations get a fresh row; dead rows and repeated postings are dropped
+by an occasional compaction. Writes by other processes are picked up by
+comparing each changed conversation's updated_at and message count, and
+conversations deleted elsewhere are dropped when the counts disagree. Syncing
+runs on a background thread, never on the search path.
+"""
+import re
+import math
+import time
+import bisect
+import threading
+from array import array
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from django.db import close_old_connections
+from django.db.models import Count, Q
+from django.utils import timezone
+from api.models import Conversation, Message
+from .vector_index import top_k
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in is it its me my of on or so
+that the their them then there these they this to was we were what when where which who
+why will with you your
+""".split())
+
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms a trailing prefix (search-as-you-type) expands to at most
+MAX_PREFIX_TERMS = 64
+
+# Compact once dead or repeated postings make up this share of all postings
+COMPACT_RATIO = 0.5
+COMPACT_MIN_POSTINGS = 100000
+
+# Re-check conversations changed this much before the last sync
+SYNC_MARGIN_SECONDS = 60
+
+# The background sync runs this often
+SYNC_INTERVAL_SECONDS = 2
+
+# Conversations deleted by other processes are looked for at most this often
+DELETE_CHECK_INTERVAL_SECONDS = 60
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords and single letters"""
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if token not in STOPWORDS and (len(token) > 1 or token.isdigit())]
+
+
+class LexicalIndex:
+    """BM25 index of conversations keyed by conversation id"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._clear()
+        self._synced_at = None
+        self._deletes_checked_at = 0.0
+        self._sync_thread = None
+        self._stats = {'searches': 0, 'messages_added': 0, 'reindexed': 0, 'compactions': 0}
+
+    def _clear(self):
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._vocabulary: List[str] = []  # Sorted, for prefix lookups
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._versions: Dict[str, Tuple] = {}
+        self._lengths = array('f')
+        self._row_postings = array('l')
+        self._live = bytearray()
+        self._live_count = 0
+        self._total_length = 0.0
+        self._postings_count = 0
+        self._stale_postings = 0
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    def _new_row(self, conversation_id: str) -> int:
+        """Start a fresh document for a conversation, retiring its old one"""
+        self._retire(conversation_id)
+        row = len(self._ids)
+        self._ids.append(conversation_id)
+        self._rows[conversation_id] = row
+        self._lengths.append(0.0)
+        self._row_postings.append(0)
+        self._live.append(1)
+        self._live_count += 1
+        return row
+
+    def _retire(self, conversation_id: str):
+        row = self._rows.pop(conversation_id, None)
+        if row is None:
+            return
+        self._live[row] = 0
+        self._live_count -= 1
+        self._total_length -= self._lengths[row]
+        self._stale_postings += self._row_postings[row]
+        self._versions.pop(conversation_id, None)
+
+    def _add_text(self, row: int, text: str) -> int:
+        tokens = tokenize(text)
+        if not tokens:
+            return 0
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('i'), array('f'))
+                bisect.insort(self._vocabulary, term)
+            elif self._row_postings[row]:
+                # The row may already have this term: counted as repeated until compacted
+                self._stale_postings += 1
+            postings[0].append(row)
+            postings[1].append(tf)
+        self._lengths[row] += len(tokens)
+        self._row_postings[row] += len(counts)
+        self._total_length += len(tokens)
+        self._postings_count += len(counts)
+        return len(tokens)
+
+    def put_documents(self, documents: Iterable[Tuple[str, Tuple, List[str]]]):
+        """Index or replace conversations given as (id, version, texts)"""
+        with self._lock:
+            for conversation_id, version, texts in documents:
+                row = self._new_row(conversation_id)
+                for text in texts:
+                    self._add_text(row, text)
+                self._versions[conversation_id] = version
+                self._stats['reindexed'] += 1
+            self._maybe_compact()
+
+    def add_message(self, conversation_id: str, content: str) -> bool:
+        """Append a new message to its conversation's document"""
+        with self._lock:
+            row = self._rows.get(conversation_id)
+            if row is None:
+                # Not indexed yet: the next sync loads the whole conversation
+                return False
+            self._add_text(row, content)
+            updated_at, message_count = self._versions.get(conversation_id, (None, 0))
+            self._versions[conversation_id] = (updated_at, message_count + 1)
+            self._stats['messages_added'] += 1
+            self._maybe_compact()
+            return True
+
+    def remove(self, conversation_id: str):
+        with self._lock:
+            self._retire(conversation_id)
+
+    def reindex(self, conversation_ids: List[str]):
+        """Reload conversations from the database, dropping deleted ones"""
+        conversation_ids = [str(conversation_id) for conversation_id in conversation_ids]
+        documents = load_documents(conversation_ids)
+        found = {conversation_id for conversation_id, _, _ in documents}
+        with self._lock:
+            for conversation_id in conversation_ids:
+                if conversation_id not in found:
+                    self._retire(conversation_id)
+        self.put_documents(documents)
+
+    def rebuild(self):
+        """Index every conversation and message from the database"""
+        synced_at = timezone.now()
+        with self._lock:
+            self._clear()
+            for conversation_id, title, summary, updated_at in Conversation.objects.values_list(
+                'id', 'title', 'summary', 'updated_at'
+            ).order_by().iterator(chunk_size=2000):
+                conversation_id = str(conversation_id)
+                row = self._new_row(conversation_id)
+                self._add_text(row, f"{title}\n{summary}")
+                self._versions[conversation_id] = (updated_at, 0)
+            for conversation_id, content in Message.objects.exclude(content='').values_list(
+                'conversation_id', 'content'
+            ).order_by().iterator(chunk_size=5000):
+                conversation_id = str(conversation_id)
+                row = self._rows.get(conversation_id)
+                if row is None:
+                    continue  # Conversation created meanwhile, loaded by the next sync
+                self._add_text(row, content)
+                updated_at, message_count = self._versions[conversation_id]
+                self._versions[conversation_id] = (updated_at, message_count + 1)
+            self.compact()
+            self._synced_at = synced_at
+
+    def sync(self):
+        """Reload conversations changed by other processes since the last sync"""
+        if self._synced_at is None:
+            self.rebuild()
+            return
+        synced_at = timezone.now()
+        since = self._synced_at - timedelta(seconds=SYNC_MARGIN_SECONDS)
+        # Both filters are on indexed columns; default orderings would add a sort
+        candidates = set(Conversation.objects.filter(updated_at__gte=since).order_by().values_list('id', flat=True))
+        candidates.update(Message.objects.filter(created_at__gte=since).order_by().values_list(
+            'conversation_id', flat=True
+        ))
+        candidates = list(candidates)
+        changed = []
+        for start in range(0, len(candidates), 2000):
+            for conversation_id, updated_at, message_count in Conversation.objects.filter(
+                id__in=candidates[start:start + 2000]
+            ).annotate(
+                message_count=Count('messages', filter=~Q(messages__content=''))
+            ).values_list('id', 'updated_at', 'message_count').order_by():
+                if self._versions.get(str(conversation_id)) != (updated_at, message_count):
+                    changed.append(conversation_id)
+        for start in range(0, len(changed), 500):
+            self.reindex(changed[start:start + 500])
+        if time.monotonic() - self._deletes_checked_at >= DELETE_CHECK_INTERVAL_SECONDS:
+            self._deletes_checked_at = time.monotonic()
+            self._drop_deleted()
+        self._synced_at = synced_at
+
+    def _drop_deleted(self):
+        """Retire conversations deleted by another process"""
+        if len(self._versions) <= Conversation.objects.count():
+            return
+        # Only when the counts disagree are all ids read
+        existing = {str(conversation_id) for conversation_id in
+                    Conversation.objects.values_list('id', flat=True).iterator(chunk_size=5000)}
+        with self._lock:
+            for conversation_id in [c for c in self._versions if c not in existing]:
+                self._retire(conversation_id)
+
+    def start_sync(self, interval: float = SYNC_INTERVAL_SECONDS):
+        """Sync every `interval` seconds on a background thread"""
+        if self._sync_thread is None:
+            self._sync_thread = threading.Thread(
+                target=self._sync_loop, args=(interval,), name='lexical-index-sync', daemon=True
+            )
+            self._sync_thread.start()
+
+    def _sync_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Warning: Could not sync lexical index: {e}")
+            finally:
+                close_old_connections()
+
+    def _term_groups(self, query: str, prefix: bool) -> List[List[str]]:
+        """Indexed terms per query token; with `prefix` the last token matches word starts"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        groups = [[token] if token in self._postings else [] for token in tokens]
+        if prefix and tokens:
+            last = tokens[-1]
+            start = bisect.bisect_left(self._vocabulary, last)
+            end = bisect.bisect_left(self._vocabulary, last + '\U0010ffff')
+            expansions = self._vocabulary[start:end]
+            if len(expansions) > MAX_PREFIX_TERMS:
+                expansions = sorted(expansions, key=lambda term: -len(self._postings[term][0]))
+                expansions = expansions[:MAX_PREFIX_TERMS]
+            groups[-1] = expansions
+        return groups
+
+    def search(self, query: str, k: int = 10, require_all: bool = False,
+               prefix: bool = False) -> List[Tuple[str, float]]:
+        """
+        (conversation id, BM25 score) of the k best matching conversations, best first
+
+        Args:
+            query: Search text
+            k: Number of results
+            require_all: Only conversations containing every query word
+            prefix: Let the last query word match the start of longer words
+        """
+        with self._lock:
+            self._stats['searches'] += 1
+            groups = self._term_groups(query, prefix)
+            if not groups or not self._live_count or (require_all and not all(groups)):
+                return []
+            rows_total = len(self._ids)
+            live = np.frombuffer(bytes(self._live), dtype=np.uint8).astype(bool)
+            lengths = np.array(self._lengths, dtype=np.float32)
+            # Documents may all be empty, e.g. untitled conversations without messages yet
+            average_length = self._total_length / self._live_count or 1.0
+            norms = self.k1 * (1 - self.b + self.b * lengths / average_length)
+            scores = np.zeros(rows_total, dtype=np.float32)
+            matched = np.zeros(rows_total, dtype=np.int32)
+            for group in groups:
+                in_group = np.zeros(rows_total, dtype=bool)
+                for term in group:
+                    rows, tfs = self._postings[term]
+                    tf = np.bincount(np.array(rows, dtype=np.int32), weights=np.array(tfs, dtype=np.float32),
+                                     minlength=rows_total)
+                    hits = np.flatnonzero((tf > 0) & live)
+                    if not len(hits):
+                        continue
+                    idf = math.log(1 + (self._live_count - len(hits) + 0.5) / (len(hits) + 0.5))
+                    tf = tf[hits]
+                    scores[hits] += idf * tf * (self.k1 + 1) / (tf + norms[hits])
+                    in_group[hits] = True
+                matched += in_group
+            candidates = np.flatnonzero(matched == len(groups) if require_all else matched > 0)
+            best = candidates[top_k(scores[candidates], k)]
+            return [(self._ids[row], float(scores[row])) for row in best]
+
+    def _maybe_compact(self):
+        if (self._postings_count >= COMPACT_MIN_POSTINGS and
+                self._stale_postings > COMPACT_RATIO * self._postings_count):
+            self.compact()
+
+    def compact(self):
+        """Drop retired rows and merge repeated postings of the same row"""
+        with self._lock:
+            live = np.frombuffer(bytes(self._live), dtype=np.uint8).astype(bool)
+            remap = np.full(len(self._ids), -1, dtype=np.int64)
+            remap[live] = np.arange(int(live.sum()))
+            old_rows = np.flatnonzero(live)
+            self._ids = [self._ids[row] for row in old_rows]
+            self._rows = {conversation_id: row for row, conversation_id in enumerate(self._ids)}
+            self._lengths = array('f', np.array(self._lengths, dtype=np.float32)[old_rows].tobytes())
+            self._live = bytearray(b'\x01' * len(self._ids))
+            row_postings = np.zeros(len(self._ids), dtype=np.int64)
+            postings_count = 0
+            for term in list(self._postings):
+                rows, tfs = self._postings[term]
+                rows = np.array(rows, dtype=np.int32)
+                keep = live[rows]
+                unique_rows, inverse = np.unique(remap[rows[keep]], return_inverse=True)
+                if not len(unique_rows):
+                    del self._postings[term]
+                    continue
+                merged = np.bincount(inverse, weights=np.array(tfs, dtype=np.float32)[keep])
+                new_rows, new_tfs = array('i'), array('f')
+                new_rows.frombytes(unique_rows.astype(np.int32).tobytes())
+                new_tfs.frombytes(merged.astype(np.float32).tobytes())
+                self._postings[term] = (new_rows, new_tfs)
+                row_postings[unique_rows] += 1
+                postings_count += len(unique_rows)
+            self._row_postings = array('l', row_postings.tolist())
+            self._vocabulary = sorted(self._postings)
+            self._postings_count = postings_count
+            self._stale_postings = 0
+            self._stats['compactions'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'conversations': self._live_count,
+                'terms': len(self._postings),
+                'postings': self._postings_count,
+                'stale_postings': self._stale_postings,
+                **self._stats,
+            }
+
+
+def load_documents(conversation_ids: List[str]) -> List[Tuple[str, Tuple, List[str]]]:
+    """(id, version, texts) of conversations: title and summary, then the messages"""
+    documents = {}
+    for conversation_id, title, summary, updated_at in Conversation.objects.filter(
+        id__in=conversation_ids
+    ).values_list('id', 'title', 'summary', 'updated_at'):
+        documents[str(conversation_id)] = (updated_at, [f"{title}\n{summary}"])
+    for conversation_id, content in Message.objects.filter(
+        conversation_id__in=conversation_ids
+    ).exclude(content='').values_list('conversation_id', 'content').order_by():
+        document = documents.get(str(conversation_id))
+        if document is not None:
+            document[1].append(content)
+    return [
+        (conversation_id, (updated_at, len(texts) - 1), texts)
+        for conversation_id, (updated_at, texts) in documents.items()
+    ]
+
+
+# Global lexical index
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Get or create the global lexical index, built from the database on first use"""
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                index = LexicalIndex()
+                index.rebuild()
+                index.start_sync()
+                _lexical_index = index
+    return _lexical_index
+
+
+def index_message_text(message):
+    """Add a new message's text; nothing to do while the index is not built"""
+    if _lexical_index is None or not message.content:
+        return
+    try:
+        _lexical_index.add_message(str(message.conversation_id), message.content)
+    except Exception as e:
+        print(f"Warning: Could not add message to lexical index: {e}")
+
+
+def reindex_conversation(conversation_id):
+    """Reload a conversation after its title, summary or messages were edited or deleted"""
+    if _lexical_index is None:
+        return
+    try:
+        _lexical_index.reindex([conversation_id])
+    except Exception as e:
+        print(f"Warning: Could not reindex conversation {conversation_id}: {e}")
+
+
+def get_lexical_index_stats() -> Optional[Dict]:
+    """Stats of the lexical index, None until it is first used"""
+    return _lexical_index.stats() if _lexical_index is not None else None
@@ -4,15 +4,96 @@ Supports streaming responses for real-time chat
 """
 import os
 import json
-from typing import Iterator, Optional, List, Dict
-from llama_cpp import Llama
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterator, Optional, List, Dict, Union
 import requests
+from . import http_pool
+from .state_cache import create_state_cache
+from .runtime_config import get_llama_params
+from .completion_cache import get_completion_cache, max_cached_temperature
+from .inference_scheduler import (
+    PRIORITY_INTERACTIVE, PRIORITY_NORMAL, get_inference_scheduler, get_queue_timeout,
+    threadsafe_callback
+)
+
+try:
+    import httpx
+except ImportError:  # Async LM Studio streaming falls back to a worker thread
+    httpx = None
+
+if TYPE_CHECKING:
+    # llama.cpp is imported when a model is loaded, LM Studio mode never needs it
+    from llama_cpp import LlamaGrammar
+
+
+# Marks the end of a token stream produced by a worker thread
+_STREAM_END = object()
+
+
+class ModelMetrics:
+    """Thread-safe request counters for one model"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.completion_tokens = 0
+        self.total_seconds = 0.0
+        self.loads = 0
+        self.unloads = 0
+        self.last_used = time.time()
+    
+    def begin(self):
+        with self._lock:
+            self.active += 1
+            self.last_used = time.time()
+    
+    def end(self, seconds: float, error: bool = False):
+        with self._lock:
+            self.active -= 1
+            self.requests += 1
+            self.errors += 1 if error else 0
+            self.total_seconds += seconds
+            self.last_used = time.time()
+    
+    def add_tokens(self, count: int):
+        with self._lock:
+            self.completion_tokens += count
+    
+    def count_load(self):
+        with self._lock:
+            self.loads += 1
+    
+    def count_unload(self):
+        with self._lock:
+            self.unloads += 1
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'active': self.active,
+                'completion_tokens': self.completion_tokens,
+                'avg_latency_ms': round(self.total_seconds / self.requests * 1000, 1) if self.requests else 0.0,
+                'tokens_per_second': round(self.completion_tokens / self.total_seconds, 2) if self.total_seconds else 0.0,
+                'loads': self.loads,
+                'unloads': self.unloads,
+                'idle_seconds': round(time.time() - self.last_used, 1),
+            }
 
 
 class LLMClient:
     """Client for interacting with local LLM models"""
     
-    def __init__(self, model_path: Optional[str] = None, use_lm_studio: bool = False, lm_studio_url: str = "http://localhost:1234"):
+    def __init__(self, model_path: Optional[str] = None, use_lm_studio: bool = False, lm_studio_url: str = "http://localhost:1234",
+                 lm_studio_model: Optional[str] = None, name: str = 'default',
+                 llama_params: Optional[Dict] = None,
+                 on_load: Optional[Callable[['LLMClient'], None]] = None):
         """
         Initialize LLM client
         
@@ -20,20 +101,36 @@ class LLMClient:
             model_path: Path to .gguf model file (for direct llama.cpp)
             use_lm_studio: If True, use LM Studio API instead of direct model loading
             lm_studio_url: LM Studio API URL
+            lm_studio_model: Model id to request from LM Studio (server default if None)
+            name: Name of this model in the model registry
+            llama_params: llama.cpp settings overriding the runtime config
+            on_load: Called before the model is (re)loaded so the owner can free memory
         """
+        self.name = name
+        self.model_path = model_path
         self.use_lm_studio = use_lm_studio
         self.lm_studio_url = lm_studio_url
+        self.lm_studio_model = lm_studio_model
+        self.llama_params = llama_params or {}
+        self._on_load = on_load
+        self.metrics = ModelMetrics()
         self.model = None
+        self.draft_model = None
+        self.n_ctx = None
+        self._model_lock = threading.Lock()
+        self._stream_executor = None
+        self._async_http_client = None
+        self._async_http_loop = None
+        self._http_session = None
+        self._http_session_lock = threading.Lock()
+        self._http_stats = {'requests': 0, 'retries': 0, 'errors': 0}
+        self.state_cache = None
+        self._grammars: Dict[str, 'LlamaGrammar'] = {}
         
         if not use_lm_studio:
             if model_path and os.path.exists(model_path):
                 try:
-                    self.model = Llama(
-                        model_path=model_path,
-                        n_ctx=4096,  # Context window
-                        n_threads=4,  # CPU threads
-                        verbose=False
-                    )
+                    self._load_model()
                 except Exception as e:
                     print(f"Warning: Could not load model directly: {e}")
                     print("Falling back to LM Studio API")
@@ -42,75 +139,536 @@ class LLMClient:
                 print("Model path not provided or file not found. Using LM Studio API.")
                 self.use_lm_studio = True
     
-    def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.7, 
-                 stop: Optional[List[str]] = None) -> str:
-        """Generate a single response (non-streaming)"""
+    @property
+    def is_loaded(self) -> bool:
+        return self.model is not None
+    
+    @property
+    def memory_bytes(self) -> int:
+        """Approximate RAM used by the loaded weights"""
+        if self.use_lm_studio or not self.model_path or not os.path.exists(self.model_path):
+            return 0
+        return os.path.getsize(self.model_path)
+    
+    @property
+    def model_id(self) -> str:
+        """Identifies the weights behind this client, e.g. for cache keys"""
         if self.use_lm_studio:
-            return self._generate_lm_studio(prompt, max_tokens, temperature, stop)
+            return f"lm_studio:{self.lm_studio_model or 'default'}"
+        try:
+            stat = os.stat(self.model_path)
+            return f"gguf:{os.path.basename(self.model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        except (OSError, TypeError):
+            return f"gguf:{self.model_path}"
+    
+    @property
+    def context_window(self) -> int:
+        """Context size in tokens (configured n_ctx until the model is loaded)"""
+        if self.n_ctx is None:
+            self.n_ctx = get_llama_params(self.llama_params)['n_ctx']
+        return self.n_ctx
+    
+    def count_tokens(self, text: str) -> int:
+        """
+        Count tokens with the model's tokenizer
+        
+        LM Studio does not expose its tokenizer, and an unloaded model
+        should not be reloaded just to count, so those cases use a
+        conservative estimate of 3 characters per token.
+        """
+        if not text:
+            return 0
+        model = self.model
+        if model is not None:
+            return len(model.tokenize(text.encode('utf-8'), add_bos=False))
+        return len(text) // 3 + 1
+    
+    def _load_model(self):
+        """Load the llama.cpp model"""
+        from llama_cpp import Llama
+        from .speculative import create_draft_model
+        if self._on_load:
+            self._on_load(self)
+        params = get_llama_params(self.llama_params)
+        self.draft_model = create_draft_model(params)
+        if self.draft_model:
+            params['draft_model'] = self.draft_model
+        self.model = Llama(model_path=self.model_path, **params)
+        self.n_ctx = params['n_ctx']
+        if self.state_cache is None:
+            self.state_cache = create_state_cache()
+        self.metrics.count_load()
+    
+    def _ensure_model(self):
+        """Reload the model if it was unloaded; call with the model lock held"""
+        if self.model is None:
+            if not self.model_path:
+                raise RuntimeError("Model not loaded")
+            self._load_model()
+    
+    def unload(self, blocking: bool = True) -> bool:
+        """
+        Free the llama.cpp model; it is reloaded on next use
+        
+        Returns False when `blocking` is off and the model is busy.
+        """
+        if not self._model_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if self.model is None:
+                return True
+            self.model = None
+            if self.state_cache:
+                self.state_cache.clear()
+            self.metrics.count_unload()
+            return True
+        finally:
+            self._model_lock.release()
+    
+    def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.7, 
+                 stop: Optional[List[str]] = None, priority: int = PRIORITY_NORMAL,
+                 conversation_id: Optional[str] = None, cache: Optional[bool] = None,
+                 json_schema: Optional[Dict] = None) -> str:
+        """
+        Generate a single response (non-streaming)
+        
+        The call waits in the inference scheduler until a slot is free;
+        `priority` and `conversation_id` decide its place in the queue.
+        When the completion cache is enabled, calls at or below
+        LLM_COMPLETION_CACHE_MAX_TEMPERATURE are served from it; `cache`
+        forces caching on or off for a single call. With `json_schema` the
+        output is constrained to JSON matching the schema.
+        """
+        completion_cache = get_completion_cache()
+        cache_key = self._completion_cache_key(prompt, max_tokens, temperature, stop, cache,
+                                               json_schema)
+        if cache_key:
+            cached = completion_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        text = self._generate_scheduled(prompt, max_tokens, temperature, stop,
+                                        priority, conversation_id, json_schema)
+        if cache_key:
+            completion_cache.put(cache_key, text)
+        return text
+    
+    def _completion_cache_key(self, prompt: str, max_tokens: int, temperature: float,
+                              stop: Optional[List[str]], cache: Optional[bool],
+                              json_schema: Optional[Dict] = None) -> Optional[str]:
+        """Completion cache key for a call, None when it must not be cached"""
+        completion_cache = get_completion_cache()
+        if cache is None:
+            cache = temperature <= max_cached_temperature()
+        if not completion_cache or not cache:
+            return None
+        params = {
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'stop': stop or [],
+        }
+        if json_schema:
+            params['json_schema'] = json_schema
+        return completion_cache.make_key(self.model_id, prompt, params)
+    
+    def generate_json(self, prompt: str, json_schema: Dict, max_tokens: int = 512,
+                      temperature: float = 0.2, priority: int = PRIORITY_NORMAL,
+                      conversation_id: Optional[str] = None,
+                      cache: Optional[bool] = None) -> Dict:
+        """
+        Generate a JSON object matching `json_schema`
+        
+        Direct mode constrains decoding with a GBNF grammar built from the
+        schema; LM Studio uses its structured output support. Raises
+        ValueError if the response still is not valid JSON, e.g. when it
+        was cut off by max_tokens.
+        """
+        text = self.generate(prompt, max_tokens=max_tokens, temperature=temperature,
+                             priority=priority, conversation_id=conversation_id,
+                             cache=cache, json_schema=json_schema)
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Model returned invalid JSON: {e}")
+    
+    def generate_many(self, prompts: List[Union[str, Dict]], max_tokens: int = 512,
+                      temperature: float = 0.7, stop: Optional[List[str]] = None,
+                      priority: int = PRIORITY_NORMAL, conversation_id: Optional[str] = None,
+                      cache: Optional[bool] = None,
+                      max_concurrency: Optional[int] = None) -> List[Dict]:
+        """
+        Generate responses for several independent prompts
+        
+        A prompt is a string or a dict with "prompt" and optional
+        "max_tokens", "temperature", "stop" and "json_schema" overriding the call's
+        defaults. LM Studio receives up to `max_concurrency`
+        (LLM_BATCH_CONCURRENCY) requests at once under a single inference
+        slot. In direct mode the prompts are decoded back to back, each
+        with its own slot, so higher-priority requests (a chat turn) get in
+        between them; prompts sharing a prefix still reuse its evaluated
+        tokens.
+        
+        Returns one {"text", "error"} dict per prompt, in order. A failed
+        prompt has text None and the error message; it does not fail the
+        others.
+        """
+        items = []
+        for entry in prompts:
+            if isinstance(entry, str):
+                entry = {'prompt': entry}
+            items.append({
+                'prompt': entry['prompt'],
+                'max_tokens': entry.get('max_tokens', max_tokens),
+                'temperature': entry.get('temperature', temperature),
+                'stop': entry.get('stop', stop),
+                'json_schema': entry.get('json_schema'),
+            })
+        
+        completion_cache = get_completion_cache()
+        results: List[Optional[Dict]] = [None] * len(items)
+        pending = []
+        for index, item in enumerate(items):
+            cache_key = self._completion_cache_key(item['prompt'], item['max_tokens'],
+                                                   item['temperature'], item['stop'], cache,
+                                                   item['json_schema'])
+            cached = completion_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                results[index] = {'text': cached, 'error': None}
+            else:
+                pending.append((index, item, cache_key))
+        if not pending:
+            return results
+        
+        def run(item: Dict) -> Dict:
+            self.metrics.begin()
+            started = time.monotonic()
+            error = False
+            try:
+                if self.use_lm_studio:
+                    text = self._generate_lm_studio(item['prompt'], item['max_tokens'],
+                                                    item['temperature'], item['stop'],
+                                                    item['json_schema'])
+                else:
+                    text = self._generate_direct(item['prompt'], item['max_tokens'],
+                                                 item['temperature'], item['stop'],
+                                                 item['json_schema'])
+                return {'text': text, 'error': None}
+            except Exception as e:
+                error = True
+                return {'text': None, 'error': str(e)}
+            finally:
+                self.metrics.end(time.monotonic() - started, error)
+        
+        scheduler = get_inference_scheduler()
+        
+        def run_scheduled(item: Dict) -> Dict:
+            try:
+                with scheduler.slot(priority, conversation_id, timeout=get_queue_timeout()):
+                    return run(item)
+            except Exception as e:
+                # Never got a slot (e.g. queue timeout)
+                return {'text': None, 'error': str(e)}
+        
+        if self.use_lm_studio and len(pending) > 1:
+            try:
+                with scheduler.slot(priority, conversation_id, timeout=get_queue_timeout()):
+                    workers = max_concurrency or int(os.getenv('LLM_BATCH_CONCURRENCY', '4'))
+                    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending))),
+                                            thread_name_prefix='llm-batch') as executor:
+                        outputs = list(executor.map(run, [item for _, item, _ in pending]))
+            except Exception as e:
+                # Never got a slot (e.g. queue timeout): every pending prompt failed
+                outputs = [{'text': None, 'error': str(e)} for _ in pending]
         else:
-            return self._generate_direct(prompt, max_tokens, temperature, stop)
+            outputs = [run_scheduled(item) for _, item, _ in pending]
+        
+        for (index, _, cache_key), output in zip(pending, outputs):
+            results[index] = output
+            if cache_key and output['error'] is None:
+                completion_cache.put(cache_key, output['text'])
+        return results
+    
+    def _generate_scheduled(self, prompt: str, max_tokens: int, temperature: float,
+                            stop: Optional[List[str]], priority: int,
+                            conversation_id: Optional[str],
+                            json_schema: Optional[Dict] = None) -> str:
+        """Run one generation once the scheduler grants a slot"""
+        scheduler = get_inference_scheduler()
+        self.metrics.begin()
+        started = time.monotonic()
+        error = False
+        try:
+            with scheduler.slot(priority, conversation_id, timeout=get_queue_timeout()):
+                if self.use_lm_studio:
+                    return self._generate_lm_studio(prompt, max_tokens, temperature, stop,
+                                                    json_schema)
+                else:
+                    return self._generate_direct(prompt, max_tokens, temperature, stop,
+                                                 json_schema)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.metrics.end(time.monotonic() - started, error)
     
     def stream(self, prompt: str, max_tokens: int = 512, temperature: float = 0.7,
-               stop: Optional[List[str]] = None) -> Iterator[str]:
-        """Generate streaming response"""
-        if self.use_lm_studio:
-            yield from self._stream_lm_studio(prompt, max_tokens, temperature, stop)
-        else:
-            yield from self._stream_direct(prompt, max_tokens, temperature, stop)
+               stop: Optional[List[str]] = None, priority: int = PRIORITY_INTERACTIVE,
+               conversation_id: Optional[str] = None,
+               on_queue_position: Optional[Callable[[int], None]] = None,
+               keep_state: bool = False) -> Iterator[str]:
+        """
+        Generate streaming response
+        
+        The inference slot is held until the stream is exhausted or closed.
+        `on_queue_position` is called with the number of requests ahead
+        whenever that number changes while waiting. With `keep_state` the
+        llama.cpp state is cached per conversation, so the next turn of an
+        append-only prompt only evaluates its new tokens.
+        """
+        state_key = conversation_id if keep_state else None
+        scheduler = get_inference_scheduler()
+        self.metrics.begin()
+        started = time.monotonic()
+        error = False
+        try:
+            with scheduler.slot(priority, conversation_id, on_queue_position, get_queue_timeout()):
+                if self.use_lm_studio:
+                    tokens = self._stream_lm_studio(prompt, max_tokens, temperature, stop)
+                else:
+                    tokens = self._stream_direct(prompt, max_tokens, temperature, stop, state_key)
+                for token in tokens:
+                    self.metrics.add_tokens(1)
+                    yield token
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.metrics.end(time.monotonic() - started, error)
+    
+    async def astream(self, prompt: str, max_tokens: int = 512, temperature: float = 0.7,
+                      stop: Optional[List[str]] = None, priority: int = PRIORITY_INTERACTIVE,
+                      conversation_id: Optional[str] = None,
+                      on_queue_position: Optional[Callable[[int], Awaitable]] = None,
+                      keep_state: bool = False) -> AsyncIterator[str]:
+        """
+        Generate streaming response without blocking the event loop
+        
+        LM Studio is streamed over an async HTTP client when httpx is available.
+        The inference slot is awaited on the event loop; direct llama.cpp
+        decoding then runs on a dedicated single-thread executor and hands
+        tokens back through an asyncio queue. `on_queue_position` is awaited
+        on the event loop while the request waits for an inference slot.
+        """
+        state_key = conversation_id if keep_state else None
+        scheduler = get_inference_scheduler()
+        self.metrics.begin()
+        started = time.monotonic()
+        error = False
+        try:
+            async with scheduler.aslot(priority, conversation_id, on_queue_position,
+                                       get_queue_timeout()):
+                if self.use_lm_studio and httpx is not None:
+                    tokens = self._astream_lm_studio(prompt, max_tokens, temperature, stop)
+                else:
+                    tokens = self._astream_in_thread(prompt, max_tokens, temperature, stop, state_key)
+                async for token in tokens:
+                    self.metrics.add_tokens(1)
+                    yield token
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.metrics.end(time.monotonic() - started, error)
+    
+    def _get_stream_executor(self) -> ThreadPoolExecutor:
+        """Get the executor used to run blocking token streams"""
+        if self._stream_executor is None:
+            # Streams only get here once they hold an inference slot. A single
+            # Llama instance decodes on one thread at a time anyway; LM Studio
+            # without httpx gets a thread per slot
+            max_workers = get_inference_scheduler().max_in_flight if self.use_lm_studio else 1
+            self._stream_executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix='llm-stream'
+            )
+        return self._stream_executor
+    
+    async def _astream_in_thread(self, prompt: str, max_tokens: int, temperature: float,
+                                 stop: Optional[List[str]],
+                                 state_key: Optional[str]) -> AsyncIterator[str]:
+        """Run the blocking token stream in a worker thread and relay its tokens"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # Event loop already closed, nobody is listening anymore
+                cancelled.set()
+        
+        def produce():
+            if self.use_lm_studio:
+                tokens = self._stream_lm_studio(prompt, max_tokens, temperature, stop)
+            else:
+                tokens = self._stream_direct(prompt, max_tokens, temperature, stop, state_key)
+            try:
+                for token in tokens:
+                    if cancelled.is_set():
+                        break
+                    put(token)
+            except Exception as e:
+                put(e)
+            finally:
+                # Release the model lock right away
+                tokens.close()
+                put(_STREAM_END)
+        
+        loop.run_in_executor(self._get_stream_executor(), produce)
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stop the worker early if the consumer went away mid-stream
+            cancelled.set()
     
     def _generate_direct(self, prompt: str, max_tokens: int, temperature: float, 
-                        stop: Optional[List[str]]) -> str:
+                        stop: Optional[List[str]], json_schema: Optional[Dict] = None) -> str:
         """Generate using direct llama.cpp"""
-        if not self.model:
-            raise RuntimeError("Model not loaded")
-        
-        response = self.model(
-            prompt,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stop=stop or [],
-            echo=False
-        )
+        grammar = self._grammar_for(json_schema) if json_schema else None
+        with self._model_lock:
+            self._ensure_model()
+            draft_calls = self.draft_model.snapshot_calls() if self.draft_model else 0
+            started = time.monotonic()
+            response = self.model(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop or [],
+                echo=False,
+                grammar=grammar
+            )
+            completion_tokens = response.get('usage', {}).get('completion_tokens', 0)
+            if self.draft_model:
+                self.draft_model.record_completion(
+                    draft_calls, completion_tokens, time.monotonic() - started
+                )
+        self.metrics.add_tokens(completion_tokens)
         return response['choices'][0]['text']
     
+    def _grammar_for(self, json_schema: Dict) -> 'LlamaGrammar':
+        """GBNF grammar for a JSON schema, compiled once per schema"""
+        key = json.dumps(json_schema, sort_keys=True)
+        grammar = self._grammars.get(key)
+        if grammar is None:
+            from llama_cpp import LlamaGrammar
+            grammar = LlamaGrammar.from_json_schema(key, verbose=False)
+            self._grammars[key] = grammar
+        return grammar
+    
     def _stream_direct(self, prompt: str, max_tokens: int, temperature: float,
-                      stop: Optional[List[str]]) -> Iterator[str]:
+                      stop: Optional[List[str]], state_key: Optional[str] = None) -> Iterator[str]:
         """Stream using direct llama.cpp"""
-        if not self.model:
-            raise RuntimeError("Model not loaded")
-        
-        stream = self.model(
-            prompt,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stop=stop or [],
-            echo=False,
-            stream=True
-        )
-        
-        for output in stream:
-            if 'choices' in output and len(output['choices']) > 0:
-                delta = output['choices'][0].get('text', '')
-                if delta:
-                    yield delta
+        with self._model_lock:
+            self._ensure_model()
+            self._restore_state(state_key)
+            draft_calls = self.draft_model.snapshot_calls() if self.draft_model else 0
+            started = time.monotonic()
+            generated = 0
+            stream = self.model(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop or [],
+                echo=False,
+                stream=True
+            )
+            
+            for output in stream:
+                generated += 1
+                if 'choices' in output and len(output['choices']) > 0:
+                    delta = output['choices'][0].get('text', '')
+                    if delta:
+                        yield delta
+            
+            if self.draft_model:
+                self.draft_model.record_completion(draft_calls, generated, time.monotonic() - started)
+            self._save_state(state_key)
+    
+    def _restore_state(self, state_key: Optional[str]):
+        """
+        Load a conversation's cached llama.cpp state before evaluating its prompt
+        
+        Llama.generate() keeps the longest common prefix of the loaded tokens
+        and the new prompt, so only the appended turn is prefilled.
+        """
+        if not state_key or not self.state_cache:
+            return
+        state = self.state_cache.get(state_key)
+        if state is None:
+            return
+        try:
+            self.model.load_state(state)
+        except Exception as e:
+            print(f"Warning: Could not restore conversation state: {e}")
+            self.state_cache.discard(state_key)
+    
+    def _save_state(self, state_key: Optional[str]):
+        """Cache the llama.cpp state after a completed turn"""
+        if not state_key or not self.state_cache:
+            return
+        try:
+            self.state_cache.put(state_key, self.model.save_state())
+        except Exception as e:
+            print(f"Warning: Could not save conversation state: {e}")
+    
+    def forget_conversation(self, conversation_id: str):
+        """Drop cached per-conversation state, e.g. once a conversation ends"""
+        if self.state_cache:
+            self.state_cache.discard(conversation_id)
     
     def _generate_lm_studio(self, prompt: str, max_tokens: int, temperature: float,
-                           stop: Optional[List[str]]) -> str:
+                           stop: Optional[List[str]], json_schema: Optional[Dict] = None) -> str:
         """Generate using LM Studio API"""
         try:
-            response = requests.post(
-                f"{self.lm_studio_url}/v1/completions",
-                json={
-                    "prompt": prompt,
-                    "max_tokens": max_tokens,
-                    "temperature": temperature,
-                    "stop": stop or []
-                },
-                timeout=60
-            )
-            response.raise_for_status()
+            if json_schema:
+                # Structured output is only offered on the chat endpoint
+                response = self._post_lm_studio(
+                    "/v1/chat/completions",
+                    {
+                        "messages": [{"role": "user", "content": prompt}],
+                        "max_tokens": max_tokens,
+                        "temperature": temperature,
+                        "stop": stop or [],
+                        "response_format": {
+                            "type": "json_schema",
+                            "json_schema": {"name": "response", "strict": True, "schema": json_schema}
+                        }
+                    }
+                )
+            else:
+                response = self._post_lm_studio(
+                    "/v1/completions",
+                    {
+                        "prompt": prompt,
+                        "max_tokens": max_tokens,
+                        "temperature": temperature,
+                        "stop": stop or []
+                    }
+                )
             data = response.json()
-            return data['choices'][0]['text']
+            self.metrics.add_tokens((data.get('usage') or {}).get('completion_tokens', 0))
+            choice = data['choices'][0]
+            if json_schema:
+                return choice['message']['content']
+            return choice['text']
         except Exception as e:
             raise RuntimeError(f"LM Studio API error: {e}")
     
@@ -118,55 +676,149 @@ class LLMClient:
                          stop: Optional[List[str]]) -> Iterator[str]:
         """Stream using LM Studio API"""
         try:
-            response = requests.post(
-                f"{self.lm_studio_url}/v1/completions",
-                json={
+            response = self._post_lm_studio(
+                "/v1/completions",
+                {
                     "prompt": prompt,
                     "max_tokens": max_tokens,
                     "temperature": temperature,
                     "stop": stop or [],
                     "stream": True
                 },
-                stream=True,
-                timeout=60
+                stream=True
             )
-            response.raise_for_status()
             
-            for line in response.iter_lines():
-                if line:
-                    line_str = line.decode('utf-8')
-                    if line_str.startswith('data: '):
-                        data_str = line_str[6:]
-                        if data_str == '[DONE]':
+            # Closing the response hands the connection back to the pool
+            with response:
+                for line in response.iter_lines():
+                    if line:
+                        delta = self._parse_stream_line(line.decode('utf-8'))
+                        if delta is _STREAM_END:
                             break
-                        try:
-                            data = json.loads(data_str)
-                            if 'choices' in data and len(data['choices']) > 0:
-                                delta = data['choices'][0].get('text', '')
-                                if delta:
-                                    yield delta
-                        except json.JSONDecodeError:
-                            continue
+                        if delta:
+                            yield delta
         except Exception as e:
             raise RuntimeError(f"LM Studio API streaming error: {e}")
+    
+    def _get_http_session(self) -> requests.Session:
+        """Get the pooled keep-alive session shared by all threads"""
+        if self._http_session is None:
+            with self._http_session_lock:
+                if self._http_session is None:
+                    self._http_session = http_pool.create_session()
+        return self._http_session
+    
+    def _post_lm_studio(self, path: str, payload: Dict, stream: bool = False) -> requests.Response:
+        """POST to LM Studio over the pooled session, retrying transient failures"""
+        payload = self._lm_studio_payload(payload)
+        session = self._get_http_session()
+        try:
+            response = session.post(
+                f"{self.lm_studio_url}{path}",
+                json=payload,
+                stream=stream,
+                timeout=http_pool.get_timeouts()
+            )
+            response.raise_for_status()
+        except Exception:
+            self._record_http(errors=1)
+            raise
+        
+        retries = response.raw.retries if response.raw is not None else None
+        self._record_http(retries=len(retries.history) if retries else 0)
+        return response
+    
+    def _lm_studio_payload(self, payload: Dict) -> Dict:
+        """Add the LM Studio model id to a request body when one is configured"""
+        if self.lm_studio_model:
+            return dict(payload, model=self.lm_studio_model)
+        return payload
+    
+    def _record_http(self, retries: int = 0, errors: int = 0):
+        with self._http_session_lock:
+            self._http_stats['requests'] += 1
+            self._http_stats['retries'] += retries
+            self._http_stats['errors'] += errors
+    
+    def http_pool_stats(self) -> Dict:
+        """Return LM Studio connection pool statistics"""
+        with self._http_session_lock:
+            stats = dict(self._http_stats)
+        stats['pool_size'] = http_pool.get_pool_size()
+        stats['pools'] = http_pool.session_pool_stats(self._http_session) if self._http_session else {}
+        return stats
+    
+    def _get_async_http_client(self):
+        """Get an async HTTP client bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._async_http_client is None or self._async_http_loop is not loop:
+            self._async_http_client = http_pool.create_async_client()
+            self._async_http_loop = loop
+        return self._async_http_client
+    
+    async def _astream_lm_studio(self, prompt: str, max_tokens: int, temperature: float,
+                                 stop: Optional[List[str]]) -> AsyncIterator[str]:
+        """Stream using LM Studio API over an async HTTP client"""
+        client = self._get_async_http_client()
+        try:
+            async with client.stream(
+                'POST',
+                f"{self.lm_studio_url}/v1/completions",
+                json=self._lm_studio_payload({
+                    "prompt": prompt,
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "stop": stop or [],
+                    "stream": True
+                })
+            ) as response:
+                response.raise_for_status()
+                
+                async for line in response.aiter_lines():
+                    if line:
+                        delta = self._parse_stream_line(line)
+                        if delta is _STREAM_END:
+                            break
+                        if delta:
+                            yield delta
+        except Exception as e:
+            raise RuntimeError(f"LM Studio API streaming error: {e}")
+    
+    @staticmethod
+    def _parse_stream_line(line_str: str):
+        """Extract the text delta from one server-sent event line"""
+        if not line_str.startswith('data: '):
+            return None
+        data_str = line_str[6:]
+        if data_str == '[DONE]':
+            return _STREAM_END
+        try:
+            data = json.loads(data_str)
+        except json.JSONDecodeError:
+            return None
+        if 'choices' in data and len(data['choices']) > 0:
+            return data['choices'][0].get('text', '')
+        return None
+
 
+def get_llm_client(role: str = 'chat') -> LLMClient:
+    """
+    Get the LLM client serving a role
+    
+    Roles are mapped to models by the model registry (see LLM_MODELS);
+    with a single configured model every role shares the same client.
+    """
+    from .model_registry import get_model_pool
+    return get_model_pool().get_client(role)
 
-# Global LLM client instance
-_llm_client = None
 
+def forget_conversation(conversation_id: str):
+    """Drop cached state of a conversation without creating or loading a model"""
+    from .model_registry import get_model_pool
+    get_model_pool().forget_conversation(conversation_id)
 
-def get_llm_client() -> LLMClient:
-    """Get or create global LLM client instance"""
-    global _llm_client
-    if _llm_client is None:
-        model_path = os.getenv('MODEL_PATH', 'model.gguf')
-        use_lm_studio = os.getenv('USE_LM_STUDIO', 'false').lower() == 'true'
-        lm_studio_url = os.getenv('LM_STUDIO_URL', 'http://localhost:1234')
-        
-        _llm_client = LLMClient(
-            model_path=model_path,
-            use_lm_studio=use_lm_studio,
-            lm_studio_url=lm_studio_url
-        )
-    return _llm_client
 
+def get_llm_stats() -> Dict:
+    """Return runtime statistics without loading a model"""
+    from .model_registry import get_model_pool
+    return get_model_pool().stats()
@@ -0,0 +1,225 @@
+"""
+Model registry routing tasks to models by role
+Loads models lazily and unloads idle ones to stay within a memory budget
+"""
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+from .llm_client import LLMClient
+
+
+# Roles a model can serve
+ROLE_CHAT = 'chat'  # Interactive chat replies
+ROLE_ANALYSIS = 'analysis'  # Summaries, sentiment, topics, action items
+ROLE_QUERY = 'query'  # Answering questions about past conversations
+
+ALL_ROLES = [ROLE_CHAT, ROLE_ANALYSIS, ROLE_QUERY]
+
+
+def load_model_specs() -> List[Dict]:
+    """
+    Read model declarations
+
+    LLM_MODELS holds a JSON list (or a path to a JSON file) of models, e.g.
+    [{"name": "chat", "model_path": "llama-8b.gguf", "roles": ["chat", "query"]},
+     {"name": "small", "model_path": "qwen-1.5b.gguf", "roles": ["analysis"],
+      "n_ctx": 2048}]
+    An entry may use "lm_studio_model" instead of "model_path". Any other key
+    is passed to llama.cpp, except "draft" ("prompt_lookup" or a draft .gguf
+    path) and "draft_num_pred_tokens", which enable speculative decoding.
+    Without LLM_MODELS the single MODEL_PATH / USE_LM_STUDIO model serves
+    every role.
+    """
+    use_lm_studio = os.getenv('USE_LM_STUDIO', 'false').lower() == 'true'
+    raw = os.getenv('LLM_MODELS', '').strip()
+    if raw and not raw.startswith('['):
+        with open(raw) as f:
+            raw = f.read()
+
+    if not raw:
+        return [{
+            'name': 'default',
+            'model_path': os.getenv('MODEL_PATH', 'model.gguf'),
+            'use_lm_studio': use_lm_studio,
+            'roles': list(ALL_ROLES),
+        }]
+
+    specs = json.loads(raw)
+    for spec in specs:
+        if 'name' not in spec:
+            raise ValueError(f"Model declaration without a name: {spec}")
+        spec.setdefault('roles', [])
+        spec.setdefault('use_lm_studio', use_lm_studio or 'lm_studio_model' in spec)
+    return specs
+
+
+class ModelPool:
+    """Lazily loaded models with LRU and idle-timeout unloading"""
+
+    # Keys of a model declaration that are not llama.cpp settings
+    SPEC_KEYS = {'name', 'roles', 'model_path', 'lm_studio_model', 'use_lm_studio', 'lm_studio_url'}
+
+    def __init__(self, specs: List[Dict], memory_budget_bytes: int = 0, idle_timeout: float = 0):
+        """
+        Initialize model pool
+
+        Args:
+            specs: Model declarations, see load_model_specs()
+            memory_budget_bytes: Max total size of loaded model files, 0 for unlimited
+            idle_timeout: Seconds without requests before a model is unloaded, 0 to never
+        """
+        self.specs = {spec['name']: spec for spec in specs}
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_timeout = idle_timeout
+        self._clients: Dict[str, LLMClient] = {}
+        self._lock = threading.RLock()
+        # Model name -> lock held while that model is being created
+        self._loading: Dict[str, threading.Lock] = {}
+        self._evictions = 0
+
+        # Role -> model name; first declaration claiming a role wins
+        self.routes = {}
+        for spec in specs:
+            for role in spec['roles']:
+                self.routes.setdefault(role, spec['name'])
+
+        if idle_timeout > 0:
+            sweeper = threading.Thread(target=self._sweep_idle, name='llm-idle-unload', daemon=True)
+            sweeper.start()
+
+    def model_for_role(self, role: str) -> str:
+        """Name of the model serving a role, falling back to the chat model"""
+        if role in self.routes:
+            return self.routes[role]
+        if ROLE_CHAT in self.routes:
+            return self.routes[ROLE_CHAT]
+        return next(iter(self.specs))
+
+    def get_client(self, role: str = ROLE_CHAT) -> LLMClient:
+        """Get (creating on first use) the client for a role"""
+        name = self.model_for_role(role)
+        with self._lock:
+            client = self._clients.get(name)
+            if client is not None:
+                return client
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        # Load outside the pool lock so stats(), other models and _make_room()
+        # are not blocked; concurrent callers for the same model wait here
+        with loading:
+            with self._lock:
+                client = self._clients.get(name)
+            if client is None:
+                client = self._create_client(self.specs[name])
+                with self._lock:
+                    self._clients[name] = client
+                    self._loading.pop(name, None)
+            return client
+
+    def _create_client(self, spec: Dict) -> LLMClient:
+        llama_params = {key: value for key, value in spec.items() if key not in self.SPEC_KEYS}
+        return LLMClient(
+            model_path=spec.get('model_path'),
+            use_lm_studio=spec['use_lm_studio'],
+            lm_studio_url=spec.get('lm_studio_url') or os.getenv('LM_STUDIO_URL', 'http://localhost:1234'),
+            lm_studio_model=spec.get('lm_studio_model'),
+            name=spec['name'],
+            llama_params=llama_params,
+            on_load=self._make_room,
+        )
+
+    def _make_room(self, loading: LLMClient):
+        """Unload least recently used idle models until `loading` fits the budget"""
+        if not self.memory_budget_bytes:
+            return
+        with self._lock:
+            needed = loading.memory_bytes
+            loaded = [
+                client for client in self._clients.values()
+                if client is not loading and client.is_loaded
+            ]
+            used = sum(client.memory_bytes for client in loaded)
+            loaded.sort(key=lambda client: client.metrics.last_used)
+            for client in loaded:
+                if used + needed <= self.memory_budget_bytes:
+                    break
+                if client.metrics.active:
+                    continue
+                if client.unload(blocking=False):
+                    used -= client.memory_bytes
+                    self._evictions += 1
+            if used + needed > self.memory_budget_bytes:
+                print(f"Warning: loading model '{loading.name}' exceeds the memory budget")
+
+    def _sweep_idle(self):
+        """Background loop unloading models idle longer than idle_timeout"""
+        interval = max(1.0, min(self.idle_timeout / 2, 60.0))
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            with self._lock:
+                clients = list(self._clients.values())
+            for client in clients:
+                if (client.is_loaded and not client.metrics.active
+                        and now - client.metrics.last_used > self.idle_timeout):
+                    if client.unload(blocking=False):
+                        print(f"Unloaded idle model '{client.name}'")
+
+    def forget_conversation(self, conversation_id: str):
+        """Drop cached state of a conversation in every client created so far"""
+        with self._lock:
+            clients = list(self._clients.values())
+        for client in clients:
+            client.forget_conversation(conversation_id)
+
+    def stats(self) -> Dict:
+        """Per-model metrics and routing, without loading anything"""
+        with self._lock:
+            clients = dict(self._clients)
+            evictions = self._evictions
+        models = {}
+        for name, spec in self.specs.items():
+            client = clients.get(name)
+            entry = {
+                'roles': spec['roles'],
+                'backend': 'lm_studio' if spec['use_lm_studio'] else 'llama.cpp',
+                'loaded': bool(client and client.is_loaded),
+            }
+            if client:
+                entry['backend'] = 'lm_studio' if client.use_lm_studio else 'llama.cpp'
+                entry['metrics'] = client.metrics.snapshot()
+                entry['memory_bytes'] = client.memory_bytes if client.is_loaded else 0
+                if client.use_lm_studio:
+                    entry['http_pool'] = client.http_pool_stats()
+                if client.state_cache:
+                    entry['state_cache'] = client.state_cache.stats()
+                if client.draft_model:
+                    entry['speculative'] = client.draft_model.stats()
+            models[name] = entry
+        return {
+            'routes': {role: self.model_for_role(role) for role in ALL_ROLES},
+            'memory_budget_bytes': self.memory_budget_bytes,
+            'evictions': evictions,
+            'models': models,
+        }
+
+
+# Global model pool instance
+_model_pool = None
+_model_pool_lock = threading.Lock()
+
+
+def get_model_pool() -> ModelPool:
+    """Get or create global model pool instance"""
+    global _model_pool
+    if _model_pool is None:
+        with _model_pool_lock:
+            if _model_pool is None:
+                _model_pool = ModelPool(
+                    load_model_specs(),
+                    memory_budget_bytes=int(os.getenv('LLM_MEMORY_BUDGET_MB', '0')) * 1024 * 1024,
+                    idle_timeout=float(os.getenv('LLM_IDLE_UNLOAD_SECONDS', '0')),
+                )
+    return _model_pool
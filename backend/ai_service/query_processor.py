@@ -5,13 +5,14 @@ from typing import Dict, List, Optional, Tuple
 from api.models import Conversation, Message
 from .semantic_search import SemanticSearch
 from .llm_client import get_llm_client
+from .model_registry import ROLE_QUERY
 
 
 class QueryProcessor:
     """Process queries about past conversations"""
     
     def __init__(self):
-        self.llm_client = get_llm_client()
+        self.llm_client = get_llm_client(ROLE_QUERY)
         self.semantic_search = SemanticSearch()
     
     def process_query(self, query: str, date_range: Optional[Tuple] = None,
@@ -27,9 +28,12 @@ class QueryProcessor:
         Returns:
             Dict with answer and relevant excerpts
         """
+        # Encode the query once for the conversation and all message searches
+        query_embedding = self.semantic_search.embedding_service.generate_embedding(query)
+        
         # Find relevant conversations
         relevant_convs = self.semantic_search.search_conversations(
-            query, limit=limit, date_range=date_range
+            query, limit=limit, date_range=date_range, query_embedding=query_embedding
         )
         
         if not relevant_convs:
@@ -49,7 +53,7 @@ class QueryProcessor:
             
             # Get relevant messages from this conversation
             relevant_messages = self.semantic_search.search_messages(
-                query, conversation_id=str(conv.id), limit=3
+                query, conversation_id=str(conv.id), limit=3, query_embedding=query_embedding
             )
             
             conv_text = f"Conversation from {conv.start_time.strftime('%Y-%m-%d')}:\n"
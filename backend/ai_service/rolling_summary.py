@@ -0,0 +1,283 @@
+"""
+Hierarchical rolling summaries for conversations longer than the context window
+Every SUMMARY_CHUNK_MESSAGES messages get a stored chunk summary as the
+conversation grows; every SUMMARY_FAN_IN chunks of one level are merged into
+a chunk of the next level. Only complete spans are stored, so stored chunks
+never change and summarizing costs work proportional to the new messages.
+"""
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from django.db import close_old_connections
+from api.models import Conversation, ConversationSummaryChunk, Message
+from .llm_client import get_llm_client
+from .inference_scheduler import PRIORITY_BACKGROUND
+from .model_registry import ROLE_ANALYSIS
+from .context_builder import SAFETY_MARGIN_TOKENS
+
+
+# Tokens generated per chunk or merge summary
+CHUNK_SUMMARY_TOKENS = 200
+
+CHUNK_INSTRUCTION = """Summarize this part of a conversation in a few sentences.
+Keep decisions, facts and open tasks."""
+
+MERGE_INSTRUCTION = """These are summaries of consecutive parts of one conversation.
+Combine them into a single concise summary that keeps decisions, facts and open tasks."""
+
+
+def get_chunk_messages() -> int:
+    return max(2, int(os.getenv('SUMMARY_CHUNK_MESSAGES', '20')))
+
+
+def get_fan_in() -> int:
+    return max(2, int(os.getenv('SUMMARY_FAN_IN', '8')))
+
+
+def rolling_enabled() -> bool:
+    """Whether chunk summaries are kept up to date while a conversation is active"""
+    return os.getenv('SUMMARY_ROLLING', 'true').lower() == 'true'
+
+
+def render_messages(messages) -> str:
+    return "\n".join(f"{msg.sender.upper()}: {msg.content}" for msg in messages)
+
+
+def render_parts(summaries: List[str]) -> str:
+    return "\n\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(summaries))
+
+
+class RollingSummarizer:
+    """Maintain and condense the stored summary chunks of a conversation"""
+
+    def __init__(self, llm_client=None):
+        self.llm_client = llm_client or get_llm_client(ROLE_ANALYSIS)
+        self.chunk_messages = get_chunk_messages()
+        self.fan_in = get_fan_in()
+
+    def budget(self, fixed_text: str, max_tokens: int) -> int:
+        """Tokens left for content next to `fixed_text` and a reply of `max_tokens`"""
+        reserved = self.llm_client.count_tokens(fixed_text) + max_tokens + SAFETY_MARGIN_TOKENS
+        return max(0, self.llm_client.context_window - reserved)
+
+    def truncate(self, text: str, budget: int) -> str:
+        """Cut `text` to roughly `budget` tokens"""
+        tokens = self.llm_client.count_tokens(text)
+        if tokens <= budget:
+            return text
+        # Proportional cut with a little slack for uneven token lengths
+        return text[:int(len(text) * budget / tokens * 0.9)]
+
+    def _chunk_prompt(self, text: str) -> str:
+        text = self.truncate(text, self.budget(CHUNK_INSTRUCTION, CHUNK_SUMMARY_TOKENS) - 16)
+        return f"""Conversation excerpt:
+{text}
+
+{CHUNK_INSTRUCTION}
+
+Summary:"""
+
+    def _merge_prompt(self, summaries: List[str]) -> str:
+        parts = self.truncate(render_parts(summaries),
+                              self.budget(MERGE_INSTRUCTION, CHUNK_SUMMARY_TOKENS) - 16)
+        return f"""Summaries of conversation parts:
+{parts}
+
+{MERGE_INSTRUCTION}
+
+Summary:"""
+
+    def _summarize(self, conversation: Conversation, prompts: List[str]) -> List[Optional[str]]:
+        """Run summary prompts as one batch; None for prompts that failed"""
+        if not prompts:
+            return []
+        results = self.llm_client.generate_many(
+            prompts,
+            max_tokens=CHUNK_SUMMARY_TOKENS,
+            temperature=0.3,
+            priority=PRIORITY_BACKGROUND,
+            conversation_id=str(conversation.id)
+        )
+        summaries = []
+        for result in results:
+            text = (result['text'] or '').strip()
+            if result['error'] or not text:
+                print(f"Error generating chunk summary: {result['error'] or 'empty response'}")
+                summaries.append(None)
+            else:
+                summaries.append(text)
+        return summaries
+
+    def _valid_chunks(self, conversation: Conversation,
+                      messages: List[Message]) -> Dict[int, List[ConversationSummaryChunk]]:
+        """
+        Stored chunks per level that still match the conversation
+
+        A level-0 chunk is stale once its span no longer ends on the same
+        message (messages deleted, chunk size changed); it is deleted
+        together with every later chunk and every chunk built on it.
+        """
+        stored = defaultdict(list)
+        for chunk in conversation.summary_chunks.all():
+            stored[chunk.level].append(chunk)
+
+        valid = {}
+        size = self.chunk_messages
+        children = None
+        level = 0
+        while level in stored or children:
+            kept = []
+            for chunk in stored.get(level, []):
+                index = len(kept)
+                if level == 0:
+                    start, end = index * size, (index + 1) * size
+                    ok = (end <= len(messages) and chunk.last_message_id == messages[end - 1].id)
+                else:
+                    group = children[index * self.fan_in:(index + 1) * self.fan_in]
+                    ok = len(group) == self.fan_in
+                    if ok:
+                        start, end = group[0].start_message, group[-1].end_message
+                ok = ok and chunk.index == index and (chunk.start_message, chunk.end_message) == (start, end)
+                if not ok:
+                    break
+                kept.append(chunk)
+
+            stale = [chunk.id for chunk in stored.get(level, [])[len(kept):]]
+            if stale:
+                ConversationSummaryChunk.objects.filter(id__in=stale).delete()
+            valid[level] = kept
+            children = kept
+            level += 1
+        return valid
+
+    @staticmethod
+    def _store(conversation: Conversation, level: int, index: int, start: int, end: int,
+               last_message: Optional[Message], summary: str) -> ConversationSummaryChunk:
+        # A concurrent update may have stored the same span first; keep that one
+        chunk, _ = ConversationSummaryChunk.objects.get_or_create(
+            conversation=conversation,
+            level=level,
+            index=index,
+            defaults={
+                'start_message': start,
+                'end_message': end,
+                'last_message': last_message,
+                'summary': summary,
+            }
+        )
+        return chunk
+
+    def update(self, conversation: Conversation,
+               messages: Optional[List[Message]] = None) -> Dict[int, List[ConversationSummaryChunk]]:
+        """Summarize and store every complete span that has no chunk yet"""
+        if messages is None:
+            messages = list(conversation.messages.all().order_by('timestamp'))
+        chunks = self._valid_chunks(conversation, messages)
+        size = self.chunk_messages
+
+        level0 = chunks.setdefault(0, [])
+        spans = list(range(len(level0), len(messages) // size))
+        summaries = self._summarize(conversation, [
+            self._chunk_prompt(render_messages(messages[i * size:(i + 1) * size])) for i in spans
+        ])
+        for i, summary in zip(spans, summaries):
+            if summary is None:
+                # Chunks must stay contiguous, retry from here next time
+                break
+            level0.append(self._store(conversation, 0, i, i * size, (i + 1) * size,
+                                      messages[(i + 1) * size - 1], summary))
+
+        level = 0
+        while len(chunks[level]) >= self.fan_in:
+            children = chunks[level]
+            parents = chunks.setdefault(level + 1, [])
+            groups = list(range(len(parents), len(children) // self.fan_in))
+            summaries = self._summarize(conversation, [
+                self._merge_prompt([c.summary for c in children[g * self.fan_in:(g + 1) * self.fan_in]])
+                for g in groups
+            ])
+            for g, summary in zip(groups, summaries):
+                if summary is None:
+                    break
+                group = children[g * self.fan_in:(g + 1) * self.fan_in]
+                parents.append(self._store(conversation, level + 1, g, group[0].start_message,
+                                           group[-1].end_message, group[-1].last_message, summary))
+            level += 1
+        return chunks
+
+    def condense(self, conversation: Conversation, messages: List[Message], budget: int) -> str:
+        """
+        Ordered part summaries of the whole conversation within `budget` tokens
+
+        Stored chunks are reused; the trailing messages not covered by a
+        stored chunk and any incomplete merge groups are summarized on the
+        fly without being stored.
+        """
+        chunks = self.update(conversation, messages)
+        size = self.chunk_messages
+
+        items = [chunk.summary for chunk in chunks.get(0, [])]
+        covered = chunks[0][-1].end_message if chunks.get(0) else 0
+        tail = [messages[i:i + size] for i in range(covered, len(messages), size)]
+        tail_summaries = self._summarize(conversation, [
+            self._chunk_prompt(render_messages(span)) for span in tail
+        ])
+        for span, summary in zip(tail, tail_summaries):
+            items.append(summary or self.truncate(render_messages(span), CHUNK_SUMMARY_TOKENS))
+
+        level = 0
+        while len(items) > 1 and self.llm_client.count_tokens(render_parts(items)) > budget:
+            parents = chunks.get(level + 1, [])
+            rest = items[len(parents) * self.fan_in:]
+            groups = [rest[i:i + self.fan_in] for i in range(0, len(rest), self.fan_in)]
+            merged = iter(self._summarize(conversation, [
+                self._merge_prompt(group) for group in groups if len(group) > 1
+            ]))
+            items = [parent.summary for parent in parents]
+            for group in groups:
+                if len(group) == 1:
+                    items.append(group[0])
+                else:
+                    summary = next(merged)
+                    items.append(summary or self.truncate(" ".join(group), CHUNK_SUMMARY_TOKENS))
+            level += 1
+
+        return self.truncate(render_parts(items), budget)
+
+
+# Background updates of chunk summaries while conversations are active
+_update_executor = None
+_scheduled = set()
+_schedule_lock = threading.Lock()
+
+
+def schedule_summary_update(conversation_id: str):
+    """Bring a conversation's chunk summaries up to date in the background"""
+    if not rolling_enabled():
+        return
+    global _update_executor
+    with _schedule_lock:
+        if conversation_id in _scheduled:
+            return
+        _scheduled.add(conversation_id)
+        if _update_executor is None:
+            _update_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rolling-summary')
+    _update_executor.submit(_run_summary_update, conversation_id)
+
+
+def _run_summary_update(conversation_id: str):
+    with _schedule_lock:
+        # Messages arriving from now on schedule another pass
+        _scheduled.discard(conversation_id)
+    close_old_connections()
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+        complete = conversation.messages.count() // get_chunk_messages()
+        if conversation.summary_chunks.filter(level=0).count() < complete:
+            RollingSummarizer().update(conversation)
+    except Exception as e:
+        print(f"Warning: Could not update rolling summary: {e}")
+    finally:
+        close_old_connections()
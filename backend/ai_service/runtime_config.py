@@ -0,0 +1,128 @@
+"""
+llama.cpp runtime parameters
+Built from host detection, the tune_llm output file and environment variables
+"""
+import os
+import json
+from typing import Dict, Optional
+from django.conf import settings
+
+
+# Settings written by `manage.py tune_llm` and read back at model load
+TUNABLE_PARAMS = ['n_threads', 'n_threads_batch', 'n_batch']
+
+# Environment variable -> (llama.cpp parameter, type)
+ENV_PARAMS = {
+    'LLM_N_CTX': ('n_ctx', int),
+    'LLM_N_THREADS': ('n_threads', int),
+    'LLM_N_THREADS_BATCH': ('n_threads_batch', int),
+    'LLM_N_BATCH': ('n_batch', int),
+    'LLM_N_GPU_LAYERS': ('n_gpu_layers', int),
+    'LLM_USE_MMAP': ('use_mmap', bool),
+    'LLM_USE_MLOCK': ('use_mlock', bool),
+    'LLM_ROPE_FREQ_BASE': ('rope_freq_base', float),
+    'LLM_ROPE_FREQ_SCALE': ('rope_freq_scale', float),
+    # Speculative decoding, see speculative.create_draft_model()
+    'LLM_DRAFT_MODEL': ('draft', str),
+    'LLM_DRAFT_NUM_PRED_TOKENS': ('draft_num_pred_tokens', int),
+}
+
+
+def available_cpus() -> int:
+    """Logical CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def physical_cores() -> int:
+    """
+    Physical cores available to this process
+
+    Decode is memory bound and gains nothing from hyper-threads, so this is
+    the default thread count. Falls back to the logical count when
+    /proc/cpuinfo is unavailable.
+    """
+    logical = available_cpus()
+    try:
+        cores = set()
+        physical_id = core_id = None
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('physical id'):
+                    physical_id = line.split(':', 1)[1].strip()
+                elif line.startswith('core id'):
+                    core_id = line.split(':', 1)[1].strip()
+                elif not line.strip():
+                    if core_id is not None:
+                        cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+        if cores:
+            # Affinity may restrict us to fewer CPUs than the machine has
+            return max(1, min(len(cores), logical))
+    except OSError:
+        pass
+    return logical
+
+
+def default_params() -> Dict:
+    """Host-derived defaults"""
+    return {
+        'n_ctx': 4096,
+        'n_threads': physical_cores(),
+        # Prompt processing is compute bound and can use every logical CPU
+        'n_threads_batch': available_cpus(),
+        'n_batch': 512,
+        'use_mmap': True,
+        'use_mlock': False,
+    }
+
+
+def tuning_file_path() -> str:
+    return os.getenv('LLM_TUNING_FILE', os.path.join(settings.BASE_DIR, 'llm_tuning.json'))
+
+
+def load_tuned_params(path: Optional[str] = None) -> Dict:
+    """Read the best configuration written by tune_llm, if any"""
+    path = path or tuning_file_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read LLM tuning file {path}: {e}")
+        return {}
+    return {key: data[key] for key in TUNABLE_PARAMS if key in data}
+
+
+def env_params() -> Dict:
+    """llama.cpp parameters set through environment variables"""
+    params = {}
+    for env_name, (param, cast) in ENV_PARAMS.items():
+        value = os.getenv(env_name, '').strip()
+        if not value:
+            continue
+        if cast is bool:
+            params[param] = value.lower() == 'true'
+        else:
+            params[param] = cast(value)
+    return params
+
+
+def get_llama_params(overrides: Optional[Dict] = None) -> Dict:
+    """
+    Resolve llama.cpp constructor parameters
+
+    Later sources win: host defaults, tune_llm file, environment,
+    per-model overrides from the model registry.
+    """
+    params = default_params()
+    params.update(load_tuned_params())
+    params.update(env_params())
+    params.update(overrides or {})
+    params.setdefault('verbose', False)
+    return params
@@ -4,18 +4,42 @@ Semantic search for finding relevant conversations and messages
 from typing import List, Dict, Tuple, Optional
 from api.models import Conversation, Message
 from .embedding_service import get_embedding_service
-from .llm_client import get_llm_client
+from .vector_index import get_vector_index
+from .conversation_embeddings import get_conversation_index
+from .lexical_index import get_lexical_index
+
+
+SEARCH_MODES = ('lexical', 'semantic', 'hybrid')
+
+# Rank offset of reciprocal rank fusion; keeps a single top rank from dominating
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Merge rankings by summing 1 / (k + rank) per item, best first"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
 
 
 class SemanticSearch:
     """Semantic search across conversations"""
     
-    def __init__(self):
-        self.embedding_service = get_embedding_service()
-        self.llm_client = get_llm_client()
+    def __init__(self, embedding_service=None):
+        self._embedding_service = embedding_service
+    
+    @property
+    def embedding_service(self):
+        """Loaded on first use, keyword-only searches need no model"""
+        if self._embedding_service is None:
+            self._embedding_service = get_embedding_service()
+        return self._embedding_service
     
     def search_conversations(self, query: str, limit: int = 10, 
-                           date_range: Optional[Tuple] = None) -> List[Dict]:
+                           date_range: Optional[Tuple] = None,
+                           query_embedding: Optional[List[float]] = None) -> List[Dict]:
         """
         Search conversations by semantic similarity
         
@@ -23,49 +47,97 @@ class SemanticSearch:
             query: Search query text
             limit: Maximum number of results
             date_range: Optional tuple of (start_date, end_date)
+            query_embedding: Embedding of the query, when the caller already has it
         
         Returns:
             List of conversation dicts with similarity scores
         """
-        query_embedding = self.embedding_service.generate_embedding(query)
+        if query_embedding is None:
+            query_embedding = self.embedding_service.generate_embedding(query)
         if not query_embedding:
             return []
         
-        # Get all conversations (or filtered by date)
-        conversations = Conversation.objects.filter(status='ended')
-        if date_range:
-            start_date, end_date = date_range
-            conversations = conversations.filter(start_time__range=[start_date, end_date])
+        return self._search_conversations_by_embedding(query_embedding, limit, date_range)
+    
+    def hybrid_search_conversations(self, query: str, limit: int = 10,
+                                    mode: str = 'hybrid') -> List[Dict]:
+        """
+        Search conversations by keywords (BM25), by meaning, or both
+        
+        Args:
+            query: Search query text
+            limit: Maximum number of results
+            mode: "lexical", "semantic" or "hybrid" (both, reciprocal rank fused)
+        
+        Returns:
+            List of ended conversation dicts with a score, plus the similarity
+            and BM25 score of the rankings the conversation was found in
+        """
+        depth = max(limit * 3, 30)
+        lexical, semantic = [], []
+        if mode != 'semantic':
+            lexical = get_lexical_index().search(query, k=depth)
+        if mode != 'lexical':
+            query_embedding = self.embedding_service.generate_embedding(query)
+            if query_embedding:
+                semantic = get_conversation_index().search(query_embedding, k=depth)
+        
+        if mode == 'hybrid':
+            ranked = reciprocal_rank_fusion([
+                [conversation_id for conversation_id, _ in lexical],
+                [conversation_id for conversation_id, _ in semantic]
+            ])
+        else:
+            ranked = lexical or semantic
+        # Over-fetch: like semantic search before it, only ended conversations
+        # are results, and ones deleted since they were indexed are dropped
+        ranked = ranked[:depth]
+        conversations = {
+            str(conv.id): conv for conv in Conversation.objects.filter(
+                id__in=[conversation_id for conversation_id, _ in ranked], status='ended'
+            )
+        }
         
+        lexical_scores, similarities = dict(lexical), dict(semantic)
         results = []
-        for conv in conversations:
-            # Use summary or first few messages for embedding
-            if conv.summary:
-                text_to_embed = conv.summary
-            else:
-                messages = conv.messages.all()[:5]
-                text_to_embed = " ".join([msg.content for msg in messages])
-            
-            if not text_to_embed:
+        for conversation_id, score in ranked:
+            conv = conversations.get(conversation_id)
+            if conv is None:
                 continue
-            
-            conv_embedding = self.embedding_service.generate_embedding(text_to_embed)
-            if conv_embedding:
-                similarity = self.embedding_service.cosine_similarity(
-                    query_embedding, conv_embedding
-                )
-                results.append({
-                    'conversation': conv,
-                    'similarity': similarity,
-                    'score': similarity
-                })
+            results.append({
+                'conversation': conv,
+                'score': score,
+                'similarity': similarities.get(conversation_id),
+                'lexical_score': lexical_scores.get(conversation_id)
+            })
+        return results[:limit]
+    
+    def _search_conversations_by_embedding(self, query_embedding: List[float], limit: int,
+                                           date_range: Optional[Tuple] = None,
+                                           exclude_id=None) -> List[Dict]:
+        """Top conversations by stored embedding, scored in one matrix product"""
+        # Over-fetch: active, excluded and deleted conversations are dropped
+        hits = get_conversation_index().search(query_embedding, k=limit * 2 + 1, date_range=date_range)
+        conversations = {
+            str(conv.id): conv for conv in Conversation.objects.filter(
+                id__in=[conversation_id for conversation_id, _ in hits], status='ended'
+            )
+        }
         
-        # Sort by similarity and return top results
-        results.sort(key=lambda x: x['similarity'], reverse=True)
+        results = []
+        for conversation_id, similarity in hits:
+            conv = conversations.get(conversation_id)
+            if conv is None or conversation_id == str(exclude_id):
+                continue
+            results.append({
+                'conversation': conv,
+                'similarity': similarity,
+                'score': similarity
+            })
         return results[:limit]
     
     def search_messages(self, query: str, conversation_id: Optional[str] = None,
-                       limit: int = 10) -> List[Dict]:
+                       limit: int = 10, query_embedding: Optional[List[float]] = None) -> List[Dict]:
         """
         Search messages by semantic similarity
         
@@ -73,59 +145,53 @@ class SemanticSearch:
             query: Search query text
             conversation_id: Optional conversation ID to limit search
             limit: Maximum number of results
+            query_embedding: Embedding of the query, when the caller already has it
         
         Returns:
             List of message dicts with similarity scores
         """
-        query_embedding = self.embedding_service.generate_embedding(query)
+        if query_embedding is None:
+            query_embedding = self.embedding_service.generate_embedding(query)
         if not query_embedding:
             return []
         
-        messages = Message.objects.all()
-        if conversation_id:
-            messages = messages.filter(conversation_id=conversation_id)
+        # Over-fetch a little: hits for messages deleted since they were indexed are dropped
+        hits = get_vector_index().search(query_embedding, k=limit * 2, conversation_id=conversation_id)
+        messages = {
+            str(msg.id): msg for msg in Message.objects.filter(
+                id__in=[message_id for message_id, _ in hits]
+            ).defer('embedding')
+        }
         
         results = []
-        for msg in messages:
-            if not msg.content:
+        for message_id, similarity in hits:
+            msg = messages.get(message_id)
+            if msg is None or not msg.content:
                 continue
-            
-            # Use existing embedding if available, otherwise generate
-            if msg.embedding:
-                msg_embedding = msg.embedding
-            else:
-                msg_embedding = self.embedding_service.generate_embedding(msg.content)
-                if msg_embedding:
-                    msg.embedding = msg_embedding
-                    msg.save(update_fields=['embedding'])
-            
-            if msg_embedding:
-                similarity = self.embedding_service.cosine_similarity(
-                    query_embedding, msg_embedding
-                )
-                results.append({
-                    'message': msg,
-                    'similarity': similarity,
-                    'score': similarity
-                })
-        
-        # Sort by similarity and return top results
-        results.sort(key=lambda x: x['similarity'], reverse=True)
+            results.append({
+                'message': msg,
+                'similarity': similarity,
+                'score': similarity
+            })
         return results[:limit]
     
     def find_related_conversations(self, conversation: Conversation, limit: int = 5) -> List[Dict]:
         """Find conversations similar to the given one"""
-        if conversation.summary:
-            query = conversation.summary
-        else:
-            messages = conversation.messages.all()[:10]
-            query = " ".join([msg.content for msg in messages])
-        
-        if not query:
-            return []
+        query_embedding = conversation.embedding
+        if query_embedding is None or not len(query_embedding):
+            if conversation.summary:
+                query = conversation.summary
+            else:
+                messages = conversation.messages.all()[:10]
+                query = " ".join([msg.content for msg in messages])
+            
+            if not query:
+                return []
+            query_embedding = self.embedding_service.generate_embedding(query)
+            if not query_embedding:
+                return []
         
         # Search excluding the current conversation
-        all_results = self.search_conversations(query, limit=limit + 1)
-        related = [r for r in all_results if r['conversation'].id != conversation.id]
-        return related[:limit]
-
+        return self._search_conversations_by_embedding(
+            query_embedding, limit, exclude_id=conversation.id
+        )
@@ -0,0 +1,129 @@
+"""
+Speculative decoding for direct llama.cpp mode
+A draft model proposes several tokens that the main model verifies in one
+batched evaluation, so accepted drafts cost a fraction of a decode step
+"""
+import threading
+from typing import Dict, Optional
+import numpy as np
+from llama_cpp import Llama
+
+try:
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+except ImportError:  # llama-cpp-python older than 0.2.34
+    LlamaDraftModel = object
+    LlamaPromptLookupDecoding = None
+
+
+# Draft setting meaning "use n-gram lookup in the prompt instead of a model"
+PROMPT_LOOKUP = 'prompt_lookup'
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Greedy proposals from a small GGUF model
+
+    The draft model must share the main model's tokenizer (e.g. a 0.5B and
+    a 7B model of the same family).
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 4, n_ctx: int = 4096,
+                 n_threads: Optional[int] = None):
+        self.num_pred_tokens = num_pred_tokens
+        self.model = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            verbose=False
+        )
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = []
+        # generate() keeps the common prefix with the previous call evaluated
+        for token in self.model.generate(input_ids.tolist(), temp=0.0, top_k=1, reset=True):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+class InstrumentedDraftModel(LlamaDraftModel):
+    """Counts draft calls and proposed tokens to estimate the acceptance rate"""
+
+    def __init__(self, draft_model, kind: str):
+        self.draft_model = draft_model
+        self.kind = kind
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.generated = 0
+        self.seconds = 0.0
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = self.draft_model(input_ids, **kwargs)
+        with self._lock:
+            self.calls += 1
+            self.proposed += len(draft)
+        return draft
+
+    def snapshot_calls(self) -> int:
+        with self._lock:
+            return self.calls
+
+    def record_completion(self, calls_before: int, generated: int, seconds: float):
+        """
+        Attribute accepted drafts to a finished completion
+
+        The first token comes from the prompt evaluation and each draft call
+        is followed by one verification step that yields one token of its
+        own, so every token beyond 1 + calls is an accepted draft.
+        """
+        with self._lock:
+            calls = self.calls - calls_before
+            self.accepted += max(0, generated - 1 - calls)
+            self.generated += generated
+            self.seconds += seconds
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'draft': self.kind,
+                'draft_calls': self.calls,
+                'proposed_tokens': self.proposed,
+                'accepted_tokens': self.accepted,
+                'acceptance_rate': round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+                'tokens_per_step': round(self.generated / (self.calls or 1), 2),
+                'effective_tok_s': round(self.generated / self.seconds, 2) if self.seconds else 0.0,
+            }
+
+
+def create_draft_model(params: Dict) -> Optional[InstrumentedDraftModel]:
+    """
+    Build the draft model described by llama params, removing the draft keys
+
+    `draft` is either "prompt_lookup" or a path to a small .gguf model and
+    `draft_num_pred_tokens` the number of tokens proposed per step.
+    """
+    draft = params.pop('draft', None)
+    num_pred_tokens = params.pop('draft_num_pred_tokens', None)
+    if not draft:
+        return None
+    if LlamaPromptLookupDecoding is None:
+        print("Warning: speculative decoding needs llama-cpp-python >= 0.2.34, disabled")
+        return None
+
+    try:
+        if draft == PROMPT_LOOKUP:
+            draft_model = LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens or 10)
+            return InstrumentedDraftModel(draft_model, PROMPT_LOOKUP)
+        draft_model = GGUFDraftModel(
+            model_path=draft,
+            num_pred_tokens=num_pred_tokens or 4,
+            n_ctx=params.get('n_ctx', 4096),
+            n_threads=params.get('n_threads'),
+        )
+        return InstrumentedDraftModel(draft_model, draft)
+    except Exception as e:
+        print(f"Warning: Could not create draft model '{draft}': {e}")
+        return None
@@ -0,0 +1,98 @@
+"""
+Per-conversation llama.cpp state cache
+Keeps the evaluated KV cache of recent chats so a new turn only pays
+prefill for the tokens appended since the previous turn
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class ConversationStateCache:
+    """Bounded LRU of llama.cpp states keyed by conversation id, evicted by RAM budget"""
+
+    def __init__(self, capacity_bytes: int):
+        """
+        Initialize state cache
+
+        Args:
+            capacity_bytes: Total size of cached states before the least
+                recently used conversations are evicted
+        """
+        self.capacity_bytes = capacity_bytes
+        self._states: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def state_size(state) -> int:
+        """Approximate memory held by a saved LlamaState"""
+        size = getattr(state, 'llama_state_size', 0) or 0
+        for name in ('input_ids', 'scores'):
+            array = getattr(state, name, None)
+            size += getattr(array, 'nbytes', 0)
+        return size
+
+    def get(self, conversation_id: str):
+        """Return the cached state for a conversation and mark it recently used"""
+        with self._lock:
+            entry = self._states.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._states.move_to_end(conversation_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, conversation_id: str, state):
+        """Store a conversation state, evicting old ones to stay under budget"""
+        size = self.state_size(state)
+        with self._lock:
+            self._discard(conversation_id)
+            if size > self.capacity_bytes:
+                return
+            self._states[conversation_id] = (state, size)
+            self._size += size
+            while self._size > self.capacity_bytes and self._states:
+                _, (_, evicted_size) = self._states.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def discard(self, conversation_id: str):
+        """Drop a conversation's cached state"""
+        with self._lock:
+            self._discard(conversation_id)
+
+    def clear(self):
+        """Drop all cached states"""
+        with self._lock:
+            self._states.clear()
+            self._size = 0
+
+    def _discard(self, conversation_id: str):
+        entry = self._states.pop(conversation_id, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'conversations': len(self._states),
+                'size_bytes': self._size,
+                'capacity_bytes': self.capacity_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def create_state_cache() -> Optional[ConversationStateCache]:
+    """Create a state cache from LLM_STATE_CACHE_MB, or None when disabled"""
+    capacity_mb = int(os.getenv('LLM_STATE_CACHE_MB', '2048'))
+    if capacity_mb <= 0:
+        return None
+    return ConversationStateCache(capacity_bytes=capacity_mb * 1024 * 1024)
@@ -0,0 +1,16 @@
+"""
+Celery tasks, used when ANALYSIS_BACKEND=celery
+"""
+from celery import shared_task
+from .analysis_pipeline import get_max_retries, get_retry_backoff, mark_failed, run_analysis
+
+
+@shared_task(bind=True, acks_late=True, max_retries=None)
+def analyze_conversation_task(self, conversation_id: str, force: bool = False):
+    """Analyze an ended conversation, retrying with backoff on errors"""
+    try:
+        run_analysis(conversation_id, force)
+    except Exception as e:
+        if self.request.retries < get_max_retries():
+            raise self.retry(exc=e, countdown=get_retry_backoff(self.request.retries))
+        mark_failed(conversation_id, e)
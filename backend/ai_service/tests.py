@@ -0,0 +1,402 @@
+"""
+Tests for ai_service
+"""
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from api.models import Conversation
+from . import analysis_pipeline
+from .analysis_pipeline import AnalysisWorker, mark_failed, request_analysis, run_analysis
+from .completion_cache import CompletionCache
+from .context_builder import ContextBuilder, MIN_RESPONSE_TOKENS, SAFETY_MARGIN_TOKENS
+from .inference_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, InferenceScheduler, QueueTimeout,
+)
+from .lexical_index import LexicalIndex
+from .semantic_search import reciprocal_rank_fusion
+from .vector_index import VectorIndex, normalize
+
+
+class FakeLLMClient:
+    """One token per word, no model needed"""
+    model_id = 'fake'
+
+    def __init__(self, context_window: int):
+        self.context_window = context_window
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+
+def words(count: int) -> str:
+    return " ".join(f"w{i}" for i in range(count))
+
+
+class ContextBuilderFitTurnTests(SimpleTestCase):
+    fixed_text = words(100)
+
+    def fit(self, context_window: int, text: str, max_tokens: int = 512):
+        client = FakeLLMClient(context_window)
+        turn, reply_tokens = ContextBuilder(client).fit_turn(self.fixed_text, text, max_tokens)
+        used = client.count_tokens(self.fixed_text) + client.count_tokens(turn) + reply_tokens
+        return turn, reply_tokens, used
+
+    def test_turn_that_fits_is_unchanged(self):
+        text = words(200)
+        turn, reply_tokens, _ = self.fit(2048, text)
+        self.assertEqual(turn, text)
+        self.assertEqual(reply_tokens, 512)
+
+    def test_long_turn_shortens_reply_first(self):
+        text = words(1600)
+        turn, reply_tokens, used = self.fit(2048, text)
+        self.assertEqual(turn, text)
+        self.assertEqual(reply_tokens, 2048 - SAFETY_MARGIN_TOKENS - 100 - 1600)
+        self.assertLessEqual(used + SAFETY_MARGIN_TOKENS, 2048)
+
+    def test_turn_larger_than_window_is_truncated(self):
+        text = words(5000)
+        turn, reply_tokens, used = self.fit(2048, text)
+        self.assertEqual(reply_tokens, MIN_RESPONSE_TOKENS)
+        self.assertTrue(text.startswith(turn))
+        self.assertGreater(len(turn), 0)
+        self.assertLessEqual(used + SAFETY_MARGIN_TOKENS, 2048)
+
+    def test_prompt_with_truncated_turn_fits_window(self):
+        client = FakeLLMClient(2048)
+        builder = ContextBuilder(client)
+        turn, reply_tokens = builder.fit_turn(self.fixed_text, words(5000), 512)
+        fixed_text = f"{self.fixed_text} {turn}"
+        history = [SimpleNamespace(id=i, sender='user', content=words(50)) for i in range(20)]
+        context = builder.build(history, fixed_text, reply_tokens)
+        used = client.count_tokens(fixed_text) + client.count_tokens(context) + reply_tokens
+        self.assertLessEqual(used + SAFETY_MARGIN_TOKENS, 2048)
+
+
+class InferenceSchedulerTests(SimpleTestCase):
+    def grant_order(self, scheduler, tickets):
+        """Release slots one by one and return the tickets in the order they were granted"""
+        order = []
+        pending = list(tickets)
+        while pending:
+            granted = [ticket for ticket in pending if ticket.granted]
+            self.assertEqual(len(granted), 1)
+            order.append(granted[0])
+            pending.remove(granted[0])
+            scheduler.release(granted[0])
+        return order
+
+    def test_higher_priority_is_granted_first(self):
+        scheduler = InferenceScheduler(max_in_flight=1)
+        holder = scheduler.acquire(PRIORITY_INTERACTIVE, 'holder')
+        background = scheduler.enqueue(PRIORITY_BACKGROUND, 'a')
+        interactive = scheduler.enqueue(PRIORITY_INTERACTIVE, 'b')
+        scheduler.release(holder)
+        self.assertEqual(self.grant_order(scheduler, [background, interactive]),
+                         [interactive, background])
+
+    def test_burst_of_one_conversation_does_not_starve_another(self):
+        scheduler = InferenceScheduler(max_in_flight=1)
+        holder = scheduler.acquire(PRIORITY_INTERACTIVE, 'holder')
+        burst = [scheduler.enqueue(PRIORITY_INTERACTIVE, 'a') for _ in range(3)]
+        single = scheduler.enqueue(PRIORITY_INTERACTIVE, 'b')
+        scheduler.release(holder)
+        order = self.grant_order(scheduler, burst + [single])
+        self.assertEqual(order.index(single), 1)
+
+    def test_wait_times_out_and_frees_the_queue_position(self):
+        scheduler = InferenceScheduler(max_in_flight=1)
+        holder = scheduler.acquire(PRIORITY_INTERACTIVE, 'holder')
+        with self.assertRaises(QueueTimeout):
+            scheduler.acquire(PRIORITY_INTERACTIVE, 'a', timeout=0.05)
+        stats = scheduler.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+        scheduler.release(holder)
+        self.assertEqual(scheduler.stats()['in_flight'], 0)
+
+    def test_async_waiters_are_granted_without_threads(self):
+        scheduler = InferenceScheduler(max_in_flight=2)
+        order = []
+
+        async def request(name, priority):
+            async with scheduler.aslot(priority, name):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            with mock.patch.object(asyncio.get_running_loop(), 'run_in_executor') as executor:
+                await asyncio.gather(
+                    request('first', PRIORITY_INTERACTIVE),
+                    request('second', PRIORITY_INTERACTIVE),
+                    *[request(f'background{i}', PRIORITY_BACKGROUND) for i in range(5)],
+                    request('late', PRIORITY_INTERACTIVE),
+                )
+                executor.assert_not_called()
+
+        asyncio.run(main())
+        self.assertEqual(order[:3], ['first', 'second', 'late'])
+        self.assertEqual(scheduler.stats()['in_flight'], 0)
+        self.assertEqual(scheduler.stats()['completed'], 8)
+
+    def test_cancelled_async_waiter_leaves_the_queue(self):
+        scheduler = InferenceScheduler(max_in_flight=1)
+
+        async def main():
+            holder = scheduler.acquire(PRIORITY_INTERACTIVE, 'holder')
+            task = asyncio.create_task(scheduler.aslot(PRIORITY_INTERACTIVE, 'a').__aenter__())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            scheduler.release(holder)
+
+        asyncio.run(main())
+        stats = scheduler.stats()
+        self.assertEqual((stats['queue_depth'], stats['in_flight']), (0, 0))
+
+
+class CompletionCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+
+    def test_key_depends_on_model_prompt_and_params(self):
+        key = CompletionCache.make_key('model', 'prompt', {'temperature': 0.0})
+        self.assertEqual(key, CompletionCache.make_key('model', 'prompt', {'temperature': 0.0}))
+        self.assertNotEqual(key, CompletionCache.make_key('other', 'prompt', {'temperature': 0.0}))
+        self.assertNotEqual(key, CompletionCache.make_key('model', 'prompt!', {'temperature': 0.0}))
+        self.assertNotEqual(key, CompletionCache.make_key('model', 'prompt', {'temperature': 0.2}))
+
+    def test_disk_tier_survives_a_new_instance(self):
+        CompletionCache(self.path).put('key', 'completion')
+        cache = CompletionCache(self.path)
+        self.assertEqual(cache.get('key'), 'completion')
+        self.assertEqual(cache.get('key'), 'completion')
+        stats = cache.stats()
+        self.assertEqual((stats['disk_hits'], stats['memory_hits']), (1, 1))
+
+    def test_expired_entries_are_misses(self):
+        cache = CompletionCache(self.path, ttl_seconds=0.01)
+        cache.put('key', 'completion')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+        self.assertIsNone(CompletionCache(self.path).get('key'))
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = CompletionCache(None, memory_entries=2)
+        cache.put('a', '1')
+        cache.put('b', '2')
+        cache.get('a')
+        cache.put('c', '3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('1', '3'))
+
+    def test_disk_tier_is_trimmed_to_max_entries(self):
+        cache = CompletionCache(self.path, memory_entries=1, max_disk_entries=10)
+        for i in range(100):
+            cache.put(f'key{i}', str(i))
+        self.assertIsNone(CompletionCache(self.path).get('key0'))
+        self.assertEqual(CompletionCache(self.path).get('key99'), '99')
+
+
+def clustered_vectors(count: int, dim: int = 32, clusters: int = 40, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return (centers[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int):
+    scores = normalize(vectors) @ normalize(query)
+    return [f'm{i}' for i in np.argsort(-scores)[:k]]
+
+
+class VectorIndexTests(SimpleTestCase):
+    def build(self, vectors, **kwargs):
+        kwargs.setdefault('min_train_size', 10 ** 9)
+        index = VectorIndex(**kwargs)
+        index.add_many([(f'm{i}', f'c{i % 10}', vector) for i, vector in enumerate(vectors)])
+        return index
+
+    def test_untrained_search_is_exact(self):
+        vectors = clustered_vectors(500)
+        index = self.build(vectors)
+        hits = index.search(vectors[7], k=5)
+        self.assertEqual([message_id for message_id, _ in hits], exact_top_k(vectors, vectors[7], 5))
+        self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+
+    def test_trained_search_finds_nearest_and_new_rows(self):
+        vectors = clustered_vectors(3000)
+        index = self.build(vectors, nprobe=8)
+        index.train()
+        self.assertEqual(index.stats()['trains'], 1)
+        for i in range(0, 3000, 100):
+            self.assertEqual(index.search(vectors[i], k=1)[0][0], f'm{i}')
+
+        extra = clustered_vectors(1, seed=1)[0]
+        index.add('new', 'c0', extra)
+        self.assertEqual(index.search(extra, k=1)[0][0], 'new')
+
+    def test_int8_search_rescores_with_full_precision(self):
+        vectors = clustered_vectors(1000)
+        loader = lambda ids: {message_id: vectors[int(message_id[1:])] for message_id in ids}
+        index = self.build(vectors, quantize=True, loader=loader)
+        query = clustered_vectors(1, seed=2)[0]
+        hits = index.search(query, k=10)
+        self.assertEqual([message_id for message_id, _ in hits], exact_top_k(vectors, query, 10))
+        exact = normalize(vectors[int(hits[0][0][1:])]) @ normalize(query)
+        self.assertAlmostEqual(hits[0][1], float(exact), places=5)
+
+    def test_int8_scores_without_loader_are_close(self):
+        vectors = clustered_vectors(200)
+        index = self.build(vectors, quantize=True)
+        message_id, score = index.search(vectors[3], k=1)[0]
+        self.assertEqual(message_id, 'm3')
+        self.assertAlmostEqual(score, 1.0, delta=0.02)
+
+    def test_removed_and_replaced_vectors(self):
+        vectors = clustered_vectors(100)
+        index = self.build(vectors)
+        index.remove('m1')
+        self.assertNotIn('m1', [message_id for message_id, _ in index.search(vectors[1], k=100)])
+        index.add('m2', 'c2', vectors[50])
+        self.assertEqual(index.search(vectors[50], k=2)[1][1], index.search(vectors[50], k=2)[0][1])
+        index.remove_conversation('c3')
+        self.assertEqual(index.search(vectors[3], k=10, conversation_id='c3'), [])
+        self.assertEqual(len(index), 89)
+
+
+class LexicalSearchTests(SimpleTestCase):
+    def build(self, documents):
+        index = LexicalIndex()
+        index.put_documents(
+            (conversation_id, (None, len(texts)), texts) for conversation_id, texts in documents.items()
+        )
+        return index
+
+    def ids(self, hits):
+        return [conversation_id for conversation_id, _ in hits]
+
+    def test_bm25_ranks_frequent_and_rare_terms_higher(self):
+        index = self.build({
+            'many': ['kubernetes kubernetes kubernetes deployment'],
+            'once': ['kubernetes deployment notes with many other words in it'],
+            'rare': ['postgres deployment'],
+            'none': ['lunch plans'],
+        })
+        self.assertEqual(self.ids(index.search('kubernetes')), ['many', 'once'])
+        self.assertEqual(self.ids(index.search('postgres deployment'))[0], 'rare')
+        self.assertEqual(index.search('the'), [])
+
+    def test_require_all_and_prefix(self):
+        index = self.build({
+            'both': ['database migration failed'],
+            'one': ['database backup'],
+        })
+        self.assertEqual(self.ids(index.search('database migration', require_all=True)), ['both'])
+        self.assertEqual(set(self.ids(index.search('database migration'))), {'both', 'one'})
+        self.assertEqual(self.ids(index.search('migr', prefix=True)), ['both'])
+        self.assertEqual(index.search('migr'), [])
+
+    def test_added_and_removed_conversations(self):
+        index = self.build({'a': ['first message'], 'b': ['unrelated']})
+        self.assertTrue(index.add_message('b', 'follow up about kafka'))
+        self.assertEqual(self.ids(index.search('kafka')), ['b'])
+        index.remove('b')
+        self.assertEqual(index.search('kafka'), [])
+        self.assertEqual(len(index), 1)
+
+    def test_reciprocal_rank_fusion_rewards_agreement(self):
+        fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'b', 'd']])
+        self.assertEqual([key for key, _ in fused], ['c', 'b', 'a', 'd'])
+        self.assertAlmostEqual(dict(fused)['b'], 2 / 62)
+        self.assertAlmostEqual(dict(fused)['a'], 1 / 61)
+
+
+@mock.patch.object(analysis_pipeline, 'notify_analysis')
+@mock.patch.object(analysis_pipeline, 'refresh_conversation_embedding')
+@mock.patch.object(analysis_pipeline, 'ConversationAnalyzer')
+class AnalysisPipelineTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title='Test', status='ended')
+
+    def status(self):
+        self.conversation.refresh_from_db()
+        return self.conversation.analysis_status
+
+    def test_request_is_queued_once(self, analyzer, refresh, notify):
+        with mock.patch.object(analysis_pipeline, 'enqueue_analysis') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(request_analysis(self.conversation), 'pending')
+                self.assertEqual(request_analysis(self.conversation), 'pending')
+            self.assertEqual(enqueue.call_count, 1)
+
+    def test_only_pending_jobs_are_claimed(self, analyzer, refresh, notify):
+        self.assertFalse(run_analysis(str(self.conversation.id)))
+        Conversation.objects.filter(id=self.conversation.id).update(analysis_status='running')
+        self.assertFalse(run_analysis(str(self.conversation.id)))
+        analyzer.assert_not_called()
+
+    def test_completed_job_is_not_run_again(self, analyzer, refresh, notify):
+        Conversation.objects.filter(id=self.conversation.id).update(analysis_status='pending')
+        self.assertTrue(run_analysis(str(self.conversation.id)))
+        self.assertEqual(self.status(), 'completed')
+        self.assertFalse(run_analysis(str(self.conversation.id)))
+        self.assertEqual(analyzer.return_value.analyze_and_save.call_count, 1)
+        notify.assert_called_once()
+
+    def test_error_puts_the_job_back_to_pending(self, analyzer, refresh, notify):
+        analyzer.return_value.analyze_and_save.side_effect = RuntimeError('model unavailable')
+        Conversation.objects.filter(id=self.conversation.id).update(analysis_status='pending')
+        with self.assertRaises(RuntimeError):
+            run_analysis(str(self.conversation.id))
+        self.assertEqual(self.status(), 'pending')
+        self.assertEqual(self.conversation.analysis_error, 'model unavailable')
+
+    def test_mark_failed(self, analyzer, refresh, notify):
+        mark_failed(str(self.conversation.id), RuntimeError('gave up'))
+        self.assertEqual(self.status(), 'failed')
+        self.assertEqual(self.conversation.analysis_error, 'gave up')
+        notify.assert_called_once_with(str(self.conversation.id), 'failed')
+
+
+@mock.patch.dict(os.environ, {'ANALYSIS_MAX_RETRIES': '2', 'ANALYSIS_RETRY_BACKOFF': '0'})
+class AnalysisWorkerTests(SimpleTestCase):
+    def run_worker(self, outcomes):
+        """Run one job whose attempts return or raise `outcomes` in turn"""
+        worker = AnalysisWorker()
+        done = mock.Mock()
+        failed = mock.Mock(side_effect=lambda *args: done())
+
+        def attempt(conversation_id, force):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            done()
+            return outcome
+
+        with mock.patch.object(analysis_pipeline, 'run_analysis', side_effect=attempt), \
+                mock.patch.object(analysis_pipeline, 'mark_failed', failed):
+            self.assertTrue(worker.submit('c1'))
+            self.assertFalse(worker.submit('c1'))
+            deadline = time.monotonic() + 5
+            while not done.called or worker.stats()['queued']:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        return worker.stats(), failed
+
+    def test_retries_until_success(self):
+        stats, failed = self.run_worker([RuntimeError('busy'), True])
+        self.assertEqual((stats['retries'], stats['completed'], stats['failed']), (1, 1, 0))
+        failed.assert_not_called()
+
+    def test_fails_after_last_retry(self):
+        stats, failed = self.run_worker([RuntimeError('busy')] * 3)
+        self.assertEqual((stats['retries'], stats['completed'], stats['failed']), (2, 0, 1))
+        failed.assert_called_once()
@@ -0,0 +1,645 @@
+"""
+Persistent approximate nearest-neighbour index over message embeddings
+An inverted-file (IVF) index in NumPy: vectors are grouped under k-means
+centroids and a query only scores the groups nearest to it. Small indexes
+are searched exhaustively. Messages are added as they are embedded, and the
+index is saved to disk periodically and rebuilt from the database on demand.
+Embeddings written by other processes are picked up by a throttled sync.
+With VECTOR_INDEX_QUANTIZE=int8 vectors are held as int8 codes (4x less RAM)
+and the best candidates are rescored on the full-precision stored embeddings.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+
+# Rows scored at once when assigning vectors to centroids
+ASSIGN_CHUNK_ROWS = 8192
+
+# Retrain once the index has grown this much since the centroids were fitted
+RETRAIN_GROWTH = 4
+
+# Messages saved shortly before the index are caught up on load anyway
+CATCH_UP_MARGIN_SECONDS = 300
+
+# Re-read embeddings this much older than the last sync, for writes that
+# committed after it with an earlier timestamp
+SYNC_MARGIN_SECONDS = 60
+
+# Searches within this many seconds of a sync skip the database check
+SYNC_INTERVAL_SECONDS = 2
+
+# Candidates per requested result rescored at full precision when quantized
+RESCORE_FACTOR = 4
+
+
+def get_index_path() -> str:
+    return os.getenv('VECTOR_INDEX_PATH', os.path.join(settings.BASE_DIR, 'vector_index.npz'))
+
+
+def get_nprobe() -> int:
+    return max(1, int(os.getenv('VECTOR_INDEX_NPROBE', '16')))
+
+
+def get_min_train_size() -> int:
+    """Below this many vectors every query is an exact scan"""
+    return int(os.getenv('VECTOR_INDEX_MIN_TRAIN', '20000'))
+
+
+def get_save_interval() -> float:
+    return float(os.getenv('VECTOR_INDEX_SAVE_INTERVAL', '30'))
+
+
+def quantization_enabled() -> bool:
+    """VECTOR_INDEX_QUANTIZE: "none" (float32 in memory) or "int8" (int8 codes, rescored)"""
+    return os.getenv('VECTOR_INDEX_QUANTIZE', 'none').lower() == 'int8'
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class VectorIndex:
+    """IVF index of unit-length message vectors keyed by message id"""
+
+    def __init__(self, path: Optional[str] = None, nprobe: int = 16, min_train_size: int = 20000,
+                 quantize: bool = False, loader: Optional[Callable] = None):
+        """
+        Initialize an empty vector index
+
+        Args:
+            path: .npz file the index is saved to, None for memory only
+            nprobe: Centroid lists scored per query once trained
+            min_train_size: Vectors needed before centroids are fitted
+            quantize: Hold vectors as int8 codes with one scale per vector
+            loader: Maps message ids to full-precision vectors for rescoring
+                quantized results
+        """
+        self.path = path
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.quantize = quantize
+        self.loader = loader
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._training = False
+        self._clear()
+        self._loading = False
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._stats = {'searches': 0, 'adds': 0, 'trains': 0, 'saves': 0, 'stale_saves_skipped': 0}
+
+    def _clear(self, dim: int = 0):
+        # Centroids fitted on the previous contents are not installed
+        self._generation += 1
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.int8 if self.quantize else np.float32)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._size = 0
+        self._live = np.zeros(0, dtype=bool)
+        self._ids: List[str] = []
+        self._conversation_ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._conversation_rows: Dict[str, List[int]] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+        self._trained_size = 0
+        self.updated_at = None
+        # Every embedding stored before this (less a margin) is in the index
+        self.synced_at = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _reserve(self, rows: int):
+        needed = self._size + rows
+        if needed <= len(self._vectors):
+            return
+        capacity = max(needed, 2 * len(self._vectors), 1024)
+        vectors = np.zeros((capacity, self.dim), dtype=self._vectors.dtype)
+        vectors[:self._size] = self._vectors[:self._size]
+        scales = np.zeros(capacity, dtype=np.float32)
+        scales[:self._size] = self._scales[:self._size]
+        live = np.zeros(capacity, dtype=bool)
+        live[:self._size] = self._live[:self._size]
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        self._vectors, self._scales, self._live, self._assignments = vectors, scales, live, assignments
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(stored rows, per-row scales): symmetric int8 codes when quantized"""
+        if not self.quantize:
+            return vectors, np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _decode(self, rows) -> np.ndarray:
+        """float32 vectors of stored rows (an index array or slice)"""
+        return self._decode_from(self._vectors, self._scales, rows)
+
+    @staticmethod
+    def _decode_from(vectors: np.ndarray, scales: np.ndarray, rows) -> np.ndarray:
+        if vectors.dtype != np.int8:
+            return vectors[rows]
+        return vectors[rows].astype(np.float32) * scales[rows][:, None]
+
+    def add(self, message_id, conversation_id, vector: Sequence[float]):
+        """Add or replace the vector of one message"""
+        self.add_many([(message_id, conversation_id, vector)])
+
+    def add_many(self, items: Sequence[Tuple]):
+        """Add or replace (message id, conversation id, vector) items"""
+        if not items:
+            return
+        vectors = normalize(np.asarray([item[2] for item in items], dtype=np.float32))
+        with self._lock:
+            if not len(self) and vectors.shape[1] != self.dim:
+                self._clear(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                print(f"Warning: Ignoring {len(items)} embeddings of dimension "
+                      f"{vectors.shape[1]}, index has {self.dim}; rebuild the vector index")
+                return
+            self._reserve(len(items))
+            start = self._size
+            for offset, (message_id, conversation_id, _) in enumerate(items):
+                message_id, conversation_id = str(message_id), str(conversation_id)
+                row = start + offset
+                old = self._rows.get(message_id)
+                if old is not None:
+                    # Replaced rows stay in the arrays as dead rows until a rebuild
+                    self._live[old] = False
+                self._rows[message_id] = row
+                self._ids.append(message_id)
+                self._conversation_ids.append(conversation_id)
+                self._conversation_rows.setdefault(conversation_id, []).append(row)
+            end = start + len(items)
+            self._vectors[start:end], self._scales[start:end] = self._encode(vectors)
+            self._live[start:end] = True
+            self._size = end
+
+            if self._centroids is not None:
+                self._assign(start, end)
+            if not self._loading and len(self) >= self.min_train_size and (
+                self._centroids is None or len(self) >= RETRAIN_GROWTH * self._trained_size
+            ):
+                self._train_in_background()
+
+            self._stats['adds'] += len(items)
+            self.updated_at = timezone.now()
+            self._dirty = True
+        if not self._loading:
+            self.maybe_save()
+
+    def changed(self, items: Sequence[Tuple]) -> List[Tuple]:
+        """Items whose message is not indexed yet or is indexed with another vector"""
+        with self._lock:
+            known = [(i, self._rows[str(item[0])]) for i, item in enumerate(items) if str(item[0]) in self._rows]
+            if not known:
+                return list(items)
+            vectors = normalize(np.asarray([items[i][2] for i, _ in known], dtype=np.float32))
+            if vectors.shape[1] != self.dim:
+                return list(items)
+            codes, scales = self._encode(vectors)
+            if self.quantize:
+                codes = codes.astype(np.float32) * scales[:, None]
+            stored = self._decode(np.asarray([row for _, row in known]))
+            same = np.isclose(stored, codes, atol=1e-6).all(axis=1)
+            unchanged = {i for (i, _), is_same in zip(known, same.tolist()) if is_same}
+        return [item for i, item in enumerate(items) if i not in unchanged]
+
+    def remove(self, message_id):
+        with self._lock:
+            row = self._rows.pop(str(message_id), None)
+            if row is not None:
+                self._live[row] = False
+                self._dirty = True
+
+    def remove_conversation(self, conversation_id):
+        """Drop every message of a conversation"""
+        with self._lock:
+            for row in self._conversation_rows.pop(str(conversation_id), []):
+                if self._live[row]:
+                    self._live[row] = False
+                    self._rows.pop(self._ids[row], None)
+                    self._dirty = True
+
+    def _train_in_background(self):
+        """Start fitting centroids on a background thread unless that already runs"""
+        if self._training:
+            return
+        self._training = True
+        threading.Thread(target=self._run_training, name='vector-index-train', daemon=True).start()
+
+    def _run_training(self):
+        try:
+            self.train()
+        except Exception as e:
+            print(f"Warning: Could not train vector index: {e}")
+        finally:
+            self._training = False
+        self.maybe_save()
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """
+        Fit centroids with spherical k-means on a sample and assign every row
+
+        The lock is only held to take the sample and to install the result,
+        so searches and adds continue while the centroids are fitted. Rows
+        are never changed in place, so the rows present when the sample was
+        taken can be read without it.
+        """
+        with self._lock:
+            generation = self._generation
+            size = self._size
+            vectors, scales = self._vectors, self._scales
+            live_rows = np.flatnonzero(self._live[:size])
+            n_lists = int(np.clip(np.sqrt(len(live_rows)), 8, 4096))
+            if len(live_rows) < n_lists:
+                return
+            rng = np.random.default_rng(seed)
+            sample = self._decode(np.sort(rng.choice(live_rows, min(len(live_rows), n_lists * 64), replace=False)))
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            labels = self._nearest(sample, centroids)
+            order = np.argsort(labels, kind='stable')
+            present, starts = np.unique(labels[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = ~sums.any(axis=1)
+            # Reseed empty clusters with random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize(sums)
+        centroids = centroids.astype(np.float32)
+
+        labels = np.empty(size, dtype=np.int32)
+        for start in range(0, size, ASSIGN_CHUNK_ROWS):
+            end = min(size, start + ASSIGN_CHUNK_ROWS)
+            labels[start:end] = self._nearest(self._decode_from(vectors, scales, slice(start, end)), centroids)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(1, n_lists))
+        lists = [rows.tolist() for rows in np.split(order, bounds)]
+
+        with self._lock:
+            if self._generation != generation:
+                return  # Cleared or reloaded meanwhile
+            self._centroids = centroids
+            self._lists = lists
+            self._list_arrays = {}
+            self._assignments[:size] = labels
+            # Rows added while fitting
+            self._assign(size, self._size)
+            self._trained_size = len(live_rows)
+            self._stats['trains'] += 1
+            self._dirty = True
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+            chunk = vectors[start:start + ASSIGN_CHUNK_ROWS]
+            labels[start:start + ASSIGN_CHUNK_ROWS] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def _assign(self, start: int, end: int):
+        labels = np.empty(end - start, dtype=np.int32)
+        for chunk_start in range(start, end, ASSIGN_CHUNK_ROWS):
+            chunk_end = min(end, chunk_start + ASSIGN_CHUNK_ROWS)
+            labels[chunk_start - start:chunk_end - start] = self._nearest(
+                self._decode(slice(chunk_start, chunk_end)), self._centroids
+            )
+        self._assignments[start:end] = labels
+        for row, label in zip(range(start, end), labels.tolist()):
+            self._lists[label].append(row)
+            self._list_arrays.pop(label, None)
+
+    def _list_rows(self, label: int) -> np.ndarray:
+        rows = self._list_arrays.get(label)
+        if rows is None:
+            rows = self._list_arrays[label] = np.asarray(self._lists[label], dtype=np.int64)
+        return rows
+
+    def search(self, query: Sequence[float], k: int = 10,
+               conversation_id=None) -> List[Tuple[str, float]]:
+        """
+        (message id, cosine similarity) of the k nearest messages, best first
+
+        With `conversation_id` the messages of that conversation are scored
+        exactly; otherwise the nprobe nearest centroid lists are scored, or
+        every vector while the index is untrained. Quantized scores of the
+        best candidates are replaced by full-precision ones from `loader`.
+        """
+        query = normalize(np.asarray(query, dtype=np.float32))
+        with self._lock:
+            self._stats['searches'] += 1
+            if not len(self) or query.shape[-1] != self.dim:
+                return []
+            if conversation_id is not None:
+                rows = np.asarray(self._conversation_rows.get(str(conversation_id), []), dtype=np.int64)
+            elif self._centroids is not None:
+                probe = top_k(self._centroids @ query, min(self.nprobe, len(self._centroids)))
+                rows = np.concatenate([self._list_rows(label) for label in probe.tolist()])
+            else:
+                rows = np.arange(self._size)
+            rows = rows[self._live[rows]]
+            if not len(rows):
+                return []
+            scores = self._vectors[rows] @ query
+            if self.quantize:
+                scores = scores * self._scales[rows]
+            best = top_k(scores, k * RESCORE_FACTOR if self.quantize and self.loader else k)
+            hits = [(self._ids[rows[i]], float(scores[i])) for i in best]
+        if self.quantize and self.loader:
+            hits = self._rescore(hits, query)[:k]
+        return hits
+
+    def _rescore(self, hits: List[Tuple[str, float]], query: np.ndarray) -> List[Tuple[str, float]]:
+        try:
+            vectors = self.loader([message_id for message_id, _ in hits])
+        except Exception as e:
+            print(f"Warning: Could not rescore vector search results: {e}")
+            return hits
+        rescored = []
+        for message_id, score in hits:
+            vector = vectors.get(message_id)
+            if vector is not None and len(vector) == self.dim:
+                score = float(normalize(np.asarray(vector, dtype=np.float32)) @ query)
+            rescored.append((message_id, score))
+        rescored.sort(key=lambda hit: hit[1], reverse=True)
+        return rescored
+
+    def rebuild(self, items_iter, batch_size: int = 5000):
+        """Replace the contents with (message id, conversation id, vector) items"""
+        with self._lock:
+            self._clear()
+            synced_at = timezone.now()
+            self._loading = True
+            try:
+                batch = []
+                for item in items_iter:
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        self.add_many(batch)
+                        batch = []
+                self.add_many(batch)
+            finally:
+                self._loading = False
+            if len(self) >= self.min_train_size:
+                self.train()
+            self.updated_at = timezone.now()
+            self.synced_at = synced_at
+            self.save(force=True)
+
+    def _saved_synced_at(self) -> Optional[datetime]:
+        """Sync time of the index file at `path`, None without a readable file"""
+        try:
+            with np.load(self.path) as data:
+                value = str(data['synced_at' if 'synced_at' in data.files else 'updated_at'])
+        except Exception:
+            return None
+        return datetime.fromisoformat(value) if value else None
+
+    def save(self, force: bool = False):
+        """
+        Write the index to `path` (compacting dead rows)
+
+        A file saved by another process that synced more recently is kept:
+        it holds messages this index has not picked up yet. `force` writes
+        anyway, e.g. after a rebuild.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not force and os.path.exists(self.path):
+                saved_synced_at = self._saved_synced_at()
+                if saved_synced_at is not None and (self.synced_at is None or saved_synced_at > self.synced_at):
+                    # Stays dirty, saved once a sync has caught up with the file
+                    self._saved_at = time.monotonic()
+                    self._stats['stale_saves_skipped'] += 1
+                    return
+            live_rows = np.flatnonzero(self._live[:self._size])
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    vectors=self._vectors[live_rows],
+                    scales=self._scales[live_rows],
+                    ids=np.asarray([self._ids[row] for row in live_rows], dtype='S36'),
+                    conversation_ids=np.asarray(
+                        [self._conversation_ids[row] for row in live_rows], dtype='S36'
+                    ),
+                    assignments=self._assignments[live_rows],
+                    centroids=self._centroids if self._centroids is not None else np.zeros((0, self.dim)),
+                    trained_size=np.int64(self._trained_size),
+                    updated_at=np.asarray(self.updated_at.isoformat() if self.updated_at else ''),
+                    synced_at=np.asarray(self.synced_at.isoformat() if self.synced_at else ''),
+                )
+            os.replace(temp_path, self.path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+            self._stats['saves'] += 1
+
+    def maybe_save(self):
+        """Save if there are unsaved changes and the save interval has passed"""
+        if self._dirty and time.monotonic() - self._saved_at >= get_save_interval():
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Warning: Could not save vector index: {e}")
+
+    def load(self) -> bool:
+        """Load the index from `path`; False when there is no usable file"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as data:
+            vectors = data['vectors']
+            if (vectors.dtype == np.int8) != self.quantize:
+                return False
+            scales = data['scales']
+            ids = [value.decode() for value in data['ids'].tolist()]
+            conversation_ids = [value.decode() for value in data['conversation_ids'].tolist()]
+            assignments = data['assignments']
+            centroids = data['centroids']
+            trained_size = int(data['trained_size'])
+            updated_at = str(data['updated_at'])
+            # Files saved before syncing was tracked were as fresh as their last add
+            synced_at = str(data['synced_at']) if 'synced_at' in data.files else updated_at
+        with self._lock:
+            self._clear(vectors.shape[1])
+            self._vectors = vectors
+            self._scales = scales.astype(np.float32)
+            self._size = len(ids)
+            self._live = np.ones(self._size, dtype=bool)
+            self._ids = ids
+            self._conversation_ids = conversation_ids
+            self._rows = {message_id: row for row, message_id in enumerate(ids)}
+            for row, conversation_id in enumerate(conversation_ids):
+                self._conversation_rows.setdefault(conversation_id, []).append(row)
+            if len(centroids):
+                self._centroids = centroids.astype(np.float32)
+                self._assignments = assignments.astype(np.int32)
+                self._lists = [[] for _ in range(len(centroids))]
+                for row, label in enumerate(self._assignments.tolist()):
+                    self._lists[label].append(row)
+            else:
+                self._assignments = np.full(self._size, -1, dtype=np.int32)
+            self._trained_size = trained_size
+            self.updated_at = datetime.fromisoformat(updated_at) if updated_at else None
+            self.synced_at = datetime.fromisoformat(synced_at) if synced_at else None
+            self._dirty = False
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(
+                self._stats,
+                vectors=len(self),
+                dead_rows=self._size - len(self),
+                dim=self.dim,
+                lists=len(self._lists),
+                training=self._training,
+                nprobe=self.nprobe,
+            )
+
+
+def database_items(since=None):
+    """(message id, conversation id, embedding) of embedded messages, streamed"""
+    from api.models import Message
+    messages = Message.objects.filter(embedding__isnull=False).order_by()
+    if since is not None:
+        # Every embedding write sets embedding_updated_at (indexed), including
+        # backfill_embeddings for older messages
+        messages = messages.filter(embedding_updated_at__gte=since)
+    for message_id, conversation_id, embedding in messages.values_list(
+        'id', 'conversation_id', 'embedding'
+    ).iterator(chunk_size=2000):
+        if len(embedding):
+            yield message_id, conversation_id, embedding
+
+
+def load_message_embeddings(message_ids: List[str]) -> Dict[str, np.ndarray]:
+    """Full-precision stored embeddings of messages, keyed by id"""
+    from api.models import Message
+    return {
+        str(message_id): embedding for message_id, embedding in
+        Message.objects.filter(id__in=message_ids, embedding__isnull=False).values_list('id', 'embedding')
+    }
+
+
+def catch_up(index: VectorIndex, margin: float = CATCH_UP_MARGIN_SECONDS):
+    """Add messages embedded by any process since the index was last synced"""
+    since = None
+    if index.synced_at is not None:
+        since = index.synced_at - timedelta(seconds=margin)
+    synced_at = timezone.now()
+    batch = []
+    for item in database_items(since):
+        batch.append(item)
+        if len(batch) >= 5000:
+            # Messages re-read within the margin are not added twice
+            index.add_many(index.changed(batch))
+            batch = []
+    index.add_many(index.changed(batch))
+    index.synced_at = synced_at
+
+
+def sync(index: VectorIndex, max_age: float = 0):
+    """Catch up unless synced within max_age seconds; callers never wait for a running sync"""
+    if index.synced_at is not None and (timezone.now() - index.synced_at).total_seconds() < max_age:
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        catch_up(index, margin=SYNC_MARGIN_SECONDS)
+    except Exception as e:
+        print(f"Warning: Could not sync vector index: {e}")
+    finally:
+        _sync_lock.release()
+
+
+def create_vector_index(path: Optional[str] = None) -> VectorIndex:
+    """An empty index configured from the VECTOR_INDEX_* settings"""
+    return VectorIndex(
+        path=path or get_index_path(),
+        nprobe=get_nprobe(),
+        min_train_size=get_min_train_size(),
+        quantize=quantization_enabled(),
+        loader=load_message_embeddings,
+    )
+
+
+# Global vector index instance
+_vector_index = None
+_vector_index_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+
+def get_vector_index() -> VectorIndex:
+    """Get or create the global vector index, loading or building it on first use"""
+    global _vector_index
+    if _vector_index is None:
+        with _vector_index_lock:
+            if _vector_index is None:
+                index = create_vector_index()
+                try:
+                    if index.load():
+                        catch_up(index)
+                    else:
+                        index.rebuild(database_items())
+                except Exception as e:
+                    print(f"Warning: Could not load vector index, rebuilding: {e}")
+                    index.rebuild(database_items())
+                _vector_index = index
+                return index
+    sync(_vector_index, max_age=SYNC_INTERVAL_SECONDS)
+    return _vector_index
+
+
+def index_message(message):
+    """
+    Add a message with an embedding to the vector index
+
+    Nothing to do while the index is not loaded: loading reads every
+    embedding from the database anyway.
+    """
+    if _vector_index is None or message.embedding is None:
+        return
+    try:
+        _vector_index.add(message.id, message.conversation_id, message.embedding)
+    except Exception as e:
+        print(f"Warning: Could not index message embedding: {e}")
+
+
+def remove_messages(message_ids=(), conversation_id=None):
+    """Drop deleted messages, or all of a deleted conversation, from the vector index"""
+    if _vector_index is None:
+        return
+    for message_id in message_ids:
+        _vector_index.remove(message_id)
+    if conversation_id is not None:
+        _vector_index.remove_conversation(conversation_id)
+
+
+def get_vector_index_stats() -> Optional[Dict]:
+    """Stats of the vector index, None until it is first used"""
+    return _vector_index.stats() if _vector_index is not None else None
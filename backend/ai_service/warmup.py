@@ -0,0 +1,134 @@
+"""
+Warm-up of models and search indexes at server startup
+Loads in a background thread what the first requests would otherwise load,
+and reports readiness so traffic can wait until it is done.
+"""
+import os
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+from django.db import close_old_connections
+
+
+def warm_embeddings():
+    from .embedding_service import get_embedding_service
+    service = get_embedding_service()
+    if service.model is None:
+        raise RuntimeError("Embedding model unavailable")
+    # The first encode initializes the runtime (kernels, ONNX session)
+    service.generate_embeddings(["warm-up"])
+
+
+def warm_vector_index():
+    from .vector_index import get_vector_index
+    get_vector_index()
+
+
+def warm_conversation_index():
+    from .conversation_embeddings import get_conversation_index
+    get_conversation_index()
+
+
+def warm_lexical_index():
+    from .lexical_index import get_lexical_index
+    get_lexical_index()
+
+
+def warm_llm():
+    from .llm_client import get_llm_client
+    from .model_registry import ROLE_CHAT
+    get_llm_client(ROLE_CHAT)
+
+
+WARMUP_STEPS: Dict[str, Callable[[], None]] = {
+    'embeddings': warm_embeddings,
+    'vector_index': warm_vector_index,
+    'conversation_index': warm_conversation_index,
+    'lexical_index': warm_lexical_index,
+    'llm': warm_llm,
+}
+
+
+def get_warmup_components() -> List[str]:
+    """WARMUP_COMPONENTS: comma-separated steps to run, empty to skip warm-up"""
+    value = os.getenv('WARMUP_COMPONENTS', 'embeddings,vector_index,conversation_index,lexical_index')
+    components = [name.strip() for name in value.split(',') if name.strip()]
+    for name in components:
+        if name not in WARMUP_STEPS:
+            print(f"Warning: Unknown warm-up component '{name}', skipped")
+    return [name for name in components if name in WARMUP_STEPS]
+
+
+class WarmUp:
+    """Runs warm-up steps in order on a background thread"""
+
+    def __init__(self, components: List[str]):
+        self.components = components
+        self.status = {name: 'pending' for name in components}
+        self.errors: Dict[str, str] = {}
+        self.durations: Dict[str, float] = {}
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self.run, name='warm-up', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        try:
+            for name in self.components:
+                self.status[name] = 'loading'
+                started = time.monotonic()
+                try:
+                    WARMUP_STEPS[name]()
+                    self.status[name] = 'ready'
+                except Exception as e:
+                    # The component still loads lazily on first use
+                    print(f"Warning: Warm-up of {name} failed: {e}")
+                    self.status[name] = 'failed'
+                    self.errors[name] = str(e)
+                self.durations[name] = time.monotonic() - started
+        finally:
+            close_old_connections()
+            self.finished_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        end = self.finished_at or time.monotonic()
+        return {
+            'ready': self.ready,
+            'components': dict(self.status),
+            'errors': dict(self.errors),
+            'durations_ms': {name: round(seconds * 1000, 1) for name, seconds in self.durations.items()},
+            'elapsed_ms': round((end - self.started_at) * 1000, 1) if self.started_at else 0.0,
+        }
+
+
+# Global warm-up, started once per server process
+_warm_up = None
+_warm_up_lock = threading.Lock()
+
+
+def start_warm_up() -> Optional[WarmUp]:
+    """Start warming up in the background, once; None when no components are configured"""
+    global _warm_up
+    with _warm_up_lock:
+        if _warm_up is None:
+            components = get_warmup_components()
+            if not components:
+                return None
+            _warm_up = WarmUp(components)
+            _warm_up.start()
+    return _warm_up
+
+
+def get_readiness() -> Dict:
+    """Readiness of this process; without a warm-up everything loads on first use"""
+    if _warm_up is None:
+        return {'ready': True, 'components': {}}
+    return _warm_up.stats()
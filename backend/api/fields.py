@@ -0,0 +1,65 @@
+"""
+Custom model fields
+"""
+import os
+import numpy as np
+from django.db import models
+
+
+# First byte of a stored embedding: the dtype of the values that follow
+EMBEDDING_DTYPES = {
+    b'\x04': np.float32,
+    b'\x02': np.float16,
+}
+EMBEDDING_DTYPE_CODES = {np.dtype(dtype): code for code, dtype in EMBEDDING_DTYPES.items()}
+
+
+def get_embedding_storage_dtype():
+    """EMBEDDING_STORAGE_DTYPE: "float32" (default) or "float16" (half the size)"""
+    return np.dtype(os.getenv('EMBEDDING_STORAGE_DTYPE', 'float32'))
+
+
+def encode_embedding(vector, dtype=None) -> bytes:
+    dtype = np.dtype(dtype or get_embedding_storage_dtype())
+    if dtype not in EMBEDDING_DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    return EMBEDDING_DTYPE_CODES[dtype] + np.asarray(vector, dtype=dtype).tobytes()
+
+
+def decode_embedding(value) -> np.ndarray:
+    """float32 vector from stored bytes, without parsing"""
+    value = bytes(value)
+    dtype = EMBEDDING_DTYPES.get(value[:1])
+    if dtype is None:
+        raise ValueError("Unknown embedding encoding")
+    vector = np.frombuffer(value, dtype=dtype, offset=1)
+    return vector if dtype is np.float32 else vector.astype(np.float32)
+
+
+class EmbeddingField(models.BinaryField):
+    """
+    Vector stored as float32 or float16 bytes behind a one-byte dtype code
+
+    Accepts lists or arrays and reads back as a float32 NumPy array.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decode_embedding(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return decode_embedding(value)
+        return np.asarray(value, dtype=np.float32)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        return encode_embedding(value)
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return None if value is None else np.asarray(value, dtype=np.float32).tolist()
@@ -0,0 +1,326 @@
+"""
+Django management command to (re-)analyze many conversations in parallel
+Progress is checkpointed after every batch, so an interrupted run picks up
+where it stopped when started again with the same filters.
+"""
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from api.models import Conversation, ConversationAnalysis, Message
+from ai_service.conversation_analyzer import ConversationAnalyzer, content_hash
+from ai_service.conversation_embeddings import refresh_conversation_embeddings
+
+
+ANALYSIS_UPDATE_FIELDS = [
+    'sentiment', 'topics', 'action_items', 'key_points', 'content_hash', 'analyzer_version'
+]
+
+
+def parse_moment(value, end_of_day=False):
+    """Datetime from an ISO datetime or a date (start or end of that day)"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Invalid date: {value}')
+        moment = datetime.combine(day, datetime.min.time())
+        if end_of_day:
+            moment += timedelta(days=1)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def after_cursor(queryset, cursor):
+    """Rows ordered after `cursor`, a (start_time, id) pair"""
+    start_time, conversation_id = cursor
+    return queryset.filter(
+        Q(start_time__gt=start_time) | Q(start_time=start_time, id__gt=conversation_id)
+    )
+
+
+def format_eta(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+
+class Command(BaseCommand):
+    help = 'Analyzes conversations in bulk with a worker pool, resuming interrupted runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=str,
+            default=None,
+            help='Only conversations started on or after this date/datetime',
+        )
+        parser.add_argument(
+            '--until',
+            type=str,
+            default=None,
+            help='Only conversations started before the end of this date/datetime',
+        )
+        parser.add_argument(
+            '--status',
+            choices=['ended', 'active', 'all'],
+            default='ended',
+            help='Conversation status to include (default: ended)',
+        )
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Only conversations without a stored analysis',
+        )
+        parser.add_argument(
+            '--stale',
+            action='store_true',
+            help='Only conversations not yet analyzed with the current analyzer version',
+        )
+        parser.add_argument(
+            '--analyzer-version',
+            type=str,
+            default=None,
+            help='Only analyses whose stored version contains this text (e.g. an old model file)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Stop after this many conversations',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Conversations analyzed concurrently (default: 4)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Conversations per database write and checkpoint (default: 50)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-analyze even when the stored analysis matches the messages',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default=None,
+            help='Checkpoint file (default: analyze_conversations.checkpoint.json in the backend dir)',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from the beginning',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the matching conversations',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1')
+
+        self.analyzer = ConversationAnalyzer()
+        self.version = self.analyzer.version
+        self.force = options['force']
+        queryset = self.filtered_queryset(options)
+
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            settings.BASE_DIR, 'analyze_conversations.checkpoint.json'
+        )
+        signature = {
+            key: options[key] for key in
+            ('since', 'until', 'status', 'missing', 'stale', 'analyzer_version', 'force')
+        }
+        signature['version'] = self.version
+        checkpoint = None if options['restart'] else self.load_checkpoint(checkpoint_path, signature)
+
+        stats = {'analyzed': 0, 'reused': 0, 'unchanged': 0, 'failed': 0}
+        cursor = None
+        if checkpoint:
+            stats.update(checkpoint['stats'])
+            cursor = (parse_datetime(checkpoint['cursor'][0]), checkpoint['cursor'][1])
+            queryset = after_cursor(queryset, cursor)
+            self.stdout.write(
+                f"Resuming after {sum(stats.values())} conversations from {checkpoint_path}"
+            )
+
+        total = queryset.count()
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        self.stdout.write(f'{total} conversations to process (analyzer version {self.version})')
+        if options['dry_run'] or not total:
+            return
+
+        done = 0
+        started = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='analyze')
+        try:
+            while done < total:
+                page = after_cursor(queryset, cursor) if cursor else queryset
+                batch = list(page[:min(options['batch_size'], total - done)])
+                if not batch:
+                    break
+
+                results = list(pool.map(self.process, batch))
+                self.write_batch(results)
+                for _, _, _, outcome, _ in results:
+                    stats[outcome] += 1
+
+                last = batch[-1]
+                cursor = (last.start_time, str(last.id))
+                self.save_checkpoint(checkpoint_path, signature, cursor, stats)
+
+                done += len(batch)
+                elapsed = time.perf_counter() - started
+                rate = done / elapsed if elapsed else 0.0
+                eta = (total - done) / rate if rate else 0.0
+                self.stdout.write(
+                    f"{done}/{total} ({100 * done / total:.0f}%)  "
+                    f"analyzed={stats['analyzed']} reused={stats['reused']} "
+                    f"unchanged={stats['unchanged']} failed={stats['failed']}  "
+                    f"{rate:.2f} conv/s  ETA {format_eta(eta)}"
+                )
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.stdout.write(self.style.WARNING(
+                '\nInterrupted; run the same command again to resume from the last checkpoint'
+            ))
+            return
+        pool.shutdown()
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Done: analyzed {stats['analyzed']}, reused {stats['reused']}, "
+            f"unchanged {stats['unchanged']}, failed {stats['failed']}"
+        ))
+
+    def filtered_queryset(self, options):
+        queryset = Conversation.objects.select_related('analysis').prefetch_related(
+            Prefetch('messages', queryset=Message.objects.order_by('timestamp'))
+        ).order_by('start_time', 'id')
+        if options['status'] != 'all':
+            queryset = queryset.filter(status=options['status'])
+        if options['since']:
+            queryset = queryset.filter(start_time__gte=parse_moment(options['since']))
+        if options['until']:
+            queryset = queryset.filter(start_time__lt=parse_moment(options['until'], end_of_day=True))
+        if options['missing']:
+            queryset = queryset.filter(analysis__isnull=True)
+        if options['stale']:
+            queryset = queryset.exclude(analysis__analyzer_version=self.version)
+        if options['analyzer_version']:
+            queryset = queryset.filter(analysis__analyzer_version__contains=options['analyzer_version'])
+        return queryset
+
+    def process(self, conversation):
+        """
+        Analyze one conversation without writing it
+        Returns (conversation, analysis data or None, content hash, outcome, error)
+        """
+        try:
+            messages = list(conversation.messages.all())
+            digest = content_hash(messages)
+            stored = getattr(conversation, 'analysis', None)
+            if not self.force:
+                current, copied = self.analyzer.lookup(conversation, stored, digest, self.version)
+                if current:
+                    return conversation, None, digest, 'unchanged', None
+                if copied:
+                    return conversation, copied, digest, 'reused', None
+            data = self.analyzer.analyze_conversation(conversation, messages)
+            return conversation, data, digest, 'analyzed', None
+        except Exception as e:
+            return conversation, None, '', 'failed', e
+        finally:
+            # Pool threads keep their own connections otherwise
+            connection.close()
+
+    def write_batch(self, results):
+        """Store a batch of results with one bulk write per table"""
+        now = timezone.now()
+        conversations, created, updated = [], [], []
+        for conversation, data, digest, outcome, error in results:
+            if outcome == 'failed':
+                self.stderr.write(f'Error analyzing {conversation.id}: {error}')
+                conversation.analysis_status = 'failed'
+                conversation.analysis_error = str(error)
+            elif data is not None:
+                conversation.summary = data['summary']
+                conversation.analysis_status = 'completed'
+                conversation.analysis_error = ''
+                analysis = getattr(conversation, 'analysis', None)
+                if analysis is None:
+                    analysis = ConversationAnalysis(conversation=conversation)
+                    created.append(analysis)
+                else:
+                    updated.append(analysis)
+                for field in ('sentiment', 'topics', 'action_items', 'key_points'):
+                    setattr(analysis, field, data[field])
+                analysis.content_hash = digest
+                analysis.analyzer_version = self.version
+            else:
+                continue
+            conversation.updated_at = now
+            conversations.append(conversation)
+
+        with transaction.atomic():
+            if conversations:
+                Conversation.objects.bulk_update(
+                    conversations, ['summary', 'analysis_status', 'analysis_error', 'updated_at']
+                )
+            if created:
+                ConversationAnalysis.objects.bulk_create(created)
+            if updated:
+                ConversationAnalysis.objects.bulk_update(updated, ANALYSIS_UPDATE_FIELDS)
+
+        # New summaries are embedded in one batch as well
+        try:
+            refresh_conversation_embeddings(
+                [c for c in conversations if c.analysis_status == 'completed']
+            )
+        except Exception as e:
+            self.stderr.write(f'Could not embed conversations: {e}')
+
+    def load_checkpoint(self, path, signature):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            self.stdout.write(self.style.WARNING(f'Ignoring unreadable checkpoint {path}: {e}'))
+            return None
+        if checkpoint.get('filters') != signature:
+            self.stdout.write(self.style.WARNING(
+                f'Ignoring checkpoint {path}: it was written for other filters or analyzer version'
+            ))
+            return None
+        return checkpoint
+
+    @staticmethod
+    def save_checkpoint(path, signature, cursor, stats):
+        # Write then rename so a kill mid-write never leaves a broken checkpoint
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'filters': signature,
+                'cursor': [cursor[0].isoformat(), cursor[1]],
+                'stats': stats,
+                'updated_at': timezone.now().isoformat(),
+            }, f, indent=2)
+        os.replace(temp_path, path)
@@ -0,0 +1,92 @@
+"""
+Django management command to embed messages that have no embedding yet
+Each batch is committed as soon as it is encoded, so an interrupted run
+resumes where it stopped: only messages still without an embedding are read.
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from api.models import Message
+from ai_service.embedding_service import get_embedding_service
+
+
+class Command(BaseCommand):
+    help = 'Embeds messages without an embedding in large batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=256,
+            help='Messages encoded and written per batch (default: 256)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Stop after this many messages',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the messages that would be embedded',
+        )
+
+    def handle(self, *args, **options):
+        messages = Message.objects.filter(embedding__isnull=True).exclude(content='')
+        total = messages.count()
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        if options['dry_run'] or not total:
+            self.stdout.write(f'{total} messages without an embedding')
+            return
+
+        embedding_service = get_embedding_service()
+        if embedding_service.model is None:
+            self.stderr.write('Embedding model unavailable')
+            return
+
+        self.checked = self.embedded = 0
+        self.started = time.perf_counter()
+        batch = []
+        # Unordered, so the database streams rows without sorting the table
+        for message in messages.order_by().only('id', 'content').iterator(chunk_size=2000):
+            batch.append(message)
+            if len(batch) >= options['batch_size']:
+                self.write_batch(batch, embedding_service, total)
+                batch = []
+            if self.checked + len(batch) >= total:
+                break
+        self.write_batch(batch, embedding_service, total)
+
+        elapsed = time.perf_counter() - self.started
+        failed = self.checked - self.embedded
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Embedded {self.embedded} messages in {elapsed:.1f}s '
+            f'({self.embedded / elapsed if elapsed else 0:.0f} msgs/s)'
+        ))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'{failed} messages could not be embedded, run the command again to retry them'
+            ))
+        self.stdout.write('Running servers add the new embeddings to their vector index within seconds')
+
+    def write_batch(self, batch, embedding_service, total):
+        """Encode a batch in one call and store it with one bulk update"""
+        if not batch:
+            return
+        now = timezone.now()
+        embedded = []
+        for message, vector in zip(batch, embedding_service.generate_embeddings([m.content for m in batch])):
+            if vector is None:
+                continue
+            message.embedding = vector
+            message.embedding_updated_at = now
+            embedded.append(message)
+        with transaction.atomic():
+            Message.objects.bulk_update(embedded, ['embedding', 'embedding_updated_at'], batch_size=500)
+        self.checked += len(batch)
+        self.embedded += len(embedded)
+        rate = self.checked / (time.perf_counter() - self.started)
+        self.stdout.write(f'{self.checked}/{total} messages, {self.embedded} embedded ({rate:.0f} msgs/s)')
@@ -1,12 +1,145 @@
 """
 Django management command to create sample conversation data with AI-generated insights
+With --scale it instead bulk-generates large randomized datasets for load testing
 """
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 from api.models import Conversation, Message, ConversationAnalysis
 from ai_service.conversation_analyzer import ConversationAnalyzer
+from ai_service.conversation_embeddings import (
+    refresh_conversation_embedding, refresh_conversation_embeddings
+)
+from ai_service.fast_analyzers import DEFAULT_TOPICS
+import numpy as np
 import random
+import time
+import uuid
+
+
+# Sentence templates for synthetic conversations; {topic} and {word} are filled in
+USER_TEMPLATES = [
+    "Can you help me with {topic}?",
+    "I'm trying to figure out the best approach to {topic}.",
+    "What do you know about {word} when it comes to {topic}?",
+    "I need to decide on {word} by next week.",
+    "That makes sense, but how does {word} fit in?",
+    "Could you explain {word} in simpler terms?",
+    "Thanks, that's really helpful!",
+    "I'm not sure that works for me, the {word} part is confusing.",
+    "Should I start with {word} or focus on something else?",
+    "Remember to remind me about the {word} later.",
+]
+
+AI_TEMPLATES = [
+    "Sure, {topic} is a broad area, so let's start with the basics.",
+    "A good first step is to look at {word} and see how it applies to your situation.",
+    "Many people find that {word} makes {topic} much easier to manage.",
+    "You should compare a few options for {word} before committing.",
+    "The main trade-off is between {word} and cost.",
+    "Here is a short plan: review {word}, set a goal, and check progress weekly.",
+    "That's a common question about {topic}.",
+    "In short, {word} matters most early on; the details can come later.",
+    "I'd recommend writing down what you expect from {word} first.",
+    "Let me know if you'd like more detail on {word}.",
+]
+
+FILLER_WORDS = [
+    "budget", "schedule", "planning", "tools", "costs", "timeline", "quality",
+    "priorities", "resources", "feedback", "options", "risks", "goals", "habits",
+    "strategy", "examples", "requirements", "maintenance", "setup", "practice",
+]
+
+SUMMARY_TEMPLATE = "Discussion about {topic} with {count} messages covering key aspects and recommendations."
+
+
+class SyntheticDataGenerator:
+    """Deterministic (per seed) random conversations, messages and analyses"""
+
+    def __init__(self, seed, messages_mean, messages_sigma, messages_max, days,
+                 active_ratio, embedding_dim):
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.topics = sorted(set(DEFAULT_TOPICS))
+        self.topic_index = {topic: i for i, topic in enumerate(self.topics)}
+        # Log-normal message counts with the requested mean, clamped to [2, max]
+        self.mu = np.log(messages_mean) - messages_sigma ** 2 / 2
+        self.sigma = messages_sigma
+        self.messages_max = messages_max
+        self.days = days
+        self.active_ratio = active_ratio
+        self.embedding_dim = embedding_dim
+        self._centroids = None
+
+    def uuid(self):
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def text(self, templates, topic):
+        count = self.random.choices([1, 2, 3, 4], weights=[4, 3, 2, 1])[0]
+        return " ".join(
+            self.random.choice(templates).format(topic=topic, word=self.random.choice(FILLER_WORDS))
+            for _ in range(count)
+        )
+
+    def conversations(self, count, now):
+        """`count` unsaved conversations with their unsaved messages"""
+        sizes = np.clip(
+            np.rint(self.rng.lognormal(self.mu, self.sigma, count)), 2, self.messages_max
+        ).astype(int)
+        result = []
+        for size in sizes:
+            topic = self.random.choice(self.topics)
+            start_time = now - timedelta(seconds=self.random.uniform(0, self.days * 86400))
+            ended = self.random.random() >= self.active_ratio
+            conversation = Conversation(
+                id=self.uuid(),
+                title=f"{topic[:1].upper()}{topic[1:]} ({self.random.randint(1, 9999)})",
+                start_time=start_time,
+                status='ended' if ended else 'active',
+            )
+            timestamp = start_time
+            messages = []
+            for i in range(size):
+                sender = 'user' if i % 2 == 0 else 'ai'
+                timestamp += timedelta(seconds=self.random.randint(5, 600))
+                messages.append(Message(
+                    id=self.uuid(),
+                    conversation=conversation,
+                    sender=sender,
+                    content=self.text(USER_TEMPLATES if sender == 'user' else AI_TEMPLATES, topic),
+                    timestamp=timestamp,
+                ))
+            if ended:
+                conversation.end_time = timestamp
+            result.append((conversation, topic, messages))
+        return result
+
+    def embeddings(self, topic_indices):
+        """
+        Unit vectors clustered around one random centroid per topic, so
+        nearest-neighbour queries behave roughly like real embeddings
+        """
+        if self._centroids is None:
+            centroids = self.rng.standard_normal((len(self.topics), self.embedding_dim))
+            self._centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+        noise = self.rng.standard_normal((len(topic_indices), self.embedding_dim)) / np.sqrt(self.embedding_dim)
+        vectors = self._centroids[topic_indices] + noise
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.astype(np.float32)
+
+    def analysis(self, conversation, topic, messages):
+        conversation.summary = SUMMARY_TEMPLATE.format(topic=topic, count=len(messages))
+        conversation.analysis_status = 'completed'
+        related = self.random.sample(self.topics, 2)
+        return ConversationAnalysis(
+            id=self.uuid(),
+            conversation=conversation,
+            sentiment=self.random.choices(['positive', 'neutral', 'negative'], weights=[5, 4, 1])[0],
+            topics=[topic] + [t for t in related if t != topic][:self.random.randint(0, 2)],
+            action_items=[f"Follow up on {self.random.choice(FILLER_WORDS)}"] if self.random.random() < 0.3 else [],
+            key_points=[f"Main topic: {topic}", f"Discussed {self.random.choice(FILLER_WORDS)}"],
+        )
 
 
 class Command(BaseCommand):
@@ -24,10 +157,78 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip AI analysis generation (faster, but no insights)',
         )
+        parser.add_argument(
+            '--force-analysis',
+            action='store_true',
+            help='Run the LLM even when an analysis of identical content is stored',
+        )
+        parser.add_argument(
+            '--scale',
+            action='store_true',
+            help='Bulk-generate --count randomized conversations for load testing (no LLM calls)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed; the same seed produces the same dataset (--scale)',
+        )
+        parser.add_argument(
+            '--messages-mean',
+            type=float,
+            default=20,
+            help='Mean messages per conversation, log-normally distributed (--scale, default: 20)',
+        )
+        parser.add_argument(
+            '--messages-sigma',
+            type=float,
+            default=0.8,
+            help='Spread of the log-normal message count distribution (--scale, default: 0.8)',
+        )
+        parser.add_argument(
+            '--messages-max',
+            type=int,
+            default=500,
+            help='Maximum messages per conversation (--scale, default: 500)',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='Spread conversation start times over this many days (--scale, default: 365)',
+        )
+        parser.add_argument(
+            '--active-ratio',
+            type=float,
+            default=0.05,
+            help='Fraction of conversations left active (--scale, default: 0.05)',
+        )
+        parser.add_argument(
+            '--embeddings',
+            choices=['none', 'random', 'model'],
+            default='none',
+            help='Message embeddings: none, topic-clustered random vectors, or the embedding model (--scale)',
+        )
+        parser.add_argument(
+            '--embedding-dim',
+            type=int,
+            default=384,
+            help='Dimension of random embeddings (--scale, default: 384)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Conversations per bulk insert transaction (--scale, default: 1000)',
+        )
 
     def handle(self, *args, **options):
+        if options.get('scale'):
+            return self.handle_scale(options)
+
         count = options['count']
         skip_analysis = options.get('skip_analysis', False)
+        force_analysis = options.get('force_analysis', False)
         
         topics = [
             "Planning a trip to Japan",
@@ -146,19 +347,11 @@ class Command(BaseCommand):
             if analyzer:
                 try:
                     self.stdout.write(f'Analyzing conversation: {topic}...')
-                    analysis_data = analyzer.analyze_conversation(conversation)
-                    
-                    conversation.summary = analysis_data.get('summary', f"Discussion about {topic}")
-                    conversation.save()
-                    
-                    ConversationAnalysis.objects.create(
-                        conversation=conversation,
-                        sentiment=analysis_data.get('sentiment', 'neutral'),
-                        topics=analysis_data.get('topics', [topic]),
-                        action_items=analysis_data.get('action_items', []),
-                        key_points=analysis_data.get('key_points', [f"Main topic: {topic}"]),
-                    )
-                    self.stdout.write(self.style.SUCCESS(f'✓ Generated AI insights for: {topic}'))
+                    # Conversations with identical messages reuse the stored analysis
+                    if analyzer.analyze_and_save(conversation, force=force_analysis):
+                        self.stdout.write(self.style.SUCCESS(f'✓ Generated AI insights for: {topic}'))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f'✓ Reused AI insights for: {topic}'))
                 except Exception as e:
                     self.stdout.write(
                         self.style.WARNING(f'Could not generate AI analysis: {e}. Using fallback.')
@@ -185,6 +378,8 @@ class Command(BaseCommand):
                     key_points=[f"Main topic: {topic}", "User seeking information and advice"],
                 )
             
+            refresh_conversation_embedding(conversation)
+            
             created_count += 1
             self.stdout.write(
                 self.style.SUCCESS(f'Created conversation {created_count}/{count}: {conversation.title}')
@@ -202,3 +397,85 @@ class Command(BaseCommand):
         self.stdout.write('  - Query past conversations in Intelligence page')
         self.stdout.write('  - View analytics and insights')
 
+    def handle_scale(self, options):
+        """Insert --count synthetic conversations in bulk, one transaction per batch"""
+        count = options['count']
+        batch_size = options['batch_size']
+        if batch_size < 1 or options['messages_mean'] < 2:
+            raise CommandError('--batch-size must be at least 1 and --messages-mean at least 2')
+
+        generator = SyntheticDataGenerator(
+            seed=options['seed'],
+            messages_mean=options['messages_mean'],
+            messages_sigma=options['messages_sigma'],
+            messages_max=options['messages_max'],
+            days=options['days'],
+            active_ratio=options['active_ratio'],
+            embedding_dim=options['embedding_dim'],
+        )
+        embedding_service = None
+        if options['embeddings'] == 'model':
+            from ai_service.embedding_service import get_embedding_service
+            embedding_service = get_embedding_service()
+            if embedding_service.model is None:
+                raise CommandError('Embedding model unavailable; use --embeddings random or none')
+
+        now = timezone.now()
+        created = messages_created = 0
+        started = time.perf_counter()
+        while created < count:
+            batch = generator.conversations(min(batch_size, count - created), now)
+            conversations = [conversation for conversation, _, _ in batch]
+            messages = [msg for _, _, conversation_messages in batch for msg in conversation_messages]
+            analyses = []
+            if not options['skip_analysis']:
+                analyses = [
+                    generator.analysis(conversation, topic, conversation_messages)
+                    for conversation, topic, conversation_messages in batch
+                    if conversation.status == 'ended'
+                ]
+
+            if options['embeddings'] == 'random':
+                topic_indices = [
+                    generator.topic_index[topic]
+                    for _, topic, conversation_messages in batch for _ in conversation_messages
+                ]
+                for msg, vector in zip(messages, generator.embeddings(topic_indices)):
+                    msg.embedding = vector
+                    msg.embedding_updated_at = now
+                ended = [(c, topic) for c, topic, _ in batch if c.status == 'ended']
+                vectors = generator.embeddings([generator.topic_index[topic] for _, topic in ended])
+                for (conversation, _), vector in zip(ended, vectors):
+                    # No embedding_hash: embed_conversations replaces these with real ones
+                    conversation.embedding = vector
+                    conversation.embedding_updated_at = now
+            elif embedding_service is not None:
+                vectors = embedding_service.generate_embeddings([msg.content for msg in messages])
+                for msg, vector in zip(messages, vectors):
+                    msg.embedding = vector
+                    if vector is not None:
+                        msg.embedding_updated_at = now
+
+            with transaction.atomic():
+                Conversation.objects.bulk_create(conversations)
+                Message.objects.bulk_create(messages, batch_size=5000)
+                ConversationAnalysis.objects.bulk_create(analyses)
+            if embedding_service is not None:
+                refresh_conversation_embeddings(
+                    [c for c in conversations if c.status == 'ended'], embedding_service=embedding_service
+                )
+
+            created += len(conversations)
+            messages_created += len(messages)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{created}/{count} conversations, {messages_created} messages '
+                f'({messages_created / elapsed:.0f} messages/s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'\n✓ Created {created} conversations with {messages_created} messages '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
+        if options['skip_analysis']:
+            self.stdout.write('Run `python manage.py analyze_conversations --missing` to analyze them')
@@ -0,0 +1,51 @@
+"""
+Django management command to compute stored conversation embeddings
+"""
+import time
+from django.core.management.base import BaseCommand
+from api.models import Conversation
+from ai_service.conversation_embeddings import refresh_conversation_embeddings
+from ai_service.embedding_service import get_embedding_service
+
+
+class Command(BaseCommand):
+    help = 'Embeds ended conversations that have no embedding or whose summary changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=256,
+            help='Conversations encoded and written per batch (default: 256)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-embed every conversation, e.g. after changing EMBEDDING_MODEL',
+        )
+
+    def handle(self, *args, **options):
+        embedding_service = get_embedding_service()
+        if embedding_service.model is None:
+            self.stderr.write('Embedding model unavailable')
+            return
+
+        conversations = Conversation.objects.filter(status='ended').order_by('start_time')
+        total = conversations.count()
+        checked = embedded = 0
+        started = time.perf_counter()
+        batch = []
+        for conversation in conversations.iterator(chunk_size=options['batch_size']):
+            batch.append(conversation)
+            if len(batch) >= options['batch_size']:
+                embedded += refresh_conversation_embeddings(batch, options['force'], embedding_service)
+                checked += len(batch)
+                batch = []
+                self.stdout.write(f'{checked}/{total} checked, {embedded} embedded '
+                                  f'({checked / (time.perf_counter() - started):.0f}/s)')
+        embedded += refresh_conversation_embeddings(batch, options['force'], embedding_service)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Embedded {embedded} of {total} ended conversations '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,31 @@
+"""
+Django management command to rebuild the message vector index from the database
+"""
+import time
+from django.core.management.base import BaseCommand
+from ai_service.vector_index import create_vector_index, database_items, get_index_path
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the persistent message vector index from stored embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Where to write the index (default: VECTOR_INDEX_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output'] or get_index_path()
+        index = create_vector_index(path)
+        started = time.perf_counter()
+        index.rebuild(database_items())
+        stats = index.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Indexed {stats['vectors']} messages ({stats['dim']} dims, {stats['lists']} lists, "
+            f"{'int8' if index.quantize else 'float32'}) "
+            f"in {time.perf_counter() - started:.1f}s to {path}"
+        ))
+        self.stdout.write('Running servers pick up the new index when restarted')
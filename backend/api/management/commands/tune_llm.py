@@ -0,0 +1,214 @@
+"""
+Django management command to benchmark llama.cpp thread/batch settings on this host
+"""
+import os
+import gc
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from llama_cpp import Llama
+from ai_service.model_registry import ROLE_CHAT, get_model_pool
+from ai_service.runtime_config import (
+    available_cpus, physical_cores, get_llama_params, tuning_file_path
+)
+
+
+# Fixed benchmark prompt, repeated up to the requested prompt length
+BENCHMARK_TEXT = (
+    "The history of computing spans mechanical calculators, vacuum tubes, "
+    "transistors and integrated circuits. Each generation made machines smaller, "
+    "faster and cheaper, which in turn opened up new uses in science, business "
+    "and everyday life. "
+)
+
+
+def parse_int_list(value):
+    return sorted({int(v) for v in value.split(',') if v.strip()})
+
+
+def rss_kb():
+    """Current RSS of this process in KB, None without /proc"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks llama.cpp thread and batch settings and writes the best config'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            type=str,
+            default=None,
+            help='Path to the .gguf model (default: the chat model)',
+        )
+        parser.add_argument(
+            '--threads',
+            type=str,
+            default=None,
+            help='Comma-separated thread counts to try (default: around the core count)',
+        )
+        parser.add_argument(
+            '--batch-sizes',
+            type=str,
+            default='128,256,512',
+            help='Comma-separated n_batch values to try (default: 128,256,512)',
+        )
+        parser.add_argument(
+            '--prompt-tokens',
+            type=int,
+            default=512,
+            help='Prompt length used to measure prefill speed (default: 512)',
+        )
+        parser.add_argument(
+            '--gen-tokens',
+            type=int,
+            default=64,
+            help='Tokens generated to measure decode speed (default: 64)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Where to write the best config (default: LLM_TUNING_FILE)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report results without writing the config file',
+        )
+
+    def handle(self, *args, **options):
+        model_path = options['model'] or self.default_model_path()
+        if not model_path or not os.path.exists(model_path):
+            raise CommandError(f'Model file not found: {model_path}')
+
+        cores = physical_cores()
+        logical = available_cpus()
+        if options['threads']:
+            thread_counts = parse_int_list(options['threads'])
+        else:
+            thread_counts = sorted({max(1, cores // 2), cores, logical})
+        batch_sizes = parse_int_list(options['batch_sizes'])
+        base_params = get_llama_params()
+        # Benchmark plain decoding; a draft model would skew decode speed
+        base_params.pop('draft', None)
+        base_params.pop('draft_num_pred_tokens', None)
+        n_ctx = max(base_params['n_ctx'], options['prompt_tokens'] + options['gen_tokens'] + 8)
+
+        self.stdout.write(
+            f'Host: {cores} physical cores, {logical} logical CPUs. '
+            f'Trying threads={thread_counts} n_batch={batch_sizes}'
+        )
+
+        results = []
+        for threads in thread_counts:
+            for n_batch in batch_sizes:
+                params = dict(
+                    base_params,
+                    n_ctx=n_ctx,
+                    n_threads=threads,
+                    n_threads_batch=threads,
+                    n_batch=n_batch,
+                )
+                try:
+                    result = self.benchmark(model_path, params, options)
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(
+                        f'threads={threads} n_batch={n_batch}: failed ({e})'
+                    ))
+                    continue
+                results.append(result)
+                self.stdout.write(
+                    f"threads={threads:<3} n_batch={n_batch:<5} "
+                    f"prefill={result['prefill_tok_s']:>8.1f} tok/s  "
+                    f"decode={result['decode_tok_s']:>6.2f} tok/s  "
+                    f"memory={self.format_memory(result['memory_mb'])}"
+                )
+
+        if not results:
+            raise CommandError('No configuration completed successfully')
+
+        # Decode speed decides n_threads; prefill speed decides batch settings
+        best_decode = max(results, key=lambda r: r['decode_tok_s'])
+        best_prefill = max(results, key=lambda r: r['prefill_tok_s'])
+        config = {
+            'n_threads': best_decode['n_threads'],
+            'n_threads_batch': best_prefill['n_threads'],
+            'n_batch': best_prefill['n_batch'],
+            'model': os.path.abspath(model_path),
+            'prefill_tok_s': best_prefill['prefill_tok_s'],
+            'decode_tok_s': best_decode['decode_tok_s'],
+            'tuned_at': timezone.now().isoformat(),
+            'results': results,
+        }
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nBest: n_threads={config['n_threads']} "
+            f"n_threads_batch={config['n_threads_batch']} n_batch={config['n_batch']}"
+        ))
+
+        if options['dry_run']:
+            return
+        output = options['output'] or tuning_file_path()
+        with open(output, 'w') as f:
+            json.dump(config, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'✓ Wrote tuned config to {output}'))
+
+    def default_model_path(self):
+        pool = get_model_pool()
+        spec = pool.specs[pool.model_for_role(ROLE_CHAT)]
+        return spec.get('model_path') or os.getenv('MODEL_PATH', 'model.gguf')
+
+    @staticmethod
+    def format_memory(memory_mb):
+        return f'{memory_mb:.0f} MB' if memory_mb is not None else 'n/a'
+
+    def benchmark(self, model_path, params, options):
+        """Load the model with `params` and time prefill and greedy decode"""
+        # The process-wide peak includes earlier configs, so memory is
+        # measured as the RSS growth over the RSS before this model loaded
+        baseline = rss_kb()
+        model = Llama(model_path=model_path, **params)
+        samples = [rss_kb()]
+        try:
+            text = BENCHMARK_TEXT
+            tokens = model.tokenize(text.encode('utf-8'))
+            while len(tokens) < options['prompt_tokens']:
+                text += BENCHMARK_TEXT
+                tokens = model.tokenize(text.encode('utf-8'))
+            tokens = tokens[:options['prompt_tokens']]
+
+            model.reset()
+            started = time.perf_counter()
+            model.eval(tokens)
+            prefill_seconds = time.perf_counter() - started
+            samples.append(rss_kb())
+
+            started = time.perf_counter()
+            for _ in range(options['gen_tokens']):
+                token = model.sample(temp=0.0)
+                model.eval([token])
+            decode_seconds = time.perf_counter() - started
+
+            samples.append(rss_kb())
+            memory_mb = None
+            if baseline is not None:
+                memory_mb = round((max(samples) - baseline) / 1024, 1)
+            return {
+                'n_threads': params['n_threads'],
+                'n_batch': params['n_batch'],
+                'prefill_tok_s': round(len(tokens) / prefill_seconds, 2),
+                'decode_tok_s': round(options['gen_tokens'] / decode_seconds, 2),
+                'memory_mb': memory_mb,
+            }
+        finally:
+            del model
+            gc.collect()
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:31
+
+from django.db import migrations, models
+
+
+def mark_analyzed(apps, schema_editor):
+    """Conversations analyzed before this migration count as completed"""
+    Conversation = apps.get_model("api", "Conversation")
+    Conversation.objects.filter(analysis__isnull=False).update(analysis_status="completed")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="analysis_error",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="analysis_status",
+            field=models.CharField(
+                choices=[
+                    ("none", "Not requested"),
+                    ("pending", "Pending"),
+                    ("running", "Running"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                default="none",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(mark_analyzed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0002_conversation_analysis_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationSummaryChunk",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("level", models.PositiveSmallIntegerField(default=0)),
+                ("index", models.PositiveIntegerField()),
+                ("start_message", models.PositiveIntegerField()),
+                ("end_message", models.PositiveIntegerField()),
+                ("summary", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="summary_chunks",
+                        to="api.conversation",
+                    ),
+                ),
+                (
+                    "last_message",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.message",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["level", "index"],
+                "unique_together": {("conversation", "level", "index")},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0003_conversation_summary_chunk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversationanalysis",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="conversationanalysis",
+            name="analyzer_version",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
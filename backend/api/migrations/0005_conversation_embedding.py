@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0004_conversationanalysis_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="embedding",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="embedding_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="embedding_updated_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
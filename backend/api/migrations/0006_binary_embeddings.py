@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:48
+
+import api.fields
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+
+def copy_embeddings(model, source, target):
+    batch = []
+    for obj in model.objects.filter(**{f"{source}__isnull": False}).only("id", source).iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        value = getattr(obj, source)
+        if value is None or len(value) == 0:
+            continue
+        setattr(obj, target, value if target == "embedding_data" else [float(x) for x in value])
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_update(batch, [target])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [target])
+
+
+def json_to_binary(apps, schema_editor):
+    for name in ("Message", "Conversation"):
+        copy_embeddings(apps.get_model("api", name), "embedding", "embedding_data")
+
+
+def binary_to_json(apps, schema_editor):
+    for name in ("Message", "Conversation"):
+        copy_embeddings(apps.get_model("api", name), "embedding_data", "embedding")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0005_conversation_embedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="embedding_data",
+            field=api.fields.EmbeddingField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="embedding_data",
+            field=api.fields.EmbeddingField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name="message",
+            name="embedding",
+        ),
+        migrations.RemoveField(
+            model_name="conversation",
+            name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="message",
+            old_name="embedding_data",
+            new_name="embedding",
+        ),
+        migrations.RenameField(
+            model_name="conversation",
+            old_name="embedding_data",
+            new_name="embedding",
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0006_binary_embeddings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="embedding_updated_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
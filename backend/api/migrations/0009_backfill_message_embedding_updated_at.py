@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 14:40
+
+from django.db import migrations
+from django.db.models import F
+
+
+def backfill_embedding_updated_at(apps, schema_editor):
+    # Vector index syncs only filter on embedding_updated_at
+    Message = apps.get_model("api", "Message")
+    Message.objects.filter(embedding__isnull=False, embedding_updated_at__isnull=True).update(
+        embedding_updated_at=F("created_at")
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_sync_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_embedding_updated_at, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 import uuid
+from .fields import EmbeddingField
 
 
 class Conversation(models.Model):
@@ -9,6 +10,13 @@ class Conversation(models.Model):
         ('active', 'Active'),
         ('ended', 'Ended'),
     ]
+    ANALYSIS_STATUS_CHOICES = [
+        ('none', 'Not requested'),
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255, blank=True)
@@ -18,8 +26,13 @@ class Conversation(models.Model):
     summary = models.TextField(blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     share_token = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    analysis_status = models.CharField(max_length=10, choices=ANALYSIS_STATUS_CHOICES, default='none')
+    analysis_error = models.TextField(blank=True)
+    embedding = EmbeddingField(null=True, blank=True)  # Embedding of the summary (or opening messages)
+    embedding_hash = models.CharField(max_length=64, blank=True)  # Hash of the embedded text and model
+    embedding_updated_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         ordering = ['-start_time']
@@ -46,11 +59,12 @@ class Message(models.Model):
     content = models.TextField()
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES)
     timestamp = models.DateTimeField(default=timezone.now)
-    embedding = models.JSONField(null=True, blank=True)  # Store vector embeddings
+    embedding = EmbeddingField(null=True, blank=True)  # float32/float16 vector bytes
+    embedding_updated_at = models.DateTimeField(null=True, blank=True, db_index=True)
     reactions = models.JSONField(default=dict, blank=True)  # Store emoji reactions
     is_bookmarked = models.BooleanField(default=False)
     parent_message = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     
     class Meta:
         ordering = ['timestamp']
@@ -67,8 +81,29 @@ class ConversationAnalysis(models.Model):
     topics = models.JSONField(default=list, blank=True)  # List of extracted topics
     action_items = models.JSONField(default=list, blank=True)  # List of action items
     key_points = models.JSONField(default=list, blank=True)  # List of key discussion points
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # Hash of the analyzed messages
+    analyzer_version = models.CharField(max_length=255, blank=True)  # Prompt version, mode and model used
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"Analysis for {self.conversation}"
 
+
+class ConversationSummaryChunk(models.Model):
+    """Stored summary of a fixed span of a conversation (see ai_service.rolling_summary)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='summary_chunks')
+    level = models.PositiveSmallIntegerField(default=0)  # 0 summarizes messages, higher levels merge chunks
+    index = models.PositiveIntegerField()  # Position among the chunks of the same level
+    start_message = models.PositiveIntegerField()  # Ordinal of the first covered message
+    end_message = models.PositiveIntegerField()  # Ordinal after the last covered message
+    last_message = models.ForeignKey(Message, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['level', 'index']
+        unique_together = [('conversation', 'level', 'index')]
+    
+    def __str__(self):
+        return f"Summary chunk {self.level}/{self.index} of {self.conversation}"
@@ -39,8 +39,10 @@ class ConversationSerializer(serializers.ModelSerializer):
         model = Conversation
         fields = ['id', 'title', 'start_time', 'end_time', 'status', 'summary',
                   'metadata', 'share_token', 'message_count', 'duration_seconds',
-                  'messages', 'analysis', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'share_token']
+                  'messages', 'analysis', 'analysis_status', 'analysis_error',
+                  'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'share_token',
+                            'analysis_status', 'analysis_error']
     
     def get_duration_seconds(self, obj):
         """Calculate duration in seconds"""
@@ -63,8 +65,9 @@ class ConversationListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
         fields = ['id', 'title', 'start_time', 'end_time', 'status', 'summary',
-                  'message_count', 'preview', 'duration_seconds', 'share_token', 'created_at']
-        read_only_fields = ['id', 'created_at', 'share_token']
+                  'message_count', 'preview', 'duration_seconds', 'share_token',
+                  'analysis_status', 'created_at']
+        read_only_fields = ['id', 'created_at', 'share_token', 'analysis_status']
     
     def get_preview(self, obj):
         """Get preview of first message"""
@@ -0,0 +1,87 @@
+"""
+Tests for api
+"""
+import os
+from unittest import mock
+import numpy as np
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from .fields import decode_embedding, encode_embedding
+from .models import Conversation, Message
+
+
+class EmbeddingFieldTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title='Test')
+
+    def test_round_trip_as_float32_array(self):
+        vector = [0.25, -1.5, 3.0]
+        message = Message.objects.create(
+            conversation=self.conversation, content='hi', sender='user', embedding=vector
+        )
+        message.refresh_from_db()
+        self.assertIsInstance(message.embedding, np.ndarray)
+        self.assertEqual(message.embedding.dtype, np.float32)
+        np.testing.assert_array_equal(message.embedding, vector)
+
+    def test_missing_embedding_stays_none(self):
+        message = Message.objects.create(conversation=self.conversation, content='hi', sender='user')
+        message.refresh_from_db()
+        self.assertIsNone(message.embedding)
+
+    @mock.patch.dict(os.environ, {'EMBEDDING_STORAGE_DTYPE': 'float16'})
+    def test_float16_storage_reads_back_as_float32(self):
+        vector = np.linspace(-1, 1, 384, dtype=np.float32)
+        self.assertEqual(len(encode_embedding(vector)), 1 + 384 * 2)
+        self.conversation.embedding = vector
+        self.conversation.save()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.embedding.dtype, np.float32)
+        np.testing.assert_allclose(self.conversation.embedding, vector, atol=1e-3)
+
+    def test_unknown_encoding_is_rejected(self):
+        with self.assertRaises(ValueError):
+            decode_embedding(b'\x08' + bytes(8))
+        with self.assertRaises(ValueError):
+            encode_embedding([1.0], dtype='float64')
+
+
+class BinaryEmbeddingMigrationTests(TransactionTestCase):
+    before = [('api', '0005_conversation_embedding')]
+    after = [('api', '0006_binary_embeddings')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_json_embeddings_are_converted_both_ways(self):
+        apps = self.migrate(self.before)
+        conversation = apps.get_model('api', 'Conversation').objects.create(
+            title='Test', embedding=[0.5, 0.25]
+        )
+        messages = apps.get_model('api', 'Message').objects
+        embedded = messages.create(conversation=conversation, content='a', sender='user',
+                                   embedding=[1.0, -2.0, 0.125])
+        empty = messages.create(conversation=conversation, content='b', sender='user', embedding=[])
+        plain = messages.create(conversation=conversation, content='c', sender='user')
+
+        apps = self.migrate(self.after)
+        messages = apps.get_model('api', 'Message').objects
+        np.testing.assert_array_equal(messages.get(id=embedded.id).embedding, [1.0, -2.0, 0.125])
+        self.assertIsNone(messages.get(id=empty.id).embedding)
+        self.assertIsNone(messages.get(id=plain.id).embedding)
+        np.testing.assert_array_equal(
+            apps.get_model('api', 'Conversation').objects.get(id=conversation.id).embedding, [0.5, 0.25]
+        )
+
+        apps = self.migrate(self.before)
+        messages = apps.get_model('api', 'Message').objects
+        self.assertEqual(messages.get(id=embedded.id).embedding, [1.0, -2.0, 0.125])
+        self.assertIsNone(messages.get(id=plain.id).embedding)
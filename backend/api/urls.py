@@ -3,7 +3,7 @@ URL routing for API endpoints
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ConversationViewSet, MessageViewSet
+from .views import ConversationViewSet, MessageViewSet, ai_stats, ai_ready
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
@@ -11,5 +11,7 @@ router.register(r'messages', MessageViewSet, basename='message')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('ai/stats/', ai_stats, name='ai-stats'),
+    path('ai/ready/', ai_ready, name='ai-ready'),
 ]
 
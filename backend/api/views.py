@@ -5,11 +5,11 @@ import json
 import secrets
 from datetime import datetime, timedelta
 from django.utils import timezone
-from django.db.models import Q, Count
+from django.db.models import Case, Count, IntegerField, Q, When
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from .models import Conversation, Message, ConversationAnalysis
@@ -18,17 +18,29 @@ from .serializers import (
     MessageSerializer, MessageCreateSerializer, ConversationQuerySerializer,
     ConversationExportSerializer, ConversationAnalysisSerializer
 )
-from ai_service.conversation_analyzer import ConversationAnalyzer
+from ai_service.analysis_pipeline import request_analysis, get_analysis_stats
+from ai_service.rolling_summary import schedule_summary_update
 from ai_service.query_processor import QueryProcessor
-from ai_service.semantic_search import SemanticSearch
-from ai_service.embedding_service import get_embedding_service
-import markdown
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from ai_service.semantic_search import SemanticSearch, SEARCH_MODES
+from ai_service.embedding_service import (
+    get_embedding_service, get_embedding_cache_stats, get_embedding_batcher_stats
+)
+from ai_service.inference_scheduler import get_inference_scheduler
+from ai_service.llm_client import forget_conversation, get_llm_stats
+from ai_service.completion_cache import get_completion_cache
+from ai_service.vector_index import get_vector_index_stats, index_message, remove_messages
+from ai_service.conversation_embeddings import refresh_conversation_embedding, remove_conversation_embedding
+from ai_service.warmup import get_readiness
+from ai_service.lexical_index import (
+    get_lexical_index, get_lexical_index_stats, index_message_text, reindex_conversation, tokenize
+)
 from io import BytesIO
 
 
+# Conversations the list endpoint's `search` returns at most, best matches first
+LIST_SEARCH_LIMIT = 1000
+
+
 class ConversationViewSet(viewsets.ModelViewSet):
     """ViewSet for Conversation model"""
     queryset = Conversation.objects.all()
@@ -51,9 +63,21 @@ class ConversationViewSet(viewsets.ModelViewSet):
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         
-        # Search by title or summary
+        # Search titles, summaries and messages; best matches first
         search = self.request.query_params.get('search', None)
-        if search:
+        if search and tokenize(search):
+            hits = get_lexical_index().search(
+                search, k=LIST_SEARCH_LIMIT, require_all=True, prefix=True
+            )
+            if hits:
+                ranks = [When(id=conversation_id, then=rank) for rank, (conversation_id, _) in enumerate(hits)]
+                queryset = queryset.filter(id__in=[conversation_id for conversation_id, _ in hits]).order_by(
+                    Case(*ranks, output_field=IntegerField())
+                )
+            else:
+                queryset = queryset.none()
+        elif search:
+            # Only stopwords or single letters, nothing indexed to look up
             queryset = queryset.filter(
                 Q(title__icontains=search) | Q(summary__icontains=search)
             )
@@ -80,9 +104,23 @@ class ConversationViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
     
+    def perform_update(self, serializer):
+        conversation = serializer.save()
+        if conversation.status == 'ended' and 'summary' in serializer.validated_data:
+            refresh_conversation_embedding(conversation)
+        if 'title' in serializer.validated_data or 'summary' in serializer.validated_data:
+            reindex_conversation(conversation.id)
+    
+    def perform_destroy(self, instance):
+        conversation_id = instance.id
+        instance.delete()
+        reindex_conversation(conversation_id)
+        remove_conversation_embedding(conversation_id)
+        remove_messages(conversation_id=conversation_id)
+    
     @action(detail=True, methods=['post'])
     def end(self, request, pk=None):
-        """End a conversation and generate summary"""
+        """End a conversation and queue its summary and analysis"""
         conversation = self.get_object()
         
         if conversation.status == 'ended':
@@ -95,29 +133,29 @@ class ConversationViewSet(viewsets.ModelViewSet):
         conversation.end_time = timezone.now()
         conversation.save()
         
-        # Generate summary and analysis
-        try:
-            analyzer = ConversationAnalyzer()
-            analysis_data = analyzer.analyze_conversation(conversation)
-            
-            conversation.summary = analysis_data['summary']
-            conversation.save()
-            
-            # Create or update analysis
-            analysis, created = ConversationAnalysis.objects.get_or_create(
-                conversation=conversation
+        # No more chat turns, release the cached model state
+        forget_conversation(str(conversation.id))
+        
+        # Summary and analysis run in the background; clients get an
+        # analysis_complete WebSocket event when they are ready
+        request_analysis(conversation)
+        
+        return Response(ConversationSerializer(conversation).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['post'])
+    def analyze(self, request, pk=None):
+        """Queue (re-)analysis of an ended conversation, e.g. after it failed"""
+        conversation = self.get_object()
+        
+        if conversation.status != 'ended':
+            return Response(
+                {'error': 'Conversation has not ended'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            analysis.sentiment = analysis_data['sentiment']
-            analysis.topics = analysis_data['topics']
-            analysis.action_items = analysis_data['action_items']
-            analysis.key_points = analysis_data['key_points']
-            analysis.save()
-            
-        except Exception as e:
-            print(f"Error generating analysis: {e}")
-            # Still end conversation even if analysis fails
         
-        return Response(ConversationSerializer(conversation).data)
+        force = str(request.data.get('force', '')).lower() in ('1', 'true')
+        analysis_status = request_analysis(conversation, force=force)
+        return Response({'analysis_status': analysis_status}, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'])
     def messages(self, request, pk=None):
@@ -138,9 +176,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
             embedding = embedding_service.generate_embedding(message.content)
             if embedding:
                 message.embedding = embedding
-                message.save(update_fields=['embedding'])
+                message.embedding_updated_at = timezone.now()
+                message.save(update_fields=['embedding', 'embedding_updated_at'])
+                index_message(message)
         except Exception as e:
             print(f"Error generating embedding: {e}")
+        index_message_text(message)
+        
+        schedule_summary_update(str(conversation.id))
         
         return Response(
             MessageSerializer(message).data,
@@ -174,7 +217,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def search(self, request):
-        """Semantic search conversations"""
+        """Search conversations by keywords, meaning or both (mode=lexical|semantic|hybrid)"""
         query = request.query_params.get('q', '')
         if not query:
             return Response(
@@ -183,15 +226,23 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
         
         limit = int(request.query_params.get('limit', 10))
+        mode = request.query_params.get('mode', 'hybrid')
+        if mode not in SEARCH_MODES:
+            return Response(
+                {'error': f'mode must be one of: {", ".join(SEARCH_MODES)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         try:
             semantic_search = SemanticSearch()
-            results = semantic_search.search_conversations(query, limit=limit)
+            results = semantic_search.hybrid_search_conversations(query, limit=limit, mode=mode)
             
             serialized_results = []
             for result in results:
                 conv_data = ConversationListSerializer(result['conversation']).data
+                conv_data['score'] = result['score']
                 conv_data['similarity_score'] = result['similarity']
+                conv_data['lexical_score'] = result['lexical_score']
                 serialized_results.append(conv_data)
             
             return Response({'results': serialized_results})
@@ -240,6 +291,11 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return response
         
         elif export_format == 'pdf':
+            # reportlab is only needed here, keep it out of server startup
+            from reportlab.lib.pagesizes import letter
+            from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+            from reportlab.lib.styles import getSampleStyleSheet
+            
             buffer = BytesIO()
             doc = SimpleDocTemplate(buffer, pagesize=letter)
             styles = getSampleStyleSheet()
@@ -388,6 +444,20 @@ class MessageViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(conversation_id=conversation_id)
         return queryset.order_by('timestamp')
     
+    def perform_update(self, serializer):
+        message = serializer.save()
+        if 'content' in serializer.validated_data:
+            # Other processes re-read conversations whose updated_at changed
+            Conversation.objects.filter(id=message.conversation_id).update(updated_at=timezone.now())
+            reindex_conversation(message.conversation_id)
+    
+    def perform_destroy(self, instance):
+        conversation_id, message_id = instance.conversation_id, instance.id
+        instance.delete()
+        Conversation.objects.filter(id=conversation_id).update(updated_at=timezone.now())
+        reindex_conversation(conversation_id)
+        remove_messages([message_id])
+    
     @action(detail=True, methods=['post'])
     def react(self, request, pk=None):
         """Add reaction to message"""
@@ -410,3 +480,30 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         return Response(MessageSerializer(message).data)
 
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def ai_stats(request):
+    """Get AI service runtime statistics"""
+    completion_cache = get_completion_cache()
+    return Response({
+        'inference_queue': get_inference_scheduler().stats(),
+        'llm': get_llm_stats(),
+        'completion_cache': completion_cache.stats() if completion_cache else None,
+        'analysis': get_analysis_stats(),
+        'vector_index': get_vector_index_stats(),
+        'embedding_cache': get_embedding_cache_stats(),
+        'embedding_batcher': get_embedding_batcher_stats(),
+        'lexical_index': get_lexical_index_stats(),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def ai_ready(request):
+    """Readiness probe: 503 until the startup warm-up has finished"""
+    readiness = get_readiness()
+    return Response(
+        readiness,
+        status=status.HTTP_200_OK if readiness['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
@@ -21,6 +21,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chat_portal.settings")
 django_asgi_app = get_asgi_application()
 
 from websocket import routing
+from ai_service.warmup import start_warm_up
+
+# Load the embedding model and search indexes before the first request
+# needs them; /api/ai/ready/ reports when this is done
+start_warm_up()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
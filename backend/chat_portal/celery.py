@@ -0,0 +1,13 @@
+"""
+Celery application for background analysis (ANALYSIS_BACKEND=celery)
+
+Start a worker with: celery -A chat_portal worker -l info
+"""
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_portal.settings')
+
+app = Celery('chat_portal')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
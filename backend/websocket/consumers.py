@@ -3,11 +3,24 @@ WebSocket consumers for real-time chat
 """
 import json
 import re
+import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from asgiref.sync import sync_to_async
+from django.utils import timezone
 from api.models import Conversation, Message
 from ai_service.llm_client import get_llm_client
 from ai_service.embedding_service import get_embedding_service
+from ai_service.context_builder import ContextBuilder
+from ai_service.rolling_summary import schedule_summary_update
+from ai_service.vector_index import index_message
+from ai_service.lexical_index import index_message_text, reindex_conversation
+
+
+SYSTEM_PROMPT = "You are a helpful AI assistant. Continue the conversation naturally."
+
+# Tokens reserved for the reply
+MAX_RESPONSE_TOKENS = 512
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -100,28 +113,37 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
         
         # Generate AI response with streaming
-        await self.generate_ai_response(conversation, user_message)
+        await self.generate_ai_response(conversation, user_msg)
     
-    async def generate_ai_response(self, conversation, user_message):
+    async def generate_ai_response(self, conversation, user_msg):
         """Generate and stream AI response"""
-        # Build conversation context
-        messages = await self.get_conversation_messages(conversation)
-        context = await self.build_context(messages)
+        user_message = user_msg.content
         
-        # Get LLM client
-        llm_client = get_llm_client()
+        # Get LLM client (first call may load the model, keep it off the event loop)
+        llm_client = await sync_to_async(get_llm_client, thread_sensitive=False)()
         
-        # Build prompt
-        prompt = f"""You are a helpful AI assistant. Continue the conversation naturally.
-
-{context}
-
-User: {user_message}
-Assistant:"""
+        # Build conversation context from the history before this message;
+        # earlier turns use the same labels as the new turn so the previous
+        # prompt plus its reply is a prefix of this one
+        messages = await self.get_conversation_messages(conversation)
+        history = [msg for msg in messages if msg.id != user_msg.id]
+        header = f"{SYSTEM_PROMPT}\n\n"
+        # A message too long for the context window shortens the reply, then itself
+        builder = ContextBuilder(llm_client)
+        turn_text, max_tokens = await sync_to_async(builder.fit_turn, thread_sensitive=False)(
+            header + "User: \nAssistant:", user_message, MAX_RESPONSE_TOKENS
+        )
+        footer = f"User: {turn_text}\nAssistant:"
+        context = await self.build_context(history, builder, header + footer, max_tokens)
+        
+        if context:
+            context += "\n"
+        prompt = f"{header}{context}{footer}"
         
         # Create AI message placeholder
         ai_message = await self.create_ai_message(conversation, "")
         full_response = ""
+        response_saved = False
         
         try:
             # Stream response
@@ -135,7 +157,21 @@ Assistant:"""
             current_thinking = ""
             visible_response = ""
             
-            for token in llm_client.stream(prompt, max_tokens=512, temperature=0.7):
+            async def send_queue_position(position):
+                await self.send(text_data=json.dumps({
+                    'type': 'queue_position',
+                    'message_id': str(ai_message.id),
+                    'position': position
+                }))
+            
+            async for token in llm_client.astream(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=0.7,
+                conversation_id=str(conversation.id),
+                on_queue_position=send_queue_position,
+                keep_state=True
+            ):
                 full_response += token
                 
                 # Check for thinking tokens
@@ -190,13 +226,17 @@ Assistant:"""
             cleaned_response = cleaned_response.strip()
             
             # Update message with cleaned response (without thinking tokens)
-            await self.update_message(ai_message, cleaned_response)
+            await self.save_response(ai_message, cleaned_response)
+            response_saved = True
             
-            # Generate embedding (use cleaned response without thinking)
-            embedding_service = get_embedding_service()
-            embedding = embedding_service.generate_embedding(cleaned_response)
-            if embedding:
-                await self.update_message_embedding(ai_message, embedding)
+            # Embed the user message and the cleaned response (without thinking);
+            # both join the batches of concurrent requests from other connections
+            embedding_service = await sync_to_async(get_embedding_service, thread_sensitive=False)()
+            embeddings = await asyncio.gather(
+                embedding_service.agenerate_embedding(user_message),
+                embedding_service.agenerate_embedding(cleaned_response)
+            )
+            await self.update_message_embeddings(list(zip([user_msg, ai_message], embeddings)))
             
             # Send completion with cleaned response
             await self.send(text_data=json.dumps({
@@ -210,25 +250,26 @@ Assistant:"""
                 }
             }))
             
+            # Keep chunk summaries current so ending a long conversation is cheap
+            schedule_summary_update(str(conversation.id))
+            
         except Exception as e:
             error_msg = f"Error generating response: {str(e)}"
-            await self.update_message(ai_message, error_msg)
+            # Only finished responses are added to the lexical index
+            await self.update_message(ai_message, error_msg, reindex=response_saved)
             await self.send(text_data=json.dumps({
                 'type': 'error',
                 'message': error_msg
             }))
     
-    async def build_context(self, messages):
-        """Build conversation context from messages"""
+    async def build_context(self, messages, builder, fixed_text, max_tokens):
+        """Build conversation context from as many recent messages as the context window allows"""
         if not messages:
             return ""
         
-        context_parts = []
-        # Use last 10 messages for context
-        for msg in messages[-10:]:
-            context_parts.append(f"{msg.sender.upper()}: {msg.content}")
-        
-        return "\n".join(context_parts)
+        return await sync_to_async(builder.build, thread_sensitive=False)(
+            messages, fixed_text, max_tokens
+        )
     
     async def typing_indicator(self, event):
         """Handle typing indicator broadcast"""
@@ -237,6 +278,15 @@ Assistant:"""
             'is_typing': event['is_typing']
         }))
     
+    async def analysis_complete(self, event):
+        """Handle background analysis completion broadcast"""
+        await self.send(text_data=json.dumps({
+            'type': 'analysis_complete',
+            'conversation_id': event['conversation_id'],
+            'status': event['status'],
+            'summary': event['summary']
+        }))
+    
     @database_sync_to_async
     def get_conversation(self):
         """Get conversation from database"""
@@ -253,11 +303,13 @@ Assistant:"""
     @database_sync_to_async
     def save_message(self, conversation, content, sender):
         """Save message to database"""
-        return Message.objects.create(
+        message = Message.objects.create(
             conversation=conversation,
             content=content,
             sender=sender
         )
+        index_message_text(message)
+        return message
     
     @database_sync_to_async
     def create_ai_message(self, conversation, content):
@@ -269,16 +321,35 @@ Assistant:"""
         )
     
     @database_sync_to_async
-    def update_message(self, message, content):
+    def update_message(self, message, content, reindex=False):
         """Update message content"""
         message.content = content
         message.save(update_fields=['content'])
+        if reindex:
+            # Replaces a response already added to the lexical index
+            reindex_conversation(message.conversation_id)
         return message
     
     @database_sync_to_async
-    def update_message_embedding(self, message, embedding):
-        """Update message embedding"""
-        message.embedding = embedding
-        message.save(update_fields=['embedding'])
+    def save_response(self, message, content):
+        """Store the finished response and add it to the lexical index"""
+        message.content = content
+        message.save(update_fields=['content'])
+        # Placeholders are created empty, so this is the message's first text
+        index_message_text(message)
         return message
+    
+    @database_sync_to_async
+    def update_message_embeddings(self, pairs):
+        """Store (message, embedding) pairs and add them to the vector index"""
+        now = timezone.now()
+        messages = []
+        for message, embedding in pairs:
+            if embedding and message.content:
+                message.embedding = embedding
+                message.embedding_updated_at = now
+                messages.append(message)
+        Message.objects.bulk_update(messages, ['embedding', 'embedding_updated_at'])
+        for message in messages:
+            index_message(message)
 
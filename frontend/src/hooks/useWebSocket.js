@@ -6,6 +6,8 @@ export function useWebSocket(conversationId, onMessage) {
   const [currentMessage, setCurrentMessage] = useState(null)
   const [streamingTokens, setStreamingTokens] = useState('')
   const [currentThinking, setCurrentThinking] = useState([])
+  const [queuePosition, setQueuePosition] = useState(null)
+  const [analysisStatus, setAnalysisStatus] = useState(null)
   const onMessageRef = useRef(onMessage)
 
   useEffect(() => {
@@ -26,7 +28,13 @@ export function useWebSocket(conversationId, onMessage) {
         setCurrentMessage({ id: data.message_id, content: '', sender: 'ai', thinking: [] })
         setStreamingTokens('')
         setCurrentThinking([])
+        setQueuePosition(null)
+      } else if (data.type === 'analysis_complete') {
+        setAnalysisStatus(data.status)
+      } else if (data.type === 'queue_position') {
+        setQueuePosition(data.position)
       } else if (data.type === 'ai_message_token') {
+        setQueuePosition(null)
         setStreamingTokens(prev => prev + data.token)
       } else if (data.type === 'ai_thinking') {
         // Add thinking to current message
@@ -37,6 +45,7 @@ export function useWebSocket(conversationId, onMessage) {
           return newThinking
         })
       } else if (data.type === 'ai_message_complete') {
+        setQueuePosition(null)
         setCurrentMessage(prev => {
           const finalMessage = { ...data.message, thinking: prev?.thinking || [] }
           setStreamingTokens('')
@@ -75,6 +84,8 @@ export function useWebSocket(conversationId, onMessage) {
     currentMessage,
     streamingTokens,
     currentThinking,
+    queuePosition,
+    analysisStatus,
   }
 }
 
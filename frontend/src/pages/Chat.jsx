@@ -47,13 +47,21 @@ export default function Chat() {
     }
   }, [showMenu])
 
-  const { isConnected, sendMessage, currentMessage, streamingTokens } = useWebSocket(
+  const { isConnected, sendMessage, currentMessage, streamingTokens, queuePosition, analysisStatus } = useWebSocket(
     conversationId,
     (message) => {
       setMessages(prev => [...prev, message])
     }
   )
 
+  // Summary and analysis are generated in the background after ending
+  useEffect(() => {
+    if (analysisStatus && conversationId) {
+      loadConversation()
+      setSidebarRefresh(prev => prev + 1)
+    }
+  }, [analysisStatus])
+
   useEffect(() => {
     if (conversationId) {
       // Store current conversation ID
@@ -430,6 +438,20 @@ export default function Chat() {
                 </div>
               ))}
 
+              {/* Waiting for an inference slot */}
+              {currentMessage && !streamingTokens && queuePosition !== null && (
+                <div className="flex gap-4 justify-start">
+                  <div className="flex-shrink-0 w-8 h-8 rounded-full bg-gray-200 dark:bg-gray-700 flex items-center justify-center">
+                    <span className="text-sm font-semibold text-gray-600 dark:text-gray-300">AI</span>
+                  </div>
+                  <div className="rounded-2xl px-4 py-3 bg-gray-100 dark:bg-gray-800 text-sm text-gray-500 dark:text-gray-400">
+                    {queuePosition === 0
+                      ? 'Waiting for the model...'
+                      : `Waiting in queue (${queuePosition} ahead)...`}
+                  </div>
+                </div>
+              )}
+
               {/* Streaming message */}
               {currentMessage && streamingTokens && (
                 <div className="flex gap-4 justify-start">
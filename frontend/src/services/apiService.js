@@ -31,8 +31,8 @@ export const conversationService = {
   // Query past conversations
   query: (data) => api.post('/conversations/query/', data),
   
-  // Semantic search
-  search: (query, limit = 10) => api.get('/conversations/search/', { params: { q: query, limit } }),
+  // Search by keywords (lexical), meaning (semantic) or both (hybrid)
+  search: (query, limit = 10, mode = 'hybrid') => api.get('/conversations/search/', { params: { q: query, limit, mode } }),
   
   // Export conversation
   export: (id, format) => api.post(`/conversations/${id}/export/`, { format }, { responseType: 'blob' }),